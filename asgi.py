@@ -0,0 +1,127 @@
+# asgi.py - sidecar غير متزامن (ASGI) لـ JSON endpoints بتاعة التعدين والمهام
+# الصفحات HTML بتفضل على Flask، والـ nginx (deploy/nginx.conf.template) بيوجّه المسارات دي بس هنا:
+#   /mining_tick /start_mining /stop_mining /pending_tasks_count /tasks_status /complete_task/<condition>
+# التلاتة (nginx + gunicorn + uvicorn) بيشتغلوا في نفس الـ container من deploy/web.sh
+# عشان يشاركوا data.db و.locks
+# نفس كوكي الجلسة (secret_key والـ serializer بتوع Flask) ونفس طبقة التخزين ونفس دوال main
+# (*_result) → نفس الردود بالظبط
+#
+# كل اتصال coroutine على event loop واحد (آلاف الـ polls مفتوحة في عملية واحدة)،
+# وشغل التخزين (sync: SQLite/ملفات) بيتنفذ في pool threads محدود بدل thread لكل طلب
+#
+#   uvicorn asgi:app --port 5001   (لوحده للتجربة؛ في الـ deploy من deploy/web.sh)
+import asyncio, os
+from concurrent.futures import ThreadPoolExecutor
+
+from itsdangerous import BadSignature
+from werkzeug.http import parse_cookie
+
+import main
+import storage
+
+ASYNC_API_THREADS = int(os.environ.get("ASYNC_API_THREADS", "8"))
+
+ROUTES = {
+    "/mining_tick": main.mining_tick_result,
+    "/start_mining": main.start_mining_result,
+    "/stop_mining": main.stop_mining_result,
+    "/pending_tasks_count": main.pending_tasks_count_result,
+    "/tasks_status": main.tasks_status_result,
+}
+PREFIX_ROUTES = {
+    "/complete_task/": main.complete_task_result,
+}
+
+# نفس هيدرز الأمان اللي Flask بيحطها في add_security_headers
+HEADERS = [
+    (b"content-type", b"application/json"),
+    (b"x-content-type-options", b"nosniff"),
+    (b"x-frame-options", b"SAMEORIGIN"),
+    (b"referrer-policy", b"strict-origin-when-cross-origin"),
+]
+
+_serializer = main.app.session_interface.get_signing_serializer(main.app)
+_cookie_name = main.app.config["SESSION_COOKIE_NAME"]
+_max_age = int(main.app.permanent_session_lifetime.total_seconds())
+_pool = None
+
+
+def _executor():
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(ASYNC_API_THREADS, thread_name_prefix="async-api")
+    return _pool
+
+
+def session_user(scope):
+    # كوكي الجلسة بتاع Flask (موقّع مش مشفّر) → session['user']
+    for name, value in scope["headers"]:
+        if name == b"cookie":
+            cookie = parse_cookie(value.decode("latin-1")).get(_cookie_name)
+            if not cookie:
+                return None
+            try:
+                return _serializer.loads(cookie, max_age=_max_age).get("user")
+            except BadSignature:
+                return None
+    return None
+
+
+def resolve(path):
+    fn = ROUTES.get(path)
+    if fn is not None:
+        return fn, ()
+    for prefix, fn in PREFIX_ROUTES.items():
+        if path.startswith(prefix) and len(path) > len(prefix) and "/" not in path[len(prefix):]:
+            return fn, (path[len(prefix):],)
+    return None, ()
+
+
+def _call(fn, username, args):
+    # في thread من الـ pool: نفس اللي before_request بيعمله في Flask
+    storage.reset_op_counts()
+    main.db.sync()
+    result = fn(username, *args)
+    return result, storage.op_counts()
+
+
+async def _send_json(send, status, payload, ops=None, head=False):
+    body = main.app.json.dumps(payload, separators=(",", ":")).encode("utf-8") + b"\n"
+    headers = HEADERS + [(b"content-length", str(len(body)).encode())]
+    if ops is not None:
+        headers.append((b"x-storage-ops",
+                        f"reads={ops['reads']} writes={ops['writes']} commits={ops['commits']}".encode()))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": b"" if head else body})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+    fn, args = resolve(scope["path"])
+    if fn is None:
+        return await _send_json(send, 404, {"ok": False, "msg": "not found"})
+    if scope["method"] not in ("GET", "HEAD"):
+        return await _send_json(send, 405, {"ok": False, "msg": "method not allowed"})
+    loop = asyncio.get_running_loop()
+    try:
+        (payload, status), ops = await loop.run_in_executor(
+            _executor(), _call, fn, session_user(scope), args)
+    except Exception:
+        main.app.logger.exception("async api %s failed", scope["path"])
+        return await _send_json(send, 500, {"ok": False, "msg": "server error"})
+    await _send_json(send, status, payload, ops, head=scope["method"] == "HEAD")
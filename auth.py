@@ -0,0 +1,159 @@
+# auth.py - مسار تسجيل الدخول
+# 1) rate limit (sliding window) لكل اسم مستخدم ولكل IP قبل أي hashing
+# 2) تحقق scrypt في pool محدود عشان الـ hashing ما يخنقش threads الطلبات
+# 3) كاش قصير للتحققات الناجحة (نفس الهاش + نفس الباسورد) بدل scrypt كل مرة
+import collections, hashlib, hmac, ipaddress, os, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from werkzeug.security import check_password_hash
+
+LOGIN_WINDOW = int(os.environ.get("LOGIN_WINDOW", "300"))              # ثواني
+LOGIN_MAX_PER_USER = int(os.environ.get("LOGIN_MAX_PER_USER", "10"))   # محاولة في النافذة
+LOGIN_MAX_PER_IP = int(os.environ.get("LOGIN_MAX_PER_IP", "30"))
+HASH_WORKERS = int(os.environ.get("LOGIN_HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+HASH_QUEUE = int(os.environ.get("LOGIN_HASH_QUEUE", str(HASH_WORKERS * 4)))
+HASH_TIMEOUT = float(os.environ.get("LOGIN_HASH_TIMEOUT", "10"))
+VERIFY_CACHE_TTL = int(os.environ.get("LOGIN_VERIFY_CACHE_TTL", "300"))
+VERIFY_CACHE_SIZE = 10000
+
+
+class Busy(Exception):
+    # الـ pool مليان → الطلب يترفض بدل ما يستنى
+    pass
+
+
+class SlidingWindowLimiter:
+    # لكل مفتاح deque بأوقات المحاولات في آخر window ثانية
+    def __init__(self, limit, window, max_keys=100000):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._hits = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key, now=None):
+        # بترجع 0 لو المحاولة مسموحة (واتسجلت)، أو عدد الثواني للمحاولة الجاية
+        now = time.time() if now is None else now
+        with self._lock:
+            q = self._hits.get(key)
+            if q is None:
+                q = self._hits[key] = collections.deque()
+                if len(self._hits) > self.max_keys:
+                    self._hits.popitem(last=False)
+            else:
+                self._hits.move_to_end(key)
+            while q and q[0] <= now - self.window:
+                q.popleft()
+            if len(q) >= self.limit:
+                return int(q[0] + self.window - now) + 1
+            q.append(now)
+            return 0
+
+    def reset(self, key):
+        with self._lock:
+            self._hits.pop(key, None)
+
+
+user_limiter = SlidingWindowLimiter(LOGIN_MAX_PER_USER, LOGIN_WINDOW)
+ip_limiter = SlidingWindowLimiter(LOGIN_MAX_PER_IP, LOGIN_WINDOW)
+
+
+def _client_ip(ip):
+    # عنوان داخلي/loopback = غالبًا الـ proxy نفسه (PROXY_HOPS مش متظبط)، مش العميل:
+    # bucket واحد ليه كان بيقفل الدخول على كل المستخدمين مع بعض
+    try:
+        return ipaddress.ip_address(ip).is_global
+    except ValueError:
+        return False
+
+
+def check_rate(username, ip):
+    # الـ IP الأول: لو اتمنع ما نستهلكش من رصيد اسم المستخدم
+    if ip and _client_ip(ip):
+        retry = ip_limiter.hit(ip)
+        if retry:
+            return retry
+    return user_limiter.hit(username.strip().lower())
+
+
+def login_succeeded(username):
+    user_limiter.reset(username.strip().lower())
+
+
+# ---------- scrypt في pool محدود ----------
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(HASH_WORKERS + HASH_QUEUE)
+
+
+def _pool():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = _make_pool()
+        return _executor
+
+
+def _make_pool():
+    # مع gevent الـ threads العادية بتبقى greenlets؛ threadpool بتاع gevent بيستخدم threads حقيقية
+    try:
+        from gevent import monkey
+        if monkey.is_module_patched("threading"):
+            from gevent.threadpool import ThreadPoolExecutor as GeventPool
+            return GeventPool(HASH_WORKERS)
+    except ImportError:
+        pass
+    return ThreadPoolExecutor(HASH_WORKERS, thread_name_prefix="pwhash")
+
+
+# ---------- كاش التحقق ----------
+# المفتاح HMAC بسر عشوائي للعملية؛ الباسورد نفسه مش بيتخزن
+_cache_secret = os.urandom(32)
+_verified = collections.OrderedDict()
+_verified_lock = threading.Lock()
+
+
+def _cache_key(pwhash, password):
+    return hmac.new(_cache_secret, f"{pwhash}\0{password}".encode("utf-8"), hashlib.sha256).digest()
+
+
+def _cached(key, now):
+    with _verified_lock:
+        expires = _verified.get(key)
+        if expires is None:
+            return False
+        if expires < now:
+            del _verified[key]
+            return False
+        return True
+
+
+def _remember(key, now):
+    with _verified_lock:
+        _verified[key] = now + VERIFY_CACHE_TTL
+        _verified.move_to_end(key)
+        while len(_verified) > VERIFY_CACHE_SIZE:
+            _verified.popitem(last=False)
+
+
+def verify_password(pwhash, password):
+    now = time.time()
+    key = _cache_key(pwhash, password)
+    if VERIFY_CACHE_TTL > 0 and _cached(key, now):
+        return True
+    if not _slots.acquire(blocking=False):
+        raise Busy()
+    try:
+        future = _pool().submit(check_password_hash, pwhash, password)
+    except BaseException:
+        _slots.release()
+        raise
+    # الخانة بتتفك لما الـ hashing يخلص فعلًا، حتى لو الطلب زهق واستسلم
+    future.add_done_callback(lambda f: _slots.release())
+    try:
+        ok = future.result(HASH_TIMEOUT)
+    except (FutureTimeout, TimeoutError):
+        raise Busy()
+    if ok and VERIFY_CACHE_TTL > 0:
+        _remember(key, now)
+    return ok
@@ -0,0 +1,413 @@
+# benchmark.py - قياس أداء الـ endpoints الساخنة عشان نقارن قبل/بعد أي تعديل
+#
+#   python benchmark.py --users 10000 --requests 2000 --out before.json
+#   python benchmark.py --users 100000 --backend json --out json.json
+#   python benchmark.py --users 10000 --http --concurrency 32 --out http.json
+#
+# الخطوات: توليد users.json/items.json/tasks.json في مجلد مؤقت
+# ثم تشغيل القياس في عملية منفصلة (cwd = المجلد ده) عشان peak RSS يبقى نظيف
+# النتيجة JSON: p50/p95/p99 + throughput + bytes لكل طلب + peak RSS
+import argparse, json, os, random, re, resource, shutil, socket, subprocess, sys, tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import HTTPCookieProcessor, HTTPRedirectHandler, build_opener
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+PASSWORD = "bench-pass"
+ENDPOINTS = ["mining_tick", "dashboard", "login", "buy_item", "toggle_power", "tasks_status"]
+TIER_WEIGHTS = [40, 25, 14, 9, 6, 3, 2, 1]  # الأجهزة الرخيصة أكتر بكتير
+DEVICE_COUNTS = [0, 1, 1, 2, 2, 3, 3, 4, 5, 6, 8, 12, 20, 40]
+
+
+# ---------- توليد البيانات ----------
+def _tiers():
+    # الفئات من catalog، و DEFAULT_TASKS من main بدون فتح تخزين حقيقي: main بيتحمّل من مجلد فاضي بـ backend json
+    scratch = tempfile.mkdtemp(prefix="bench-scratch-")
+    cwd = os.getcwd()
+    os.environ.setdefault("STORAGE_BACKEND", "json")
+    os.chdir(scratch)
+    try:
+        sys.path.insert(0, REPO)
+        import catalog, main
+        tiers = [t._asdict() for t in catalog.TIERS]
+        return tiers, main.DEFAULT_TASKS, main.generate_password_hash(PASSWORD)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def generate(workdir, users, seed=0):
+    rng = random.Random(seed)
+    tiers, default_tasks, pw_hash = _tiers()
+    now = int(time.time())
+    created = datetime.now().isoformat()
+    names = [f"bench{n}" for n in range(users)]
+
+    def write_array(path, rows):
+        # كتابة متدفقة: مليون مستخدم من غير ما القائمة كلها تبقى في الذاكرة كنص واحد
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("[\n")
+            for n, row in enumerate(rows):
+                f.write((",\n" if n else "") + json.dumps(row, ensure_ascii=False))
+            f.write("\n]\n")
+
+    devices = {}
+
+    def user_rows():
+        for name in names:
+            owned = rng.choices(tiers, TIER_WEIGHTS, k=rng.choice(DEVICE_COUNTS))
+            mining = bool(owned) and rng.random() < 0.6
+            rate = 0.0
+            rows = []
+            for n, t in enumerate(owned):
+                on = mining and rng.random() < 0.8
+                rows.append({
+                    "owner": name, "store_id": t["id"], "name": t["name"], "price": t["price"],
+                    "created_at": created, "active": on, "power_on": on,
+                    "last_tick": now - rng.randrange(3600) if on else None,
+                    "sat_per_cycle": t["sat_per_cycle"], "interval": t["interval"],
+                    "id": f"{t['id']}_bench_{name}_{n}",
+                })
+                if on:
+                    rate += t["sat_per_cycle"] / t["interval"]
+            devices[name] = rows
+            sats = rng.randrange(10_000, 50_000_000)
+            xp = rng.randrange(0, 120_000)
+            yield {
+                "username": name, "password": pw_hash,
+                "balance": sats / 100_000_000, "balance_sats": sats,
+                "xp": xp, "rank": "مبتدأ", "currency": "bitcoin", "blocked": False,
+                "theme": "light", "created_at": created, "last_login": "",
+                "mining": mining, "mining_rate": rate, "mining_anchor": now, "mining_carry": 0.0,
+            }
+
+    write_array(os.path.join(workdir, "users.json"), user_rows())
+    write_array(os.path.join(workdir, "items.json"),
+                (row for name in names for row in devices.pop(name, [])))
+    with open(os.path.join(workdir, "tasks.json"), "w", encoding="utf-8") as f:
+        json.dump({}, f)
+    return default_tasks
+
+
+# ---------- القياس ----------
+def _io():
+    # rchar/wchar = كل البايتات اللي اتقرت/اتكتبت بـ syscalls (لينكس بس)
+    try:
+        with open("/proc/self/io") as f:
+            fields = dict(line.split(": ") for line in f.read().splitlines())
+        return int(fields["rchar"]), int(fields["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _peak_rss():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+def summarize(latencies, elapsed, sizes, statuses, io=None, ops=None):
+    lat = sorted(latencies)
+    n = len(lat)
+    out = {
+        "requests": n,
+        "throughput_rps": n / elapsed if elapsed else None,
+        "latency_ms": {
+            "p50": _percentile(lat, 50) * 1000 if n else None,
+            "p95": _percentile(lat, 95) * 1000 if n else None,
+            "p99": _percentile(lat, 99) * 1000 if n else None,
+            "mean": sum(lat) / n * 1000 if n else None,
+        },
+        "response_bytes": sum(sizes) / n if n else 0,
+        "status": {str(k): statuses.count(k) for k in sorted(set(statuses))},
+    }
+    if io:
+        out["io_read_bytes"] = io[0] / n if n else 0
+        out["io_write_bytes"] = io[1] / n if n else 0
+    if ops:
+        out["storage_ops"] = {k: v / n for k, v in ops.items()}
+    return out
+
+
+def _request_for(endpoint, name, items):
+    if endpoint == "login":
+        return "POST", "/login", {"username": name, "password": PASSWORD,
+                                  "captcha": "2", "captcha_real": "2"}
+    if endpoint == "buy_item":
+        return "GET", "/buy_item/1", None
+    if endpoint == "toggle_power":
+        owned = items.get(name)
+        return "GET", f"/toggle_power/{owned[0] if owned else 'missing'}", None
+    return "GET", f"/{endpoint}", None
+
+
+def _pool(endpoint, names, items):
+    # toggle_power محتاج مستخدمين عندهم أجهزة
+    if endpoint == "toggle_power":
+        return [n for n in names if items.get(n)] or names
+    return names
+
+
+def run_test_client(endpoints, requests, sample, seed):
+    # بيشتغل جوه المجلد المولّد (cwd) → main بيفتح البيانات دي
+    sys.path.insert(0, REPO)
+    started = time.perf_counter()
+    import main
+    load_time = time.perf_counter() - started
+    main.app.config["WTF_CSRF_ENABLED"] = False
+    client = main.app.test_client()
+    rng = random.Random(seed)
+
+    users = [u["username"] for u in main.db.load_users()]
+    names = rng.sample(users, min(sample, len(users)))
+    items = {}
+    for name in names:
+        items[name] = [i["id"] for i in main.db.items_by_owner(name)]
+
+    results = {}
+    for endpoint in endpoints:
+        latencies, sizes, statuses = [], [], []
+        ops = {"reads": 0, "writes": 0, "commits": 0}
+        pool = _pool(endpoint, names, items)
+        io_before = _io()
+        begin = time.perf_counter()
+        for n in range(requests):
+            name = pool[n % len(pool)]
+            method, path, form = _request_for(endpoint, name, items)
+            with client.session_transaction() as s:
+                s.clear()
+                if endpoint != "login":
+                    s["user"] = name
+            t0 = time.perf_counter()
+            resp = client.open(path, method=method, data=form)
+            body = resp.get_data()
+            latencies.append(time.perf_counter() - t0)
+            sizes.append(len(body))
+            statuses.append(resp.status_code)
+            header = resp.headers.get("X-Storage-Ops", "")
+            for part in header.split():
+                k, _, v = part.partition("=")
+                if k in ops and v.isdigit():
+                    ops[k] += int(v)
+        elapsed = time.perf_counter() - begin
+        io_after = _io()
+        io = (io_after[0] - io_before[0], io_after[1] - io_before[1]) if io_before and io_after else None
+        results[endpoint] = summarize(latencies, elapsed, sizes, statuses, io, ops)
+    return {"startup_seconds": load_time, "endpoints": results, "peak_rss_bytes": _peak_rss()}
+
+
+# ---------- HTTP driver (اختياري) ----------
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _server_rss(pid):
+    # VmHWM للسيرفر + أولاده (workers بتوع gunicorn)
+    total, pids = 0, [pid]
+    while pids:
+        p = pids.pop()
+        try:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        total += int(line.split()[1]) * 1024
+            with open(f"/proc/{p}/task/{p}/children") as f:
+                pids.extend(int(c) for c in f.read().split())
+        except OSError:
+            pass
+    return total or None
+
+
+def start_server(workdir, workers, env):
+    port = _free_port()
+    try:
+        import gunicorn  # noqa: F401
+        cmd = [sys.executable, "-m", "gunicorn", "-w", str(workers), "-b", f"127.0.0.1:{port}",
+               "--pythonpath", REPO, "main:app"]
+    except ImportError:
+        cmd = [sys.executable, "-c",
+               f"import main; main.app.run(host='127.0.0.1', port={port}, threaded=True)"]
+        env = dict(env, PYTHONPATH=REPO)
+    proc = subprocess.Popen(cmd, cwd=workdir, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("server exited during startup")
+        # /ready = 200 لما الكاش يسخن (القياس مش على worker بارد)
+        try:
+            status, _ = _open(_opener(), f"http://127.0.0.1:{port}/ready")
+        except OSError:
+            status = None
+        if status == 200:
+            return proc, f"http://127.0.0.1:{port}"
+        time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("server did not start")
+
+
+class _NoRedirect(HTTPRedirectHandler):
+    # نقيس الطلب نفسه مش الصفحة اللي بيحوّل عليها
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def _opener():
+    return build_opener(HTTPCookieProcessor(CookieJar()), _NoRedirect)
+
+
+def _open(opener, url, data=None):
+    try:
+        resp = opener.open(url, data)
+        return resp.status, resp.read()
+    except HTTPError as e:
+        return e.code, e.read()
+
+
+def _login_form(opener, base, form):
+    _, page = _open(opener, base + "/login")
+    token = re.search(r'name="csrf_token" value="([^"]+)"', page.decode("utf-8", "replace"))
+    return urlencode(dict(form, csrf_token=token.group(1) if token else "")).encode()
+
+
+def run_http(base, endpoints, requests, concurrency, names, items):
+    # كل worker بيسجل دخول بمستخدم مختلف مرة واحدة وبعدين بيلف على الطلبات
+    # مستخدمين عندهم أجهزة عشان toggle_power يلاقي جهاز يخصهم
+    owners = _pool("toggle_power", names, items)
+    sessions = []
+    for w in range(concurrency):
+        name, opener = owners[w % len(owners)], _opener()
+        _, _, form = _request_for("login", name, items)
+        _open(opener, base + "/login", _login_form(opener, base, form))
+        sessions.append((name, opener))
+
+    results = {}
+    lock = threading.Lock()
+    for endpoint in endpoints:
+        latencies, sizes, statuses = [], [], []
+        counter = iter(range(requests))
+
+        def worker(w):
+            name, opener = sessions[w]
+            for _ in counter:
+                method, path, form = _request_for(endpoint, name, items)
+                data = None
+                if form:
+                    # /login: جلسة جديدة + csrf_token (خارج التوقيت)
+                    opener = _opener()
+                    data = _login_form(opener, base, form)
+                t0 = time.perf_counter()
+                status, body = _open(opener, base + path, data)
+                dt = time.perf_counter() - t0
+                with lock:
+                    latencies.append(dt)
+                    sizes.append(len(body))
+                    statuses.append(status)
+
+        begin = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(worker, range(concurrency)))
+        results[endpoint] = summarize(latencies, time.perf_counter() - begin, sizes, statuses)
+    return results
+
+
+# ---------- CLI ----------
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="benchmark the hot endpoints")
+    ap.add_argument("--users", type=int, default=1000, help="1k → 1M")
+    ap.add_argument("--requests", type=int, default=1000, help="طلبات لكل endpoint")
+    ap.add_argument("--sample", type=int, default=200, help="عدد المستخدمين اللي بيتلف عليهم")
+    ap.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    ap.add_argument("--backend", choices=["sqlite", "json"], default=os.environ.get("STORAGE_BACKEND", "sqlite"))
+    ap.add_argument("--http", action="store_true", help="كمان شغّل سيرفر حقيقي وسوقه بطلبات متوازية")
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--workers", type=int, default=4, help="gunicorn workers للـ --http")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--keep", help="احتفظ بالبيانات المولدة في المجلد ده")
+    ap.add_argument("--out", help="ملف النتيجة (الافتراضي stdout)")
+    ap.add_argument("--run-in", help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+    endpoints = [e for e in args.endpoints.split(",") if e]
+
+    if args.run_in:
+        # العملية الابن: قياس الـ test client بس
+        os.chdir(args.run_in)
+        print(json.dumps(run_test_client(endpoints, args.requests, args.sample, args.seed)))
+        return
+
+    workdir = args.keep or tempfile.mkdtemp(prefix="bench-")
+    os.makedirs(workdir, exist_ok=True)
+    # كل طلبات القياس من نفس الـ IP → نرفع حدود /login عشان نقيس المسار مش الـ 429
+    env = dict({"LOGIN_MAX_PER_IP": "1000000000", "LOGIN_MAX_PER_USER": "1000000000"}, **os.environ)
+    # الـ test client بيقيس الحالة المستقرة: الكاش يتحمّل قبل أول طلب
+    env.update(STORAGE_BACKEND=args.backend, STORAGE_WARMUP="sync",
+               DB_FILE=os.path.join(workdir, "bench.db"), LOCK_DIR=os.path.join(workdir, ".locks"))
+    try:
+        t0 = time.perf_counter()
+        generate(workdir, args.users, args.seed)
+        report = {
+            "created_at": datetime.now().isoformat(),
+            "config": {k: v for k, v in vars(args).items() if k not in ("run_in", "out")},
+            "generate_seconds": time.perf_counter() - t0,
+        }
+        # نسخة نظيفة من البيانات للـ HTTP driver (الـ test client بيعدّل فيها)
+        if args.http:
+            http_dir = os.path.join(workdir, "http")
+            os.makedirs(http_dir, exist_ok=True)
+            for f in ("users.json", "items.json", "tasks.json"):
+                shutil.copy(os.path.join(workdir, f), http_dir)
+
+        child = subprocess.run([sys.executable, os.path.abspath(__file__), "--run-in", workdir,
+                                "--requests", str(args.requests), "--sample", str(args.sample),
+                                "--endpoints", ",".join(endpoints), "--seed", str(args.seed)],
+                               env=env, capture_output=True, text=True)
+        if child.returncode != 0:
+            sys.stderr.write(child.stderr)
+            raise SystemExit("benchmark run failed")
+        report["test_client"] = json.loads(child.stdout.strip().splitlines()[-1])
+
+        if args.http:
+            http_env = dict(env, STORAGE_WARMUP="background", DB_FILE=os.path.join(http_dir, "bench.db"),
+                            LOCK_DIR=os.path.join(http_dir, ".locks"))
+            with open(os.path.join(http_dir, "users.json"), encoding="utf-8") as f:
+                names = [u["username"] for u in json.load(f)]
+            with open(os.path.join(http_dir, "items.json"), encoding="utf-8") as f:
+                items = {}
+                for i in json.load(f):
+                    items.setdefault(i["owner"], []).append(i["id"])
+            names = random.Random(args.seed).sample(names, min(args.sample, len(names)))
+            proc, base = start_server(http_dir, args.workers, http_env)
+            try:
+                report["http"] = {
+                    "concurrency": args.concurrency,
+                    "endpoints": run_http(base, endpoints, args.requests, args.concurrency, names, items),
+                    "server_peak_rss_bytes": _server_rss(proc.pid),
+                }
+            finally:
+                proc.terminate()
+                proc.wait(timeout=30)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, indent=4, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# catalog.py - أجهزة المتجر وتعريفات المهام
+# STORE_ITEMS هي البيانات الأصلية (مفاتيح sat_per_30s / sat_per_26s ... مختلفة لكل فئة)
+# وبتتحول مرة واحدة وقت الاستيراد لسجلات Tier ثابتة، مفهرسة بالـ id
+from typing import NamedTuple
+
+from models import store_rate
+from storage import SATS_PER_BTC
+
+STORE_ITEMS = [
+    {"id":1,"name":"Antinminer s19","price":0.00000012,"sat_per_30s":6,"interval":30},
+    {"id":2,"name":"Antinminer s19j","price":0.00000050,"sat_per_26s":8,"interval":26},
+    {"id":3,"name":"Antinminer s19pro","price":0.00001000,"sat_per_22s":13,"interval":22},
+    {"id":4,"name":"Antinminer s19j pro","price":0.00009000,"sat_per_19s":15,"interval":19},
+    {"id":5,"name":"Antinminer s21","price":0.00050000,"sat_per_15s":20,"interval":15},
+    {"id":6,"name":"Antinminer s21 pro","price":0.00090000,"sat_per_11s":26,"interval":11},
+    {"id":7,"name":"Antinminer s23 hydro","price":0.001,"sat_per_8s":30,"interval":8},
+    {"id":8,"name":"Antinminer s23 pro hydro","price":0.05,"sat_per_4s":40,"interval":4},
+]
+
+
+class Tier(NamedTuple):
+    id: int
+    name: str
+    price: float          # BTC زي ما هو في STORE_ITEMS
+    price_sats: int
+    sat_per_cycle: int
+    interval: int         # ثواني
+    sats_per_hour: float
+    roi_hours: float      # ساعات تعدين لحد ما الجهاز يرجّع تمنه (inf لو مش بينتج)
+
+
+def _tier(item):
+    sat, interval = store_rate(item)
+    price_sats = int(round(float(item["price"]) * SATS_PER_BTC))
+    per_hour = sat * 3600 / interval
+    return Tier(id=int(item["id"]), name=item["name"], price=float(item["price"]),
+                price_sats=price_sats, sat_per_cycle=sat, interval=interval,
+                sats_per_hour=per_hour,
+                roi_hours=price_sats / per_hour if per_hour else float("inf"))
+
+
+TIERS = tuple(_tier(i) for i in STORE_ITEMS)
+_BY_ID = {t.id: t for t in TIERS}
+
+
+def tier(tier_id):
+    return _BY_ID.get(tier_id)
+
+
+# ---------- المهام ----------
+# التعريفات متخزنة هنا مرة واحدة لكل المستخدمين، والمستخدم بيخزن bitset بالـ slot
+# الـ slot ثابت: تعديل عنوان أو مكافأة بيسري على الكل من غير ما نلمس بياناتهم
+# مهمة جديدة = slot جديد (وTASKS_VERSION+1)، ومهمة اتشالت ما يتعادش استخدام الـ slot بتاعها
+TASKS_VERSION = 1
+
+DEFAULT_TASKS = [
+    {"slot": 0, "title": "أول تسجيل الدخول", "reward": 0.00000006, "type":"btc", "condition":"first_login"},
+    {"slot": 1, "title": "اشتري ثلاثة أجهزة", "reward": 0.00000020, "type":"btc", "condition":"buy_3_items"},
+    {"slot": 2, "title": "اشتري خمسة أجهزة", "reward": 0.00000100, "type":"btc", "condition":"buy_5_items"},
+    {"slot": 3, "title": "اشتري عشرة أجهزة", "reward": 0.00000175, "type":"btc", "condition":"buy_10_items"},
+    {"slot": 4, "title": "اشتري عشرون جهاز", "reward": 0.00000250, "type":"btc", "condition":"buy_20_items"},
+    {"slot": 5, "title": "اشتري ثلاثون جهاز", "reward": 0.00000325, "type":"btc", "condition":"buy_30_items"},
+    {"slot": 6, "title": "اشتري خمسون جهاز", "reward": 0.00000500, "type":"btc", "condition":"buy_50_items"},
+    {"slot": 7, "title": "اشتري مائة جهاز", "reward": 0.00001000, "type":"btc", "condition":"buy_100_items"},
+    {"slot": 8, "title": "سجل الدخول يوميا لمدة أسبوع", "reward": 900, "type":"xp", "condition":"login_7_days"},
+    {"slot": 9, "title": "سجل الدخول يوميا لمدة شهر", "reward": 5000, "type":"xp", "condition":"login_30_days"},
+]
+
+
+class TaskDef(NamedTuple):
+    slot: int
+    title: str
+    reward: float
+    type: str              # btc / xp / daily
+    condition: str
+
+
+TASKS = tuple(TaskDef(**t) for t in DEFAULT_TASKS)
+_TASK_BY_CONDITION = {t.condition: t for t in TASKS}
+assert len({t.slot for t in TASKS}) == len(TASKS), "task slots must be unique"
+
+
+def task_for(condition):
+    return _TASK_BY_CONDITION.get(condition)
@@ -0,0 +1,27 @@
+#!/usr/bin/env bash
+# web.sh - الـ web dyno/container كله: gunicorn (Flask) + uvicorn (asgi.py) + nginx قدامهم على $PORT
+# في نفس الـ container عشان التلاتة يشوفوا نفس data.db و.locks (process types منفصلة ما بتشاركش ملفات)
+# محتاج nginx و envsubst في الـ image (على Heroku: heroku-community/nginx buildpack)
+PORT=${PORT:-5000}
+FLASK_PORT=${FLASK_PORT:-5002}
+API_PORT=${API_PORT:-5001}
+export PORT FLASK_PORT API_PORT
+
+# nginx hop زيادة قدام الـ app (+ router الـ platform لو موجود)
+if [ -z "$PROXY_HOPS" ]; then
+    if [ -n "$DYNO" ]; then PROXY_HOPS=2; else PROXY_HOPS=1; fi
+fi
+export PROXY_HOPS
+
+envsubst '${PORT} ${FLASK_PORT} ${API_PORT}' < deploy/nginx.conf.template > /tmp/nginx.conf || exit 1
+
+gunicorn -k gevent -w "${WEB_CONCURRENCY:-4}" --worker-connections "${WORKER_CONNECTIONS:-1000}" \
+    -b "127.0.0.1:$FLASK_PORT" main:app &
+uvicorn asgi:app --host 127.0.0.1 --port "$API_PORT" &
+nginx -c /tmp/nginx.conf &
+
+# أي واحد فيهم يقع → الـ container كله يقع والـ platform يعيد تشغيله
+wait -n
+status=$?
+kill 0
+exit $status
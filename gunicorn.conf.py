@@ -0,0 +1,11 @@
+# gunicorn.conf.py - gunicorn بيقراه لوحده من المجلد الحالي
+import os
+
+
+def post_worker_init(worker):
+    # الـ scheduler بيشتغل جوه الـ web عشان يشوف نفس data.db و.locks (الـ process types
+    # على Heroku وأمثاله كل واحد في container لوحده). كل worker بيبدأ thread، وقفل
+    # scheduler.lock بيخلي واحد بس هو اللي بيسوّي
+    if os.environ.get("MINING_SCHEDULER", "1") == "1":
+        import main
+        main.start_mining_scheduler()
@@ -1,9 +1,21 @@
 # main.py - High Security Version 🚀
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, make_response, flash
-import json, os, random, time
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, make_response, flash, Response, stream_with_context, g, has_request_context
+import base64, csv, hashlib, heapq, io, json, os, random, threading, time
+import click
+from contextlib import contextmanager, nullcontext
 from datetime import datetime, timedelta
+from functools import wraps
 #import bcrypt
 from flask_wtf import CSRFProtect
+from flask_wtf.csrf import generate_csrf
+from werkzeug.security import generate_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
+import storage
+from models import Item, TaskState
+import catalog
+import metrics
+import auth
+import pagecache
 
 app = Flask(__name__)
 
@@ -12,11 +24,21 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = os.urandom(32) 
 app.secret_key = "any_strong_fallback_key"
 
+# خلف reverse proxy (Heroku/nginx): عدد الـ proxies عشان request.remote_addr يبقى IP العميل
+# على Heroku (DYNO موجود) فيه router واحد قدام الـ app → الافتراضي 1
+# (deploy/web.sh بيظبطه لوحده: nginx بيزود hop كمان)
+PROXY_HOPS = int(os.environ.get("PROXY_HOPS", "1" if "DYNO" in os.environ else "0"))
+if PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS, x_proto=PROXY_HOPS)
+
 # مسارات ملفات البيانات
 USERS_FILE = "users.json"
 ITEMS_FILE = "items.json"
 TASKS_FILE = "tasks.json"
 
+# طبقة التخزين (SQLite افتراضيًا - راجع storage.py)
+db = storage.open_storage(USERS_FILE, ITEMS_FILE, TASKS_FILE)
+
 # تفعيل حماية CSRF
 csrf = CSRFProtect(app)
 
@@ -44,6 +66,35 @@ def add_security_headers(response):
     response.headers['Referrer-Policy'] = 'strict-origin-when-cross-origin'
     return response
 
+# --- عداد عمليات التخزين لكل طلب (بيظهر في الهيدر X-Storage-Ops) ---
+@app.before_request
+def reset_storage_ops():
+    storage.reset_op_counts()
+    # الصفحة الرئيسية وعدد المستخدمين من الرقم المحفوظ (user_count) من غير تخزين
+    if request.endpoint in STORAGELESS_ENDPOINTS:
+        return
+    # نلحق تعديلات الـ workers التانية قبل أي قراءة من الكاش
+    db.sync()
+
+@app.after_request
+def add_storage_ops_header(response):
+    ops = storage.op_counts()
+    response.headers['X-Storage-Ops'] = f"reads={ops['reads']} writes={ops['writes']} commits={ops['commits']}"
+    return response
+
+# --- قياسات اختيارية لكل endpoint (METRICS=1) - راجع metrics.py ---
+if metrics.METRICS:
+    metrics.install(app, storage)
+
+# لوحة المتصدرين (الأدمن مش بيظهر فيها)
+LEADERBOARD_SIZE = 50
+LEADERBOARD_EXCLUDE = ("gatapro901",)
+
+# عدد المستخدمين في الصفحة الرئيسية: بيتقري من عداد التخزين مرة كل USER_COUNT_TTL ثانية
+# لكل عملية، ونفس المدة Cache-Control على /api/user_count (الصفحة بتسأل كل ثانيتين)
+USER_COUNT_TTL = int(os.environ.get("USER_COUNT_TTL", "5"))
+STORAGELESS_ENDPOINTS = ("welcome", "api_user_count", "static")
+
 # ثابت أمان تسجيل الدخول
 MAX_FAILED_ATTEMPTS = 5
 LOCK_DURATION_MINUTES = 5
@@ -51,156 +102,238 @@ LOCK_DURATION_MINUTES = 5
 # --- بداية الأكواد والوظائف (الـ Routes) ---
 
 # ---------- Helper functions ----------
-# المهام الافتراضية
-DEFAULT_TASKS = [
-    {"title": "أول تسجيل الدخول", "reward": 0.00000006, "type":"btc", "condition":"first_login"},
-    {"title": "اشتري ثلاثة أجهزة", "reward": 0.00000020, "type":"btc", "condition":"buy_3_items"},
-    {"title": "اشتري خمسة أجهزة", "reward": 0.00000100, "type":"btc", "condition":"buy_5_items"},
-    {"title": "اشتري عشرة أجهزة", "reward": 0.00000175, "type":"btc", "condition":"buy_10_items"},
-    {"title": "اشتري عشرون جهاز", "reward": 0.00000250, "type":"btc", "condition":"buy_20_items"},
-    {"title": "اشتري ثلاثون جهاز", "reward": 0.00000325, "type":"btc", "condition":"buy_30_items"},
-    {"title": "اشتري خمسون جهاز", "reward": 0.00000500, "type":"btc", "condition":"buy_50_items"},
-    {"title": "اشتري مائة جهاز", "reward": 0.00001000, "type":"btc", "condition":"buy_100_items"},
-    {"title": "سجل الدخول يوميا لمدة أسبوع", "reward": 900, "type":"xp", "condition":"login_7_days"},
-    {"title": "سجل الدخول يوميا لمدة شهر", "reward": 5000, "type":"xp", "condition":"login_30_days"},
-]
+# المهام الافتراضية: التعريفات في catalog (slot ثابت لكل مهمة)
+DEFAULT_TASKS = catalog.DEFAULT_TASKS
 
 def load_tasks():
-    if not os.path.exists(TASKS_FILE):
-        with open(TASKS_FILE, "w", encoding="utf-8") as f:
-            json.dump({}, f, indent=4, ensure_ascii=False)
-
-    try:
-        with open(TASKS_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-            # لو الملف اتحول لقائمة بالغلط → نصلحه
-            if isinstance(data, list):
-                return {}
-
-            return data
-    except:
-        return {}
+    return db.load_tasks()
 
 def save_tasks(tasks):
-    with open(TASKS_FILE, "w", encoding="utf-8") as f:
-        json.dump(tasks, f, indent=4, ensure_ascii=False)
-# تعطي المستخدم مهامه الافتراضية لو جديد
-def get_user_tasks(username):
-    tasks_data = load_tasks()
-
-    username = username.strip().lower()  # توحيد الاسم للحروف الصغيرة
-
-    if username not in tasks_data:
-        # نسخ المهام الافتراضية
-        tasks_data[username] = []
-        for t in DEFAULT_TASKS:
-            tasks_data[username].append({
-                "title": t["title"],
-                "reward": float(t["reward"]),  # لتكون 0.00000000
-                "type": t["type"],
-                "condition": t["condition"],
-                "completed": False
-            })
-        save_tasks(tasks_data)
-
-    # تأكد إن كل مهمة عندها completed
-    for t in tasks_data[username]:
-        if "completed" not in t:
-            t["completed"] = False
-
-    save_tasks(tasks_data)  # تحديث الملف لو فيه أي حاجة جديدة
-
-    return tasks_data[username]
-
-# تعليم مهمة كمكتملة
-def mark_task_completed(username, condition):
-    tasks_data = load_tasks()
-    user_tasks = tasks_data.get(username, [])
-    users = load_users()
-    user = next((u for u in users if u["username"] == username), None)
-    
-    if not user:
-        return False, "المستخدم غير موجود"
-    
-    task = next((t for t in user_tasks if t.get("condition") == condition), None)
-    if not task:
-        return False, "المهمة غير موجود"
-    
-    if task.get("completed", False):
-        return False, "المهمة مكتملة مسبقًا"  # منع مضاعفة المكافأة
-
-    # علامة المهمة كمكتملة
-    task["completed"] = True
-    task["last_done"] = datetime.now().strftime("%Y-%m-%d")
-
-    # إضافة المكافأة
-    if task["type"] == "btc":
-        user["balance"] = float(user.get("balance", 0)) + float(task.get("reward", 0))
-        user["balance"] = float(f"{user['balance']:.8f}")
-    elif task["type"] == "xp":
-        user["xp"] = int(user.get("xp", 0)) + int(task.get("reward", 0))
-        user["rank"] = calculate_rank(user["xp"])
-
-    tasks_data[username] = user_tasks
-    save_tasks(tasks_data)
-    save_users(users)
-
-    return True, f"تم إكمال المهمة: {task.get('title','(بدون عنوان)')} 🎉"
+    db.save_tasks(tasks)
+# ---------- Task state ----------
+# المستخدم بيخزن {"done": bitset, "days": {slot: يوم الإنجاز}} بس؛
+# العنوان والمكافأة والشرط من catalog.TASKS. مستخدم جديد = مفيش سجل خالص
+def task_key(username):
+    return username.strip().lower()
+
+def load_task_state(username):
+    unit = current_unit(username, task_key)
+    if unit is not None:
+        return unit.get_tasks()
+    return _load_task_state(username)
+
+def _load_task_state(username):
+    stored = db.get_tasks(task_key(username))
+    if stored is None and username != task_key(username):
+        stored = db.get_tasks(username)
+    if isinstance(stored, dict):
+        return TaskState.from_dict(stored)
+    # قائمة قديمة (نسخة كاملة من المهام لكل مستخدم) → bitset
+    state = TaskState(days={})
+    for row in stored or ():
+        task = catalog.task_for(row.get("condition"))
+        if task is None or not row.get("completed"):
+            continue
+        state.done |= 1 << task.slot
+        day = row.get("done_day")
+        if day is None and row.get("last_done"):
+            day = day_number(row["last_done"])
+        if day is not None:
+            state.days[task.slot] = day
+    return state
+
+def save_task_state(username, state):
+    unit = current_unit(username, task_key)
+    if unit is not None:
+        unit.mark_tasks(state)
+        return
+    db.put_tasks(task_key(username), state.to_dict())
 
+def task_rows(state):
+    # شكل القائمة القديمة للقوالب و /tasks_status
+    return [{"title": t.title, "reward": t.reward, "type": t.type, "condition": t.condition,
+             "completed": state.is_done(t.slot)} for t in catalog.TASKS]
 
+def get_user_tasks(username):
+    return task_rows(load_task_state(username))
 
 def load_users():
-    if not os.path.exists(USERS_FILE):
-        with open(USERS_FILE, "w") as f:
-            json.dump([], f)
-    with open(USERS_FILE, "r") as f:
-        try:
-            return json.load(f)
-        except:
-            return []
+    return db.load_users()
 
 def save_users(users):
-    with open(USERS_FILE, "w") as f:
-        json.dump(users, f, indent=4)
+    db.save_users(users)
 
 def find_user(username):
     if username is None:
         return None
-    username = username.strip()
-    users = load_users()
-    for u in users:
-        if u.get("username","").strip() == username:
-            return u
+    unit = current_unit(username)
+    if unit is not None:
+        return unit.get_user()
+    return db.get_user(username.strip())
+
+def update_user(user, old_username=None):
+    # old_username لو الاسم نفسه اتغير (صفحة الإعدادات)
+    unit = current_unit(old_username or user.get("username", ""))
+    if unit is not None:
+        unit.mark_user(user, old_username)
+        return
+    write_user(user, old_username)
+
+def write_user(user, old_username=None):
+    # قيود الرصيد المعلقة بتتكتب مع صف المستخدم في نفس المعاملة
+    entries = user.pop("_ledger", None)
+    if entries and old_username:
+        # قيود اتسجلت قبل تغيير الاسم في نفس الطلب → بالاسم الجديد (الباقي بيتنقل في put_user)
+        for e in entries:
+            if e["username"] == old_username.strip():
+                e["username"] = user.get("username", "").strip()
+    if not entries:
+        db.put_user(user, old_username=old_username)
+        return
+    with db.transaction():
+        db.put_user(user, old_username=old_username)
+        db.append_ledger(entries)
+
+def locked_to_user(view):
+    # الطلب كله بيتنفذ تحت قفل المستخدم الحالي (unit of work واحد):
+    # القراءة والتعديل والكتابة ذرية حتى مع أكتر من worker
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with user_unit(session.get('user') or ""):
+            return view(*args, **kwargs)
+    return wrapper
+
+# ---------- Unit of work (لكل طلب) ----------
+# جوه قفل المستخدم (user_unit / locked_to_user) صفه وأجهزته وحالة مهامه بتتقري مرة واحدة:
+# كل find_user / get_user_items / load_task_state بترجع نفس الـ object، والتعديلات
+# (update_user / save_user_items / save_task_state) بتتعلّم بس، وفي آخر البلوك
+# بتتكتب كلها في معاملة واحدة وهو لسه ماسك القفل. صف المستخدم مش بيتكتب لو مفيش حقل اتغير
+# لو البلوك وقع بـ exception مفيش حاجة بتتكتب. برا الـ unit أو لمستخدم تاني: زي الأول
+_UNLOADED = object()
+
+class UnitOfWork:
+    def __init__(self, username):
+        self.username = username.strip()
+        self.user = _UNLOADED
+        self.loaded = None            # نسخة الصف وقت القراءة (لمعرفة الحقول اللي اتغيرت)
+        self.old_username = None
+        self.user_dirty = False
+        self.items = None
+        self.dirty_items = {}         # id → item
+        self.tasks = None
+        self.tasks_dirty = False
+
+    def get_user(self):
+        if self.user is _UNLOADED:
+            self.user = db.get_user(self.username)
+            self.loaded = dict(self.user) if self.user else {}
+        return self.user
+
+    def get_items(self):
+        if self.items is None:
+            self.items = db.items_by_owner(self.username)
+        return self.items
+
+    def get_tasks(self):
+        if self.tasks is None:
+            self.tasks = _load_task_state(self.username)
+        return self.tasks
+
+    def mark_user(self, user, old_username=None):
+        if self.user is _UNLOADED:
+            self.loaded = {}
+        self.user = user
+        self.user_dirty = True
+        if old_username:
+            self.old_username = old_username
+
+    def mark_items(self, items):
+        known = {id(i) for i in self.items or ()}
+        for i in items:
+            self.dirty_items[str(i.get("id"))] = i
+            if self.items is not None and id(i) not in known:
+                self.items.append(i)
+
+    def mark_tasks(self, state):
+        self.tasks = state
+        self.tasks_dirty = True
+
+    def changed_fields(self):
+        if not self.user_dirty or not self.user:
+            return set()
+        loaded = self.loaded or {}
+        return {k for k in set(self.user) | set(loaded) if self.user.get(k, _UNLOADED) != loaded.get(k, _UNLOADED)}
+
+    def flush(self):
+        write_row = bool(self.changed_fields() or self.old_username)
+        if not (write_row or self.dirty_items or self.tasks_dirty):
+            return
+        with db.transaction():
+            if self.dirty_items:
+                db.put_items(list(self.dirty_items.values()))
+            if self.tasks_dirty:
+                db.put_tasks(task_key(self.username), self.tasks.to_dict())
+            if write_row:
+                write_user(self.user, self.old_username)
+        self.loaded = dict(self.user) if self.user else {}
+        self.user_dirty = self.tasks_dirty = False
+        self.old_username = None
+        self.dirty_items = {}
+
+def current_unit(username, key=str.strip):
+    unit = g.get("_unit") if has_request_context() else None
+    if unit is not None and username is not None and key(username) == key(unit.username):
+        return unit
     return None
 
-def update_user(user):
-    users = load_users()
-    for i,u in enumerate(users):
-        if u.get("username","").strip() == user.get("username","").strip():
-            users[i] = user
-            break
-    else:
-        users.append(user)
-    save_users(users)
+@contextmanager
+def unit_of_work(username):
+    # units متداخلة بتشارك الـ unit الخارجي، وهو بس اللي بيكتب في الآخر
+    if not username or not has_request_context() or g.get("_unit") is not None:
+        yield current_unit(username)
+        return
+    unit = g._unit = UnitOfWork(username)
+    try:
+        yield unit
+        unit.flush()
+    finally:
+        g._unit = None
+
+@contextmanager
+def user_unit(username):
+    with db.user_lock(username), unit_of_work(username) as unit:
+        yield unit
+
+def user_transaction(username):
+    # جوه الـ unit الكتابة بتتأجل للـ flush (معاملة واحدة) → مفيش معاملة فاضية هنا
+    return nullcontext() if current_unit(username) is not None else db.transaction()
 
 def delete_user_by_name(username: str):
     username_clean = username.strip().lower()
-    # حذف المستخدم
-    users = load_users()
-    users = [u for u in users if u.get("username","").strip().lower() != username_clean]
-    save_users(users)
-
-    # حذف الأجهزة المرتبطة بالمستخدم
-    items = load_items()
-    items = [i for i in items if i.get("owner","").strip().lower() != username_clean]
-    save_items(items)
-
-    # حذف المهام الخاصة بالمستخدم
-    tasks = load_tasks()
-    if username_clean in tasks:
-        del tasks[username_clean]
-        save_tasks(tasks)
+    with db.user_lock(username_clean), db.transaction():
+        # حذف المستخدم
+        db.delete_user_ci(username_clean)
+        # حذف الأجهزة المرتبطة بالمستخدم
+        db.delete_items_by_owner_ci(username_clean)
+        # حذف المهام الخاصة بالمستخدم
+        db.delete_tasks(username_clean)
+    forget_user_count()
+
+# ---------- User count ----------
+# العداد نفسه في التخزين (triggers في SQLite، الفهرس في الكاش) بيتحدث مع كل تسجيل/حذف؛
+# هنا نسخة لكل عملية بتعيش USER_COUNT_TTL ثانية، والتسجيل/الحذف في نفس العملية بيلغيها
+_user_count = {"value": 0, "expires": 0.0}
+
+def user_count():
+    now = time.time()
+    if now >= _user_count["expires"]:
+        db.sync()
+        _user_count["value"] = db.user_count(exclude=LEADERBOARD_EXCLUDE)
+        _user_count["expires"] = now + USER_COUNT_TTL
+    return _user_count["value"]
+
+def forget_user_count():
+    _user_count["expires"] = 0.0
 
 def calculate_rank(xp):
     try: xp=int(xp)
@@ -211,17 +344,8 @@ def calculate_rank(xp):
     elif 60001 <= xp <= 120000: return "أسطوري"
     return "مبتدأ"
 
-def check_task_condition(username, condition):
-    """
-    تحقق من شرط المهمة للمستخدم.
-    ترجع (True, "") لو الشرط متحقق، أو (False, رسالة_خطأ) لو مش متحقق.
-    """
-
-    users = load_users()
-    user = next((u for u in users if u.get("username") == username), None)
-    if not user:
-        return False, "المستخدم غير موجود"
-
+def _task_condition(condition, snap):
+    # تقييم شرط مهمة على snapshot في الذاكرة (بدون أي قراءة من التخزين)
     # أول تسجيل دخول
     if condition == "first_login":
         return True, ""
@@ -229,23 +353,21 @@ def check_task_condition(username, condition):
     # شراء أجهزة
     if condition.startswith("buy_"):
         count = int(condition.replace("buy_", "").replace("_items", ""))
-        items = load_items()
-        owned = [i for i in items if i.get("owner") == username]
-        if len(owned) >= count:
+        if snap["item_count"] >= count:
             return True, ""
         else:
             return False, f"يجب شراء {count} أجهزة أولًا"
 
     # تسجيل دخول 7 أيام
     if condition == "login_7_days":
-        if user.get("login_streak", 0) >= 7:
+        if snap["streak"] >= 7:
             return True, ""
         else:
             return False, "يجب تسجيل الدخول لمدة 7 أيام متتالية"
 
     # تسجيل دخول 30 يوم
     if condition == "login_30_days":
-        if user.get("login_streak", 0) >= 30:
+        if snap["streak"] >= 30:
             return True, ""
         else:
             return False, "يجب تسجيل الدخول لمدة 30 يوم متتالية"
@@ -253,242 +375,184 @@ def check_task_condition(username, condition):
     # أي شرط آخر غير معروف
     return False, "شرط المهمة غير معروف"
 
-def update_user_tasks(username):
-    tasks_data = load_tasks()
-    user_tasks = tasks_data.get(username, [])
-
-    # لو المستخدم ملوش مهام → نعمله نسخة جديدة من DEFAULT_TASKS
-    if not user_tasks:
-        user_tasks = [dict(t, completed=False) for t in DEFAULT_TASKS]
-        tasks_data[username] = user_tasks
-
-    users = load_users()
-    user = next((u for u in users if u.get("username") == username), None)
-    if not user:
-        return []
-
-    messages = []
-    today = datetime.now().date()
-
-    for task in user_tasks:
-        # إعادة تعيين المهام اليومية لو لم تُنجز اليوم
-        if task.get("type") == "daily":
-            last_done_str = task.get("last_done")
-            last_done_date = None
-            if isinstance(last_done_str, str) and last_done_str:
-                try:
-                    last_done_date = datetime.strptime(last_done_str, "%Y-%m-%d").date()
-                except:
-                    last_done_date = None
-
-            if last_done_date != today:
-                task["completed"] = False  # bool مضبوط
-
-        # لو المهمة مكتملة مسبقًا → نعدي
-        if bool(task.get("completed", False)):
-            continue
-
-        # تحقق الشرط
-        condition_ok, _ = check_task_condition(username, task.get("condition", ""))
-        if condition_ok:
-            task["completed"] = True  # bool
-            task["last_done"] = today.strftime("%Y-%m-%d")  # str
-
-            # إضافة المكافأة
-            if task.get("type") == "btc":
-                user["balance"] = float(user.get("balance", 0)) + float(task.get("reward", 0))
-                user["balance"] = float(f"{user['balance']:.8f}")
-            elif task.get("type") == "xp":
-                user["xp"] = int(user.get("xp", 0)) + int(task.get("reward", 0))
-                user["rank"] = calculate_rank(user["xp"])
-
-            messages.append(f"تم إكمال المهمة: {task.get('title','(بدون عنوان)')} 🎉")
-
-    # حفظ التغييرات
-    tasks_data[username] = user_tasks
-    save_tasks(tasks_data)
-    save_users(users)
-
-    return messages
+def _needs_items(state):
+    return any(t.condition.startswith("buy_") and not state.is_done(t.slot) for t in catalog.TASKS)
 
-def check_auto_tasks(username):
-    today = datetime.now().date()
-    users = load_users()
-    user = next((u for u in users if u.get("username") == username), None)
+def load_task_snapshot(username):
+    # كل اللي تقييم المهام محتاجه في قراءة واحدة لكل جدول
+    # عدد الأجهزة بيتحسب بس لو فيه مهمة buy_ لسه ما خلصتش
+    user = find_user(username)
     if not user:
-        return
-
-    all_tasks = load_tasks()
-    tasks = all_tasks.get(username, [])
+        return None
+    state = load_task_state(username)
+    return {
+        "user": user,
+        "item_count": len(get_user_items(username)) if _needs_items(state) else 0,
+        "streak": int(user.get("login_streak", 0)),
+        "tasks": state,
+    }
 
-    changed = False
+def check_task_condition(username, condition):
+    """
+    تحقق من شرط المهمة للمستخدم.
+    ترجع (True, "") لو الشرط متحقق، أو (False, رسالة_خطأ) لو مش متحقق.
+    """
+    snap = load_task_snapshot(username)
+    if not snap:
+        return False, "المستخدم غير موجود"
+    return _task_condition(condition, snap)
 
-    for task in tasks:
-        if task.get("type") == "daily":
-            last_done_str = task.get("last_done")
-            last_done_date = None
-            if last_done_str:
-                try:
-                    last_done_date = datetime.strptime(last_done_str, "%Y-%m-%d").date()
-                except:
-                    last_done_date = None
+# ---------- Day numbers ----------
+# الأيام بتتخزن كرقم (date.toordinal) بدل نص بيتعمله strptime في كل طلب:
+# login_day على المستخدم و done_day على المهمة
+# ولما اليوم ما يتغيرش مفيش حاجة تتحسب ولا تتكتب
+def today_number(now=None):
+    return (now or datetime.now()).date().toordinal()
 
-            if last_done_date != today:
-                task["completed"] = False
-                changed = True
+def day_number(value):
+    # last_login / last_done القديمة (نصوص) → رقم يوم؛ مرة واحدة لكل سجل قديم
+    try:
+        return datetime.fromisoformat(str(value)[:10]).date().toordinal()
+    except ValueError:
+        return None
 
-    if changed:
-        all_tasks[username] = tasks
-        save_tasks(all_tasks)
-
-    # تنفيذ أول تسجيل دخول بدون مضاعفة المكافأة
-    mark_task_completed(username, "first_login")
-
-    # تنفيذ مهام شراء الأجهزة
-    counts = [3,5,10,20,30,50,100]
-    items = user.get("items", [])
-    for count in counts:
-        if len(items) >= count:
-            mark_task_completed(username, f"buy_{count}_items")
-
-    # تسجيل الدخول اليومي
-    last_login = user.get("last_login")
-    if last_login:
-        last_date = datetime.fromisoformat(last_login).date()
-        delta = (today - last_date).days
-        if delta >= 1:
-            streak = user.get("login_streak", 0) + 1
-            user["login_streak"] = streak
-            save_users(users)
-
-            if streak >= 7:
-                mark_task_completed(username, "login_7_days")
-            if streak >= 30:
-                mark_task_completed(username, "login_30_days")
+def roll_login_day(user, today):
+    # بترجع True لو اليوم اتغير (واتحدث الـ streak)
+    day = user.get("login_day")
+    if day == today:
+        return False
+    if day is None:
+        # مستخدم قبل login_day: آخر دخول مسجل هو آخر يوم في الـ streak
+        day = day_number(user.get("last_login")) if user.get("last_login") else None
+        if day == today:
+            user["login_day"] = today
+            user["login_streak"] = max(1, int(user.get("login_streak", 0)))
+            return True
+    if day is not None and today - day == 1:
+        user["login_streak"] = int(user.get("login_streak", 0)) + 1
     else:
         user["login_streak"] = 1
-        save_users(users)
+    user["login_day"] = today
+    return True
 
-    # تحديث آخر دخول
-    user["last_login"] = datetime.now().isoformat()
-    save_users(users)
+def reset_daily_tasks(state, today):
+    changed = False
+    for task in catalog.TASKS:
+        if task.type == "daily" and state.is_done(task.slot) and state.days.get(task.slot) != today:
+            state.clear(task.slot)
+            changed = True
+    return changed
 
-def give_reward(username, condition):
-    tasks = get_user_tasks(username)
-    users = load_users()
+def evaluate_user_tasks(username):
+    with user_unit(username):
+        return _evaluate_user_tasks(username)
 
-    user = next((u for u in users if u["username"] == username), None)
-    if not user:
-        return
+def _evaluate_user_tasks(username):
+    # snapshot واحد → تقييم المهام اللي لسه ما خلصتش في الذاكرة
+    # → كتابة واحدة في معاملة، ولو مفيش حاجة اتغيرت مفيش كتابة خالص
+    snap = load_task_snapshot(username)
+    if not snap:
+        return []
+    user, state = snap["user"], snap["tasks"]
+    today = today_number()
+
+    # تسجيل الدخول اليومي + إعادة المهام اليومية: مرة واحدة أول ما اليوم يتغير
+    user_changed = roll_login_day(user, today)
+    tasks_changed = False
+    if user_changed:
+        snap["streak"] = int(user.get("login_streak", 0))
+        if reset_daily_tasks(state, today):
+            tasks_changed = True
+            if _needs_items(state):
+                snap["item_count"] = len(get_user_items(username))
 
-    task = next((t for t in tasks if t["condition"] == condition), None)
-    if not task:
-        return
+    messages = []
+    for task in catalog.TASKS:
+        # لو المهمة مكتملة مسبقًا → نعدي (منع مضاعفة المكافأة)
+        if state.is_done(task.slot):
+            continue
 
-    reward = task["reward"]
+        condition_ok, _ = _task_condition(task.condition, snap)
+        if not condition_ok:
+            continue
 
-    if task["type"] == "btc":
-        user["balance"] = float(user.get("balance", 0)) + float(reward)
-        user["balance"] = float(f"{user['balance']:.8f}")
+        state.mark(task.slot, today)
+        tasks_changed = user_changed = True
 
-    elif task["type"] == "xp":
-        user["xp"] = int(user.get("xp", 0)) + int(reward)
-        user["rank"] = calculate_rank(user["xp"])
+        # إضافة المكافأة
+        if task.type == "btc":
+            post_ledger(user, to_sats(task.reward), "task_reward", task.condition)
+        elif task.type == "xp":
+            user["xp"] = int(user.get("xp", 0)) + int(task.reward)
+            user["rank"] = calculate_rank(user["xp"])
 
-    save_users(users)
+        messages.append(f"تم إكمال المهمة: {task.title or '(بدون عنوان)'} 🎉")
 
-def ensure_user_tasks(username):
-    tasks = load_tasks()
+    # حفظ التغييرات مرة واحدة
+    if tasks_changed or user_changed:
+        with user_transaction(username):
+            if tasks_changed:
+                save_task_state(username, state)
+            if user_changed:
+                update_user(user)
 
-    # لو مفيش مهام للمستخدم
-    if username not in tasks:
-        with open("default_tasks.json", "r", encoding="utf-8") as f:
-            default = json.load(f)
+    return messages
 
-        # ننسخ النسخة الأصلية لكل يوزر
-        tasks[username] = default
+def give_reward(username, condition):
+    task = catalog.task_for(condition)
+    user = find_user(username)
+    if not user or not task:
+        return
 
-        save_tasks(tasks)
+    if task.type == "btc":
+        post_ledger(user, to_sats(task.reward), "task_reward", condition)
 
-    return tasks[username]
+    elif task.type == "xp":
+        user["xp"] = int(user.get("xp", 0)) + int(task.reward)
+        user["rank"] = calculate_rank(user["xp"])
 
-# ---------- Store items (base data) ----------
-STORE_ITEMS = [
-    {"id":1,"name":"Antinminer s19","price":0.00000012,"sat_per_30s":6,"interval":30},
-    {"id":2,"name":"Antinminer s19j","price":0.00000050,"sat_per_26s":8,"interval":26},
-    {"id":3,"name":"Antinminer s19pro","price":0.00001000,"sat_per_22s":13,"interval":22},
-    {"id":4,"name":"Antinminer s19j pro","price":0.00009000,"sat_per_19s":15,"interval":19},
-    {"id":5,"name":"Antinminer s21","price":0.00050000,"sat_per_15s":20,"interval":15},
-    {"id":6,"name":"Antinminer s21 pro","price":0.00090000,"sat_per_11s":26,"interval":11},
-    {"id":7,"name":"Antinminer s23 hydro","price":0.001,"sat_per_8s":30,"interval":8},
-    {"id":8,"name":"Antinminer s23 pro hydro","price":0.05,"sat_per_4s":40,"interval":4},
-]
+    update_user(user)
 
 # ---------- Items persisted per-user ----------
 def load_items():
-    if not os.path.exists(ITEMS_FILE):
-        with open(ITEMS_FILE,"w") as f:
-            json.dump([],f)
-    with open(ITEMS_FILE,"r") as f:
-        try:
-            return json.load(f)
-        except:
-            return []
+    return db.load_items()
 
 def save_items(items):
-    with open(ITEMS_FILE,"w") as f:
-        json.dump(items,f,indent=4)
+    db.save_items(items)
 
 def get_user_items(username):
-    items = load_items()  # هنا التعديل المهم
-    return [i for i in items if str(i.get("owner")) == str(username)]
+    unit = current_unit(username)
+    if unit is not None:
+        return unit.get_items()
+    return db.items_by_owner(username)
+
+def save_user_items(username, items):
+    unit = current_unit(username)
+    if unit is not None:
+        unit.mark_items(items)
+    elif items:
+        db.put_items(items)
     
-def _derive_sat_and_interval_from_store_item(item):
-    # normalize store item to (sat_per_cycle, interval)
-    interval = item.get("interval") or 30
-    # find any key that starts with 'sat_per'
-    sat = None
-    for k,v in item.items():
-        if isinstance(k,str) and k.startswith("sat_per"):
-            try:
-                sat = int(v)
-                break
-            except:
-                pass
-    if sat is None:
-        sat = item.get("sat", 0)
-    return sat, int(interval)
-
-def add_item_to_user(username, store_item):
-    items = load_items()
-    item_copy = {
-        "owner": username,
-        "store_id": store_item.get("id"),
-        "name": store_item.get("name"),
-        "price": store_item.get("price"),
-        "created_at": datetime.now().isoformat(),
-        "active": False,
-        "last_tick": None
-    }
-    sat, interval = _derive_sat_and_interval_from_store_item(store_item)
-    item_copy["sat_per_cycle"] = int(sat or 0)
-    item_copy["interval"] = int(interval or 30)
-    item_copy["id"] = f"{store_item.get('id')}_{int(time.time() * 1000)}"
-    items.append(item_copy)
-    save_items(items)
+def add_item_to_user(username, tier, qty=1):
+    # tier = catalog.Tier؛ لاحقة عشوائية: شرائين في نفس الملي ثانية (من workers مختلفة) ما يتصادموش
+    # qty أجهزة بتتكتب مرة واحدة (put_items) مش qty كتابة
+    stamp, created = int(time.time() * 1000), datetime.now().isoformat()
+    batch = os.urandom(3).hex()
+    new_items = [Item.from_tier(tier, username, f"{tier.id}_{stamp}_{batch}" + (f"_{n}" if n else ""), created).to_dict()
+                 for n in range(qty)]
+    save_user_items(username, new_items)
 
 def update_user_item(username, item_name, active):
-    items = load_items()
-    for i in items:
-        if i.get("owner")==username and i.get("name")==item_name:
+    for i in get_user_items(username):
+        if i.get("name")==item_name:
             i["active"]=active
             # initialize last_tick when activating
             if active:
                 i["last_tick"] = int(time.time())
             else:
                 i["last_tick"] = None
+            save_user_items(username, [i])
             break
-    save_items(items)
 
 # ---------- Utility: safe float comparison for price ----------
 
@@ -499,14 +563,337 @@ def has_enough_balance(user_balance, price):
         return user_sats >= price_sats
     except:
         return False
-        
+
+# ---------- Balance ledger (integer satoshi) ----------
+# الرصيد الحقيقي هو balance_sats (عدد صحيح) وكل تغيير بيتسجل كقيد:
+# mining / task_reward / purchase / withdraw / admin_adjustment / signup_bonus
+# balance (BTC) بيتحدث معاه للعرض في القوالب و الـ JSON بس
+SATS_PER_BTC = storage.SATS_PER_BTC
+
+def to_sats(btc):
+    try:
+        return int(round(float(btc) * SATS_PER_BTC))
+    except:
+        return 0
+
+def user_sats(user):
+    if "balance_sats" in user:
+        return int(user["balance_sats"])
+    return to_sats(user.get("balance", 0))
+
+def _queue_entry(user, sats, kind, ref=None):
+    user["balance_sats"] = int(user.get("balance_sats", 0)) + sats
+    user["balance"] = user["balance_sats"] / SATS_PER_BTC
+    user.setdefault("_ledger", []).append({
+        "username": user.get("username", "").strip(),
+        "kind": kind,
+        "sats": sats,
+        "ts": int(time.time()),
+        "ref": ref,
+    })
+
+def open_ledger(user):
+    # مستخدم قديم: رصيده الحالي بيتسجل كقيد افتتاحي مرة واحدة
+    if "balance_sats" in user:
+        return False
+    opening = user_sats(user)
+    user["balance_sats"] = 0
+    _queue_entry(user, opening, "opening")
+    return True
+
+def post_ledger(user, sats, kind, ref=None):
+    open_ledger(user)
+    _queue_entry(user, int(sats), kind, ref)
+
+# ---------- Mining accrual (lazy) ----------
+# الرصيد بيتحسب وقت القراءة بمعادلة مباشرة:
+#   balance + mining_rate * (now - mining_anchor)
+# mining_rate = مجموع sat_per_cycle/interval للأجهزة الشغالة (active + power_on)
+# ومش بيتكتب في التخزين غير لما حالة التعدين تتغير (start/stop, power, buy, withdraw)
+def mining_rate(items):
+    rate = 0.0
+    for i in items:
+        if i.get("active", False) and i.get("power_on", False):
+            interval = int(i.get("interval", 30)) or 30
+            rate += int(i.get("sat_per_cycle", 0)) / interval
+    return rate
+
+def ensure_accrual_state(user, now):
+    # مستخدمين قدام من قبل المحرك: نحسب المعدل مرة واحدة من أجهزتهم
+    if "mining_rate" in user:
+        return False
+    user_items = get_user_items(user.get("username"))
+    user["mining_rate"] = mining_rate(user_items)
+    ticks = [int(i["last_tick"]) for i in user_items
+             if i.get("active") and i.get("power_on") and i.get("last_tick") is not None]
+    user["mining_anchor"] = min(ticks) if ticks else now
+    user["mining_carry"] = 0.0
+    return True
+
+def _mined_exact(user, now):
+    if not user.get("mining", False):
+        return 0.0
+    rate = float(user.get("mining_rate", 0))
+    if rate <= 0:
+        return 0.0
+    elapsed = max(0, now - int(user.get("mining_anchor", now)))
+    return rate * elapsed + float(user.get("mining_carry", 0))
+
+def pending_sats(user, now):
+    return int(_mined_exact(user, now))
+
+def _apply_mined_xp(user, sats):
+    user['xp'] = int(user.get('xp', 0)) + (sats // 6) * 20
+    user['rank'] = calculate_rank(user['xp'])
+
+def _credit_mined(user, sats):
+    post_ledger(user, sats, "mining")
+    _apply_mined_xp(user, sats)
+
+def settle_mining(user, now):
+    # نضيف اللي اتعدّن لحد دلوقتي للرصيد ونحرّك نقطة البداية
+    ensure_accrual_state(user, now)
+    exact = _mined_exact(user, now)
+    sats = int(exact)
+    if sats > 0:
+        _credit_mined(user, sats)
+    user["mining_carry"] = exact - sats
+    user["mining_anchor"] = now
+    return sats
+
+def rearm_mining(user, user_items, now):
+    # لازم تتنده قبل ما نغير user["mining"] وبعد ما نعدل الأجهزة
+    sats = settle_mining(user, now)
+    user["mining_rate"] = mining_rate(user_items)
+    return sats
+
+def save_device_state(username, user_items, changed):
+    # حفظ الأجهزة اللي اتغيرت + إعادة حساب معدل التعدين في معاملة واحدة
+    user = find_user(username)
+    with user_transaction(username):
+        save_user_items(username, changed)
+        if user:
+            rearm_mining(user, user_items, int(time.time()))
+            update_user(user)
+
+def accrued_view(user, now):
+    # نسخة للعرض فيها الرصيد المتوقع بدون أي كتابة
+    sats = pending_sats(user, now)
+    if sats <= 0:
+        return user
+    view = dict(user)
+    view.pop("_ledger", None)
+    view["balance_sats"] = user_sats(user) + sats
+    view["balance"] = view["balance_sats"] / SATS_PER_BTC
+    _apply_mined_xp(view, sats)
+    return view
+
+
+# ---------- Mining scheduler ----------
+# تسوية في الخلفية للمستخدمين اللي بيعدّنوا ومحدش بيلمس رصيدهم: الرصيد بيتحسب وقت القراءة
+# (accrued_view)، وأي شراء/سحب/تغيير أجهزة بيسوّي ويحرّك mining_anchor، فالمستخدم النشط
+# عمره ما بيستحق. الـ heap فيه موعد واحد لكل مستخدم بيعدّن = mining_anchor + الـ cadence،
+# وبيتحدث من سجل التغييرات (changes_since) لما التعدين يبدأ/يقف أو الأجهزة تتغير،
+# مش بإعادة قراءة كل الأجهزة. تحميل كامل بس أول مرة أو لو السجل اتقص
+SCHEDULER_CADENCE = int(os.environ.get("MINING_SCHEDULER_CADENCE", "21600"))  # أقصى مدة من غير تسوية
+SCHEDULER_POLL = int(os.environ.get("MINING_SCHEDULER_POLL", "60"))            # قراءة سجل التغييرات
+SCHEDULER_BATCH = int(os.environ.get("MINING_SCHEDULER_BATCH", "500"))         # أقصى عدد مستخدمين في المعاملة
+SCHEDULER_STRIPES = int(os.environ.get("MINING_SCHEDULER_STRIPES", "4"))       # أقصى stripes مقفولة في المعاملة
+
+class MiningScheduler:
+    def __init__(self, cadence=SCHEDULER_CADENCE, poll=SCHEDULER_POLL, batch=SCHEDULER_BATCH,
+                 stripes=SCHEDULER_STRIPES):
+        self.cadence = max(1, cadence)
+        self.poll_every = max(1, poll)
+        self.batch = max(1, batch)
+        self.stripes = max(1, stripes)
+        self.heap = []      # (موعد التسوية, username) - المواعيد القديمة بتتشال وقت ما تطلع
+        self.due = {}       # username → موعده الحالي
+        self.marker = None  # marker سجل التغييرات اللي وصلنا له (None = تحميل كامل)
+        self.polled_at = 0
+        self._stop = threading.Event()
+
+    def due_at(self, user):
+        if not user.get("mining", False) or user.get("username", "").strip() in ("", "gatapro901"):
+            return None
+        if "mining_rate" in user and float(user.get("mining_rate", 0)) <= 0:
+            return None
+        # مستخدم قديم من غير anchor → مستحق فورًا (التسوية بتحسب حالته مرة واحدة)
+        return int(user.get("mining_anchor", 0)) + self.cadence
+
+    def schedule(self, username, due):
+        if due is None:
+            self.due.pop(username, None)
+        elif self.due.get(username) != due:
+            self.due[username] = due
+            heapq.heappush(self.heap, (due, username))
+
+    def track(self, username):
+        user = find_user(username)
+        self.schedule(username, self.due_at(user) if user else None)
+
+    def load(self, now):
+        db.sync()
+        self.marker = db.change_marker()
+        self.heap, self.due = [], {}
+        if db.indexed:
+            # فهرس users_mining في SQLite؛ الكاش كان بيعدي على كل المستخدمين لكل صفحة
+            rows = export_rows(lambda after, n: db.page_users({"mining": True}, "username", after, n),
+                               lambda u: storage.user_sort_key(u, "username"))
+        else:
+            rows = (u for u in load_users() if u.get("mining", False))
+        for user in rows:
+            self.schedule(user.get("username", "").strip(), self.due_at(user))
+        self.polled_at = now
+
+    def poll(self, now):
+        if self.marker is None:
+            return self.load(now)
+        db.sync()
+        marker = db.change_marker()
+        if marker != self.marker:
+            changes = db.changes_since(self.marker)
+            if changes is None:
+                return self.load(now)
+            for username in dict.fromkeys(c[2] for c in changes if c[1] == "users"):
+                self.track(username)
+            self.marker = marker
+        self.polled_at = now
+
+    def settle(self, owners, now):
+        # قفل كل الأصحاب + معاملة واحدة؛ المستخدم اللي معدّنش ساتوشي كاملة مش بيتكتب
+        # بس موعده بيتأجل cadence كمان (عشان ما يرجعش مستحق فورًا)
+        settled = 0
+        with db.users_lock(owners), db.transaction():
+            for name in owners:
+                user = find_user(name)
+                if not user or not user.get("mining", False):
+                    self.schedule(name, None)
+                    continue
+                if settle_mining(user, now) > 0:
+                    update_user(user)
+                    settled += 1
+                self.schedule(name, now + self.cadence)
+        return settled
+
+    def run_due(self, now):
+        if self.marker is None or now - self.polled_at >= self.poll_every:
+            self.poll(now)
+        owners = []
+        while self.heap and self.heap[0][0] <= now:
+            due, name = heapq.heappop(self.heap)
+            if self.due.get(name) == due:
+                owners.append(name)
+        return self.settle_batches(owners, now)
+
+    def settle_batches(self, owners, now):
+        # الـ batch بيتقسم حسب stripes القفل: كل معاملة فيها مستخدمين من self.stripes
+        # stripes بس، فالطلبات على باقي المستخدمين ما بتستناش الـ scheduler
+        # (500 مستخدم في قفل واحد كانوا بياخدوا تقريبًا كل الـ 256 stripe)
+        settled, batch, held = 0, [], 0
+        for group in db.lock_groups(list(dict.fromkeys(owners))):
+            if batch and (held == self.stripes or len(batch) + len(group) > self.batch):
+                settled += self.settle(batch, now)
+                batch, held = [], 0
+            batch += group
+            held += 1
+        if batch:
+            settled += self.settle(batch, now)
+        return settled
+
+    def next_wake(self, now):
+        wake = self.polled_at + self.poll_every
+        if self.heap:
+            wake = min(wake, self.heap[0][0])
+        return max(0, wake - now)
+
+    def run(self):
+        while not self._stop.is_set():
+            now = int(time.time())
+            try:
+                settled = self.run_due(now)
+                if settled:
+                    app.logger.info("mining scheduler: settled %d users", settled)
+            except Exception:
+                app.logger.exception("mining scheduler pass failed")
+                self.marker = None   # المرة الجاية تحميل كامل
+            self._stop.wait(self.next_wake(int(time.time())) or 1)
+
+    def run_exclusive(self):
+        # كل worker في الـ web بيشغل الـ thread ده، بس اللي ماسك scheduler.lock هو اللي
+        # بيسوّي؛ الباقيين بيحاولوا كل poll، فلو الـ worker ده مات غيره بيكمل مكانه
+        while not self._stop.is_set():
+            lock = storage.try_lock_file("scheduler")
+            if lock is not None:
+                with lock:
+                    return self.run()
+            self._stop.wait(self.poll_every)
+
+    def stop(self):
+        self._stop.set()
+
+def start_mining_scheduler():
+    scheduler = MiningScheduler()
+    threading.Thread(target=scheduler.run_exclusive, name="mining-scheduler", daemon=True).start()
+    return scheduler
+
+
+# ---------- Pre-rendered pages ----------
+# صفحات واحدة لكل المستخدمين (المتجر وصفحات الشراء) بتترسم مرة واحدة لكل عملية
+# والمتصفح بيرجع بـ If-None-Match → 304 من غير body
+_prerendered = {}
+
+def prerendered(template, **context):
+    page = _prerendered.get(template)
+    if page is None:
+        body = render_template(template, **context).encode("utf-8")
+        page = _prerendered[template] = (body, hashlib.sha1(body).hexdigest())
+    body, etag = page
+    response = make_response(body)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response.make_conditional(request)
+
+# ---------- Per-user page cache ----------
+# صفحات المستخدم بتترسم مرة لكل نسخة من بياناته (db.data_version من كاش التخزين)
+# والمتصفح بيرجع بـ If-None-Match → 304. من غير كاش التخزين (STORAGE_CACHE=0 أو لسه
+# بيسخن) مفيش نسخ، فالصفحة بتترسم كل مرة زي الأول
+page_cache = pagecache.PageCache(pagecache.PAGE_CACHE_BYTES, pagecache.PAGE_CACHE_TTL)
+
+def user_page(page, username, render, mimetype="text/html", extra=()):
+    data_version = getattr(db, "data_version", None) if pagecache.PAGE_CACHE_BYTES else None
+    version = data_version(username) if data_version else None
+    # توكن CSRF اللي جوه الصفحة خاص بالجلسة → جزء من المفتاح (بيتعمل قبل أول رسم)
+    if "csrf_token" not in session:
+        generate_csrf()
+    key = (page, username.strip().lower(), session.get("csrf_token")) + tuple(extra)
+    hit = page_cache.get(key, version) if version is not None else None
+    if hit is None:
+        body = render()
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        if version is not None:
+            hit = page_cache.put(key, version, body)
+        else:
+            hit = body, hashlib.sha1(body).hexdigest()
+    body, etag = hit
+    response = make_response(body)
+    response.mimetype = mimetype
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response.make_conditional(request)
+
 
 # ---------- Routes ----------
 @app.route("/")
 def welcome():
-    users = load_users()
-    count = len([u for u in users if u.get("username","").strip() != "gatapro901"])
-    return render_template("welcome.html", count=count)
+    return render_template("welcome.html", count=user_count())
+
+@app.route("/api/user_count")
+def api_user_count():
+    response = jsonify({"count": user_count()})
+    response.headers["Cache-Control"] = f"public, max-age={USER_COUNT_TTL}"
+    return response
 
 # ---------- Login ----------
 @app.route("/login", methods=["GET", "POST"])
@@ -526,40 +913,53 @@ def login():
             msg = "التحقق من الروبوت خاطئ"
             return render_template("login.html", msg=msg, captcha=captcha_q, captcha_real=captcha_ans)
 
+        def fail(msg, status=200):
+            return render_template("login.html", msg=msg, captcha=captcha_q, captcha_real=captcha_ans), status
+
+        # rate limit قبل أي قراءة أو hashing (راجع auth.py)
+        retry = auth.check_rate(username, request.remote_addr)
+        if retry:
+            return fail(f"محاولات كثيرة. جرب بعد {retry} ثانية.", 429)
+
+        # المحاولات الفاشلة والقفل في login_state مش في بيانات المستخدم
+        state = db.get_login_state(username)
+        now = time.time()
+        if state["lock_until"] > now:
+            remaining = int((state["lock_until"] - now) // 60) + 1
+            return fail(f"الحساب مقفل مؤقتًا. جرب بعد {remaining} دقيقة.")
+
         user = find_user(username)
         if not user:
-            msg = "اسم المستخدم غير موجود"
-            return render_template("login.html", msg=msg, captcha=captcha_q, captcha_real=captcha_ans)
-
-        # تحقق من القفل المؤقت
-        if user.get("lock_until"):
-            lock_time = datetime.fromisoformat(user["lock_until"])
-            if datetime.now() < lock_time:
-                remaining = int((lock_time - datetime.now()).total_seconds() // 60) + 1
-                msg = f"الحساب مقفل مؤقتًا. جرب بعد {remaining} دقيقة."
-                return render_template("login.html", msg=msg, captcha=captcha_q, captcha_real=captcha_ans)
-            else:
-                # إعادة تعيين القفل بعد انتهاء الوقت
-                user["failed_attempts"] = 0
-                user["lock_until"] = ""
-                update_user(user)
+            return fail("اسم المستخدم غير موجود")
 
-        # تحقق الباسورد
-        if not check_password_hash(user["password"], password):
-            user["failed_attempts"] = user.get("failed_attempts",0) + 1
-            if user["failed_attempts"] >= MAX_FAILED_ATTEMPTS:
-                user["lock_until"] = (datetime.now() + timedelta(minutes=LOCK_DURATION_MINUTES)).isoformat()
-                msg = f"وصلت الحد الأقصى لمحاولات الدخول. الحساب مقفل {LOCK_DURATION_MINUTES} دقيقة."
-            else:
-                msg = f"كلمة المرور خاطئة. حاول مرة أخرى ({user['failed_attempts']}/{MAX_FAILED_ATTEMPTS})"
-            update_user(user)
-            return render_template("login.html", msg=msg, captcha=captcha_q, captcha_real=captcha_ans)
+        # تحقق الباسورد (scrypt في pool محدود)
+        try:
+            ok = auth.verify_password(user["password"], password)
+        except auth.Busy:
+            return fail("السيرفر مشغول. حاول مرة أخرى بعد لحظات.", 503)
+        if not ok:
+            state = db.login_failure(username, MAX_FAILED_ATTEMPTS, LOCK_DURATION_MINUTES * 60, now)
+            if state["lock_until"]:
+                return fail(f"وصلت الحد الأقصى لمحاولات الدخول. الحساب مقفل {LOCK_DURATION_MINUTES} دقيقة.")
+            return fail(f"كلمة المرور خاطئة. حاول مرة أخرى ({state['failed']}/{MAX_FAILED_ATTEMPTS})")
 
         # تسجيل الدخول ناجح → إعادة تعيين الفشل
-        user["failed_attempts"] = 0
-        user["lock_until"] = ""
-        user['last_login'] = str(datetime.now())
-        update_user(user)
+        auth.login_succeeded(username)
+        if state["failed"] or state["lock_until"]:
+            db.clear_login_state(username)
+        with db.user_lock(username):
+            user = find_user(username)
+            if not user:
+                # الحساب اتمسح بين التحقق وأخد القفل
+                return fail("اسم المستخدم غير موجود")
+            if "login_day" not in user and user.get("last_login"):
+                # الـ streak بقى على login_day؛ آخر دخول قديم هو نقطة البداية
+                user["login_day"] = day_number(user["last_login"])
+            user['last_login'] = str(datetime.now())
+            # حقول القفل القديمة كانت في users.json
+            user.pop("failed_attempts", None)
+            user.pop("lock_until", None)
+            update_user(user)
         session['user'] = user.get("username")
         return redirect(url_for("dashboard"))
 
@@ -577,54 +977,58 @@ def register():
             msg = "ادخل اسم مستخدم صالح"
             return render_template("register.html", msg=msg)
 
-        if find_user(username):
-            msg = "الإسم مستخدم بالفعل"
-            return render_template("register.html", msg=msg)
-
-        # تحميل المستخدمين
-        users = load_users()
-
-        # إضافة مستخدم جديد بالباسورد المشفر
-        users.append({
-            "username": username,
-            "password": generate_password_hash(password),  # تشفير الباسورد
-            "balance": 0.00000012,
-            "xp": 0,
-            "rank": "مبتدأ",
-            "currency": "bitcoin",
-            "blocked": False,
-            "theme": "light",
-            "created_at": datetime.now().isoformat(),
-            "last_login": "",
-            "mining": False
-        })
-
-        save_users(users)
+        with db.user_lock(username):
+            if find_user(username):
+                msg = "الإسم مستخدم بالفعل"
+                return render_template("register.html", msg=msg)
+
+            # إضافة مستخدم جديد بالباسورد المشفر
+            new_user = {
+                "username": username,
+                "password": generate_password_hash(password),  # تشفير الباسورد
+                "balance": 0.0,
+                "balance_sats": 0,
+                "xp": 0,
+                "rank": "مبتدأ",
+                "currency": "bitcoin",
+                "blocked": False,
+                "theme": "light",
+                "created_at": datetime.now().isoformat(),
+                "last_login": "",
+                "mining": False
+            }
+            post_ledger(new_user, 12, "signup_bonus")  # 0.00000012 BTC
+            update_user(new_user)
+        forget_user_count()
         return redirect(url_for("login"))
 
     return render_template("register.html", msg=msg)
 
 # ---------- Logout ----------
 @app.route("/logout")
+@locked_to_user
 def logout():
     if 'user' in session:
         username = session['user']
-        items = load_items()
-        changed = False
-        for item in items:
-            if item.get("owner") == username:
-                # نحافظ على حالة power_on حسب طلبك؟ الان نوقف التعدين فقط
-                item["active"] = False
-                item["last_tick"] = None
-                changed = True
-        if changed:
-            save_items(items)
+        user = find_user(username)
+        user_items = get_user_items(username)
+        for item in user_items:
+            # نحافظ على حالة power_on حسب طلبك؟ الان نوقف التعدين فقط
+            item["active"] = False
+            item["last_tick"] = None
+        if user_items:
+            with user_transaction(username):
+                save_user_items(username, user_items)
+                if user:
+                    rearm_mining(user, user_items, int(time.time()))
+                    update_user(user)
         session.pop('user', None)
     return redirect(url_for("login"))
     
 # ---------- Dashboard ----------
 
 @app.route("/dashboard")
+@locked_to_user
 def dashboard():
     if 'user' not in session:
         return redirect(url_for("login"))
@@ -647,176 +1051,314 @@ def dashboard():
         session.pop('user', None)
         return redirect(url_for("login"))
 
-    # التحقق التلقائي لمهام المستخدم
-    check_auto_tasks(username)
-
-    # **هنا نضيف التحديث التلقائي للمهام وإظهار الرسائل**
-    messages = update_user_tasks(username)
+    # التحقق التلقائي لمهام المستخدم وإظهار الرسائل
+    messages = evaluate_user_tasks(username)
     for msg in messages:
         flash(msg)
 
-    # ترتيب المستخدمين حسب الرصيد
-    users = load_users()
-    users = [u for u in users if u.get("username", "").strip() != "gatapro901"]
-    users.sort(key=lambda x: float(x.get("balance", 0)), reverse=True)
+    # أعلى المستخدمين رصيدًا + ترتيب المستخدم نفسه (من فهرس اللوحة)
+    users = db.leaderboard(0, LEADERBOARD_SIZE, exclude=LEADERBOARD_EXCLUDE)
+    my_rank = db.leaderboard_rank(username, exclude=LEADERBOARD_EXCLUDE)
 
     # جمع عدد الأجهزة النشطة للمستخدم
-    items = load_items()
-    user_items = [i for i in items if i.get("owner") == username]
+    user_items = get_user_items(username)
     active_count = len([i for i in user_items if i.get("active")])
 
+    if "mining_rate" in user:
+        user = accrued_view(user, int(time.time()))
+
     return render_template(
         "dashboard.html",
         user=user,
         users=users,
+        my_rank=my_rank,
         active_count=active_count
     )
 
 # ---------- Mining control (global per-user) ----------
+# منطق الـ JSON endpoints في دوال *_result(username, ...) → (payload, status)
+# عشان الـ sidecar غير المتزامن (asgi.py) يشغّل نفس الكود بالظبط
 @app.route('/start_mining')
 def start_mining():
-    if 'user' not in session:
-        return jsonify({"ok": False, "msg": "not logged"}), 401
+    return api_response(start_mining_result(session.get('user')))
 
-    username = session['user']
+def api_response(result):
+    payload, status = result
+    return jsonify(payload), status
+
+def start_mining_result(username):
+    if not username:
+        return {"ok": False, "msg": "not logged"}, 401
     if username == "gatapro901":
-        return jsonify({"ok": False, "msg": "admin cannot mine"})
+        return {"ok": False, "msg": "admin cannot mine"}, 200
 
-    users = load_users()
-    user = next((u for u in users if u.get("username") == username), None)
-    if not user:
-        return jsonify({"ok": False, "msg": "user not found"})
+    with user_unit(username):
+        user = find_user(username)
+        if not user:
+            return {"ok": False, "msg": "user not found"}, 200
 
-    items = load_items()
-    now = int(time.time())
+        now = int(time.time())
 
-    # جلب الأجهزة المملوكة للمستخدم
-    user_items = [i for i in items if i.get("owner") == username]
+        # جلب الأجهزة المملوكة للمستخدم
+        user_items = get_user_items(username)
 
-    if not user_items:
-        return jsonify({"ok": False, "msg": "ليس لديك أي جهاز — اشترِ جهاز أولاً"})
+        if not user_items:
+            return {"ok": False, "msg": "ليس لديك أي جهاز — اشترِ جهاز أولاً"}, 200
 
-    # تحقق إن على الأقل جهاز واحد شغّال (power_on=True)
-    powered = [i for i in user_items if i.get("power_on", False)]
-    if not powered:
-        return jsonify({"ok": False, "msg": "لا يوجد جهاز شغّال — شغّل جهاز من صفحة أجهزتي أولاً"})
+        # تحقق إن على الأقل جهاز واحد شغّال (power_on=True)
+        powered = [i for i in user_items if i.get("power_on", False)]
+        if not powered:
+            return {"ok": False, "msg": "لا يوجد جهاز شغّال — شغّل جهاز من صفحة أجهزتي أولاً"}, 200
 
-    # شغّل التعدين لجميع الأجهزة المفعّلة
-    changed = False
-    for i in powered:
-        if not i.get("active", False):
-            i["active"] = True
-            i["last_tick"] = now
-            changed = True
+        # شغّل التعدين لجميع الأجهزة المفعّلة
+        changed = []
+        for i in powered:
+            if not i.get("active", False):
+                i["active"] = True
+                i["last_tick"] = now
+                changed.append(i)
 
-    if changed:
-        save_items(items)
+        with user_transaction(username):
+            if changed:
+                save_user_items(username, changed)
 
-    # تحديث حالة التعدين للمستخدم
-    user["mining"] = True
-    update_user(user)
+            # تحديث حالة التعدين للمستخدم
+            rearm_mining(user, user_items, now)
+            user["mining"] = True
+            update_user(user)
 
-    return jsonify({"ok": True, "msg": "تم بدء التعدين", "mining": True})
+    return {"ok": True, "msg": "تم بدء التعدين", "mining": True}, 200
 
 @app.route('/stop_mining')
 def stop_mining():
-    if 'user' not in session:
-        return jsonify({"ok": False}), 401
-    username = session['user']
-    users = load_users()
-    user = next((u for u in users if u.get("username")==username), None)
-    if not user:
-        return jsonify({"ok": False}), 404
+    return api_response(stop_mining_result(session.get('user')))
 
-    items = load_items()
-    changed = False
-    for i in items:
-        if i.get("owner")==username and i.get("active", False):
-            i["active"] = False
-            i["last_tick"] = None
-            changed = True
-    if changed:
-        save_items(items)
+def stop_mining_result(username):
+    if not username:
+        return {"ok": False}, 401
+    with user_unit(username):
+        user = find_user(username)
+        if not user:
+            return {"ok": False}, 404
 
-    user["mining"] = False
-    update_user(user)
+        user_items = get_user_items(username)
+        changed = []
+        for i in user_items:
+            if i.get("active", False):
+                i["active"] = False
+                i["last_tick"] = None
+                changed.append(i)
+
+        with user_transaction(username):
+            if changed:
+                save_user_items(username, changed)
+
+            rearm_mining(user, user_items, int(time.time()))
+            user["mining"] = False
+            update_user(user)
 
-    return jsonify({"ok": True, "msg": "تم إيقاف التعدين", "mining": False})
+    return {"ok": True, "msg": "تم إيقاف التعدين", "mining": False}, 200
 
 # ---------- Mining tick (called by client JS loop while mining on) ----------
+# قراءة فقط: الرصيد بيتحسب من mining_rate و mining_anchor بدون أي كتابة
 @app.route('/mining_tick')
 def mining_tick():
-    if 'user' not in session:
-        return jsonify({"ok": False, "msg": "not logged"})
-    username = session['user']
+    return api_response(mining_tick_result(session.get('user')))
+
+def mining_tick_result(username):
+    if not username:
+        return {"ok": False, "msg": "not logged"}, 200
     if username == "gatapro901":
-        return jsonify({"ok": False, "msg": "admin cannot mine"})
+        return {"ok": False, "msg": "admin cannot mine"}, 200
 
-    users = load_users()
-    user = next((u for u in users if u.get("username")==username), None)
+    user = find_user(username)
     if not user:
-        return jsonify({"ok": False, "msg": "user not found"})
+        return {"ok": False, "msg": "user not found"}, 200
 
     # لو المستخدم مش مُفعّل له تعدين، رجّع رسالة
     if not user.get("mining", False):
-        return jsonify({"ok": False, "msg": "mining not started"})
+        return {"ok": False, "msg": "mining not started"}, 200
 
-    items = load_items()
     now = int(time.time())
-    total_sats_added = 0
-    changed = False
-
-    for i in items:
-        if i.get("owner") != username:
-            continue
-        # فقط الأجهزة التي تم تفعيل التعدين لها (active=True)
-        if not i.get("active", False):
-            continue
-
-        interval = int(i.get("interval", 30))
-        last_tick = i.get("last_tick")
-        if last_tick is None:
-            i["last_tick"] = now
-            changed = True
-            continue
-
-        elapsed = now - int(last_tick)
-        if elapsed < interval:
-            continue
-
-        cycles = elapsed // interval
-        if cycles <= 0:
-            continue
+    if "mining_rate" not in user:
+        with user_unit(username):
+            user = find_user(username)
+            if ensure_accrual_state(user, now):
+                update_user(user)
 
-        sat_per_cycle = int(i.get("sat_per_cycle", 0))
-        sats_gain = cycles * sat_per_cycle
-        total_sats_added += sats_gain
+    return dict(live_stats(user, now), ok=True), 200
 
-        # تقدّم آخر تِك
-        i["last_tick"] = int(last_tick) + cycles * interval
-        changed = True
+def live_stats(user, now):
+    # نفس أرقام mining_tick، محسوبة من حالة التراكم بدون أي كتابة
+    view = accrued_view(user, now)
+    return {
+        "balance": round(float(view.get('balance', 0)), 8),
+        "xp": view.get('xp', 0),
+        "rank": view.get('rank', "مبتدأ"),
+        "sats_added": pending_sats(user, now) if user.get("mining") else 0,
+    }
 
-    if changed:
-        save_items(items)
+def pending_task_count(username):
+    state = load_task_state(username)
+    return sum(1 for t in catalog.TASKS if not state.is_done(t.slot))
+
+# ---------- Live stats stream (Server-Sent Events) ----------
+# اتصال واحد مفتوح بدل fetch كل 3 ثواني؛ الحدث بيتبعت بس لما الأرقام تتغير
+# loop واحدة لكل عملية (StreamHub) بتعمل db.sync وبتقرا المستخدمين اللي ليهم streams
+# مفتوحة (بس اللي نسخة بياناتهم اتغيرت)، والـ streams بتستنى الـ tick وتحسب الأرقام
+# من النسخة المشتركة من غير أي قراءة من التخزين
+STREAM_INTERVAL = float(os.environ.get("STREAM_INTERVAL", "1"))
+STREAM_KEEPALIVE = float(os.environ.get("STREAM_KEEPALIVE", "15"))
+STREAM_TASKS_EVERY = float(os.environ.get("STREAM_TASKS_EVERY", "30"))
+
+class StreamHub:
+    def __init__(self, interval=STREAM_INTERVAL):
+        self.interval = interval
+        self.cond = threading.Condition()
+        self.tick = 0
+        self.watchers = {}   # username → عدد الـ streams المفتوحة
+        self.users = {}      # username → (نسخة البيانات, user)
+        self.tasks = {}      # username → (وقت القراءة, نسخة البيانات, عدد المهام)
+        self.running = False
+
+    def subscribe(self, username):
+        with self.cond:
+            self.watchers[username] = self.watchers.get(username, 0) + 1
+            if not self.running:
+                self.running = True
+                threading.Thread(target=self.run, name="stream-hub", daemon=True).start()
+            return self.tick
+
+    def unsubscribe(self, username):
+        with self.cond:
+            left = self.watchers.get(username, 0) - 1
+            if left > 0:
+                self.watchers[username] = left
+            else:
+                self.watchers.pop(username, None)
+
+    def wait(self, seen, timeout):
+        # الـ tick الجديد بعد seen (أو نفسه لو الوقت خلص)
+        with self.cond:
+            self.cond.wait_for(lambda: self.tick != seen, timeout)
+            return self.tick
+
+    def state(self, username):
+        # (user, عدد المهام) من آخر poll، أو None لو المستخدم لسه ما اتقراش
+        cached, tasks = self.users.get(username), self.tasks.get(username)
+        if cached is None:
+            return None
+        return cached[1], tasks[2] if tasks else 0
+
+    def poll(self):
+        db.sync()
+        now = time.time()
+        data_version = getattr(db, "data_version", None)
+        with self.cond:
+            names = list(self.watchers)
+        for username in names:
+            version = data_version(username) if data_version else None
+            cached = self.users.get(username)
+            if cached is None or version is None or cached[0] != version:
+                self.users[username] = (version, find_user(username))
+            tasks = self.tasks.get(username)
+            if tasks is None or tasks[1] != version or now - tasks[0] >= STREAM_TASKS_EVERY:
+                self.tasks[username] = (now, version, pending_task_count(username))
+        for username in set(self.users) - set(names):
+            self.users.pop(username, None)
+            self.tasks.pop(username, None)
+
+    def run(self):
+        while True:
+            with self.cond:
+                if not self.watchers:
+                    self.running = False
+                    self.users, self.tasks = {}, {}
+                    return
+            try:
+                self.poll()
+            except Exception:
+                app.logger.exception("stream hub poll failed")
+            with self.cond:
+                self.tick += 1
+                self.cond.notify_all()
+            time.sleep(self.interval)
+
+stream_hub = StreamHub()
+
+@app.route('/stream')
+def stream():
+    if 'user' not in session:
+        return jsonify({"ok": False, "msg": "not logged"}), 401
+    username = session['user']
 
-    if total_sats_added > 0:
-        btc_gain = total_sats_added / 100_000_000.0
-        user['balance'] = float(user.get('balance', 0)) + btc_gain
-        xp_gain = (total_sats_added // 6) * 20
-        user['xp'] = int(user.get('xp', 0)) + xp_gain
-        user['rank'] = calculate_rank(user['xp'])
-        save_users(users)
+    def events():
+        seen = stream_hub.subscribe(username)
+        try:
+            last, last_sent = None, time.time()
+            yield "retry: 3000\n\n"
+            while True:
+                seen = stream_hub.wait(seen, STREAM_KEEPALIVE)
+                now = time.time()
+                state = stream_hub.state(username)
+                if state is not None and state[0] is None:
+                    yield "event: end\ndata: {}\n\n"
+                    return
+                stats = None
+                if state is not None:
+                    user, tasks_count = state
+                    stats = dict(live_stats(user, int(now)),
+                                 mining=bool(user.get("mining")),
+                                 pending_tasks=tasks_count)
+                if stats is not None and stats != last:
+                    yield f"data: {json.dumps(stats, ensure_ascii=False)}\n\n"
+                    last, last_sent = stats, now
+                elif now - last_sent >= STREAM_KEEPALIVE:
+                    # تعليق SSE عشان البروكسي ما يقفلش الاتصال
+                    yield ": keepalive\n\n"
+                    last_sent = now
+        finally:
+            stream_hub.unsubscribe(username)
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# ---------- Leaderboard API ----------
+# /api/leaderboard?page=1&per_page=50
+@app.route('/api/leaderboard')
+def api_leaderboard():
+    if 'user' not in session:
+        return jsonify({"ok": False, "msg": "not logged"}), 401
+    try:
+        page = max(1, int(request.args.get("page", 1)))
+        per_page = min(200, max(1, int(request.args.get("per_page", LEADERBOARD_SIZE))))
+    except ValueError:
+        return jsonify({"ok": False, "msg": "bad page"}), 400
+
+    offset = (page - 1) * per_page
+    board = db.leaderboard(offset, per_page, exclude=LEADERBOARD_EXCLUDE)
+    total = db.leaderboard_size(exclude=LEADERBOARD_EXCLUDE)
+    username = session['user']
+    me = find_user(username)
 
     return jsonify({
         "ok": True,
-        "balance": round(float(user.get('balance', 0)), 8),
-        "xp": user.get('xp', 0),
-        "rank": user.get('rank', "مبتدأ"),
-        "sats_added": total_sats_added
+        "page": page,
+        "per_page": per_page,
+        "total": total,
+        "users": [
+            {"rank": offset + n, "username": u.get("username"), "balance": round(float(u.get("balance", 0)), 8)}
+            for n, u in enumerate(board, start=1)
+        ],
+        "me": {
+            "rank": db.leaderboard_rank(username, exclude=LEADERBOARD_EXCLUDE),
+            "balance": round(float(me.get("balance", 0)), 8) if me else 0.0,
+        },
     })
-    
+
 # ---------- Withdraw ----------
 @app.route("/withdraw")
+@locked_to_user
 def withdraw():
     if 'user' not in session:
         return jsonify({"balance":0.0,"xp":0,"rank":"مبتدأ"})
@@ -826,7 +1368,8 @@ def withdraw():
     user = find_user(username)
     if not user:
         return jsonify({"balance":0.0,"xp":0,"rank":"مبتدأ"})
-    user['balance'] = 0.0
+    settle_mining(user, int(time.time()))
+    post_ledger(user, -user_sats(user), "withdraw")
     user['xp'] = 0
     user['rank'] = "مبتدأ"
     update_user(user)
@@ -834,6 +1377,7 @@ def withdraw():
 
 # ---------- Settings ----------
 @app.route("/settings", methods=["GET","POST"])
+@locked_to_user
 def settings():
     if 'user' not in session:
         return redirect(url_for("login"))
@@ -855,15 +1399,16 @@ def settings():
         if new_username != user['username'] and find_user(new_username):
             return render_template("settings.html", user=user, msg="هذا الاسم مستخدم بالفعل")
 
+        old_username = user['username']
         user['username']=new_username
         user['password']=new_password
         user['currency']=new_currency
         user['theme']=new_theme
-        update_user(user)
+        update_user(user, old_username=old_username)
         session['user']=new_username
         return redirect(url_for("dashboard"))
 
-    return render_template("settings.html", user=user)
+    return user_page("settings", username, lambda: render_template("settings.html", user=user))
 
 # ---------- Delete Account ----------
 @app.route("/delete_my_account", methods=["POST"])
@@ -878,14 +1423,17 @@ def delete_my_account():
     return redirect(url_for("login"))
 
 # ---------- Store ----------
+BUY_MAX_QTY = int(os.environ.get("BUY_MAX_QTY", "100"))   # أقصى عدد أجهزة في عملية شراء واحدة
+
 @app.route("/store")
 def store():
     if 'user' not in session:
         return redirect(url_for("login"))
-    # send store catalog to template
-    return render_template("store.html", items=STORE_ITEMS)
+    # الصفحة ثابتة لكل المستخدمين → متحضّرة مرة واحدة + ETag
+    return prerendered("store.html", items=catalog.TIERS, buy_max_qty=BUY_MAX_QTY)
 
 @app.route("/buy_item/<int:item_id>")
+@locked_to_user
 def buy_item(item_id):
     if 'user' not in session:
         return redirect(url_for("login"))
@@ -894,20 +1442,27 @@ def buy_item(item_id):
     if not user:
         return redirect(url_for("login"))
 
-    store_item = next((i for i in STORE_ITEMS if i["id"]==item_id),None)
-    if store_item is None:
+    tier = catalog.tier(item_id)
+    if tier is None:
         return redirect(url_for("store"))
+    # ?qty=N: N أجهزة من نفس الفئة بخصم واحد وكتابة واحدة
+    qty = max(1, min(request.args.get("qty", 1, type=int) or 1, BUY_MAX_QTY))
 
-    # التحقق من الرصيد
-    if user.get("balance",0) < store_item["price"]:
-        return render_template("store.html", items=STORE_ITEMS, msg="رصيد غير كافٍ")
-    
-    # خصم السعر
-    user["balance"] -= store_item["price"]
-    update_user(user)
+    # اللي اتعدّن لحد دلوقتي بيتحسب في الرصيد قبل الشراء
+    settle_mining(user, int(time.time()))
+
+    # التحقق من الرصيد (بالساتوشي عشان مفيش أخطاء float)
+    price_sats = tier.price_sats * qty
+    if user_sats(user) < price_sats:
+        return render_template("store.html", items=catalog.TIERS, buy_max_qty=BUY_MAX_QTY, msg="رصيد غير كافٍ")
     
-    # إضافة الجهاز للمستخدم
-    add_item_to_user(username, store_item)
+    with user_transaction(username):
+        # خصم السعر
+        post_ledger(user, -price_sats, "purchase", str(item_id) if qty == 1 else f"{item_id}x{qty}")
+        update_user(user)
+
+        # إضافة الأجهزة للمستخدم
+        add_item_to_user(username, tier, qty)
     
     return redirect(url_for("items"))
 # ---------- User Items ----------
@@ -917,20 +1472,20 @@ def items():
         return redirect(url_for("login"))
 
     username = session["user"]
-    user_items = get_user_items(username)
-
-    return render_template("items.html", items=user_items)
+    return user_page("items", username,
+                     lambda: render_template("items.html", items=get_user_items(username)))
 
 @app.route("/toggle_item/<item_id>")
+@locked_to_user
 def toggle_item(item_id):
     if 'user' not in session:
         return jsonify({"ok":False})
     username = session['user']
-    items = load_items()
+    user_items = get_user_items(username)
     new_active = False
     msg = "الجهاز غير موجود"
-    for i in items:
-        if i.get("id")==item_id and i.get("owner")==username:
+    for i in user_items:
+        if i.get("id")==item_id:
             new_active = not bool(i.get("active", False))
             i["active"] = new_active
             if new_active:
@@ -939,9 +1494,8 @@ def toggle_item(item_id):
             else:
                 i["last_tick"] = None
                 msg = "تم إيقاف الجهاز وإيقاف التعدين"
+            save_device_state(username, user_items, [i])
             break
-    save_items(items)
-    user = find_user(username)
     return jsonify({"ok":True, "active": new_active, "message": msg})
 
 @app.route("/device_tick/<item_id>")
@@ -950,64 +1504,229 @@ def device_tick(item_id):
         return jsonify({"ok":False})
 
     username = session['user']
-    items = load_items()
-    users = load_users()
-
-    user = None
-    for u in users:
-        if u["username"] == username:
-            user = u
-            break
-
+    user = find_user(username)
     if not user:
         return jsonify({"ok":False, "msg":"user not found"})
 
-    for i in items:
-        if i.get("id") == item_id and i.get("owner") == username and i.get("active", False):
-            user["balance"] += float(i["sat_per_cycle"]) / 100_000_000
-            break
+    # الرصيد بيتحسب من محرك التعدين، الـ tick هنا قراءة فقط
+    view = accrued_view(user, int(time.time()))
+    return jsonify({"ok":True, "balance": view["balance"]})
+
+# ---------- Admin paging ----------
+# صفحات بمؤشر (keyset) بدل تحميل كل المستخدمين والأجهزة في صفحة واحدة
+# ?sort=balance|xp|username &blocked=0|1 &mining=0|1 &rank=.. &min_balance=.. &max_balance=.. (BTC)
+# أجهزة: ?owner=.. &store_id=.. &active=0|1 &power_on=0|1
+# المؤشر (after) هو مفتاح الترتيب بتاع آخر صف في الصفحة
+ADMIN_PAGE_SIZE = int(os.environ.get("ADMIN_PAGE_SIZE", "50"))
+ADMIN_PAGE_MAX = 500
+EXPORT_BATCH = 1000
+USER_EXPORT_FIELDS = ("username", "balance", "balance_sats", "xp", "rank", "blocked", "mining",
+                      "created_at", "last_login")
+ITEM_EXPORT_FIELDS = ("id", "owner", "store_id", "name", "price", "active", "power_on",
+                      "sat_per_cycle", "interval", "last_tick", "created_at")
+PRIVATE_FIELDS = ("password", "_ledger")
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode("utf-8")).decode("ascii")
+
+# شكل مفتاح الترتيب لكل sort (storage.user_sort_key / item_sort_key)
+USER_CURSOR_TYPES = {"balance": (int, str), "xp": (int, str), "username": (str,)}
+ITEM_CURSOR_TYPES = (str,)
+
+def decode_cursor(cursor, types):
+    # مؤشر مش على شكل مفتاح الترتيب (sort اتغير أو متلعب فيه) → من أول الصفحة
+    if not cursor:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not isinstance(key, list) or len(key) != len(types):
+        return None
+    if not all(isinstance(v, t) and not isinstance(v, bool) for v, t in zip(key, types)):
+        return None
+    return tuple(key)
+
+def _flag(args, name):
+    value = args.get(name, "")
+    return None if value == "" else value in ("1", "true", "yes", "on")
+
+def admin_user_query(args):
+    sort = args.get("sort", "balance")
+    if sort not in storage.USER_SORTS:
+        sort = "balance"
+    filters = {
+        "blocked": _flag(args, "blocked"),
+        "mining": _flag(args, "mining"),
+        "rank": args.get("rank") or None,
+        "min_sats": to_sats(args["min_balance"]) if args.get("min_balance") else None,
+        "max_sats": to_sats(args["max_balance"]) if args.get("max_balance") else None,
+    }
+    return filters, sort
+
+def admin_item_query(args):
+    return {
+        "owner": args.get("owner") or None,
+        "store_id": args.get("store_id", type=int),
+        "active": _flag(args, "active"),
+        "power_on": _flag(args, "power_on"),
+    }
 
-    save_users(users)
-    return jsonify({"ok":True, "balance": user["balance"]})
+def _page_size(args):
+    return max(1, min(args.get("limit", ADMIN_PAGE_SIZE, type=int) or ADMIN_PAGE_SIZE, ADMIN_PAGE_MAX))
+
+def admin_users_page(args):
+    filters, sort = admin_user_query(args)
+    limit = _page_size(args)
+    # صف زيادة عشان نعرف فيه صفحة بعدها ولا لأ
+    rows = db.page_users(filters, sort, decode_cursor(args.get("after"), USER_CURSOR_TYPES[sort]), limit + 1)
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return rows, encode_cursor(storage.user_sort_key(rows[-1], sort)) if more else None
+
+def admin_items_page(args):
+    filters = admin_item_query(args)
+    limit = _page_size(args)
+    rows = db.page_items(filters, decode_cursor(args.get("after"), ITEM_CURSOR_TYPES), limit + 1)
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return rows, encode_cursor(storage.item_sort_key(rows[-1])) if more else None
+
+def _public(row):
+    return {k: v for k, v in row.items() if k not in PRIVATE_FIELDS}
+
+def _next_url(endpoint, cursor):
+    if cursor is None:
+        return None
+    args = request.args.to_dict()
+    args["after"] = cursor
+    return url_for(endpoint, **args)
+
+def export_rows(page, key):
+    # دفعات بالمؤشر: الذاكرة ثابتة مهما كان حجم الجدول، ومفيش قراءة طويلة مفتوحة على الـ DB
+    after = None
+    while True:
+        rows = page(after, EXPORT_BATCH)
+        yield from rows
+        if len(rows) < EXPORT_BATCH:
+            return
+        after = key(rows[-1])
+
+def csv_lines(rows, fields):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(fields)
+    for row in rows:
+        writer.writerow([row.get(f, "") for f in fields])
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    yield buf.getvalue()
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(_public(row), ensure_ascii=False) + "\n"
 
 # ---------- Admin (basic) ----------
 @app.route("/admin")
 def admin():
     if 'user' not in session or session['user']!="gatapro901":
         return redirect(url_for("login"))
-    users = load_users()
-    return render_template("admin.html", users=users)
+    users, cursor = admin_users_page(request.args)
+    return render_template("admin.html", users=users, next_url=_next_url("admin", cursor))
 
 # ---------- Admin Advanced (new route) ----------
 @app.route("/admin_advanced")
 def admin_advanced():
     if 'user' not in session or session['user']!="gatapro901":
         return redirect(url_for("login"))
-    users = load_users()
-    # sort by balance desc
-    users.sort(key=lambda x: float(x.get("balance",0)), reverse=True)
-    items = load_items()
-    return render_template("admin_advanced.html", users=users, items=items)
+    # sorted by balance desc (leaderboard index)
+    users, cursor = admin_users_page(request.args)
+    return render_template("admin_advanced.html", users=users, next_url=_next_url("admin_advanced", cursor),
+                           args=request.args)
+
+@app.route("/admin/api/users")
+def admin_api_users():
+    if 'user' not in session or session['user']!="gatapro901":
+        return jsonify({"error": "forbidden"}), 403
+    users, cursor = admin_users_page(request.args)
+    return jsonify({"users": [_public(u) for u in users], "next": cursor})
+
+@app.route("/admin/api/items")
+def admin_api_items():
+    if 'user' not in session or session['user']!="gatapro901":
+        return jsonify({"error": "forbidden"}), 403
+    items, cursor = admin_items_page(request.args)
+    return jsonify({"items": items, "next": cursor})
+
+@app.route("/admin/export/<table>.<fmt>")
+def admin_export(table, fmt):
+    if 'user' not in session or session['user']!="gatapro901":
+        return redirect(url_for("login"))
+    if table == "users":
+        filters, sort = admin_user_query(request.args)
+        rows = export_rows(lambda after, n: db.page_users(filters, sort, after, n),
+                           lambda u: storage.user_sort_key(u, sort))
+        fields = USER_EXPORT_FIELDS
+    elif table == "items":
+        filters = admin_item_query(request.args)
+        rows = export_rows(lambda after, n: db.page_items(filters, after, n), storage.item_sort_key)
+        fields = ITEM_EXPORT_FIELDS
+    else:
+        return "unknown table", 404
+    if fmt == "csv":
+        body, mimetype = csv_lines(rows, fields), "text/csv"
+    elif fmt == "ndjson":
+        body, mimetype = ndjson_lines(rows), "application/x-ndjson"
+    else:
+        return "unknown format", 404
+    return Response(body, mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename={table}.{fmt}"})
+
+# ---------- Readiness ----------
+# الـ load balancer يبعت للـ worker لما الكاش يسخن: 200، وقبلها 503 + التقدم
+@app.route("/ready")
+def ready():
+    status = storage.warmup_status(db)
+    return jsonify(status), 200 if status["ready"] else 503
+
+# ---------- Metrics (METRICS=1) ----------
+# Prometheus بيقرا بـ Authorization: Bearer $METRICS_TOKEN، أو الأدمن من المتصفح
+@app.route("/metrics")
+def metrics_page():
+    if not metrics.authorized(session.get('user'), request.headers.get("Authorization")):
+        return "forbidden", 403
+    if not metrics.METRICS:
+        return "metrics disabled (METRICS=1)", 404
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/metrics/profiles")
+def metrics_profiles():
+    if not metrics.authorized(session.get('user'), request.headers.get("Authorization")):
+        return "forbidden", 403
+    return Response(metrics.profiles_text(), mimetype="text/plain")
 
 # ---------- Admin Actions ----------
 @app.route("/admin_block/<username>")
 def admin_block(username):
     if 'user' not in session or session['user']!="gatapro901":
         return redirect(url_for("login"))
-    user = find_user(username)
-    if user:
-        user['blocked'] = True
-        update_user(user)
+    with db.user_lock(username):
+        user = find_user(username)
+        if user:
+            user['blocked'] = True
+            update_user(user)
     return redirect(url_for("admin"))
 
 @app.route("/admin_unblock/<username>")
 def admin_unblock(username):
     if 'user' not in session or session['user']!="gatapro901":
         return redirect(url_for("login"))
-    user = find_user(username)
-    if user:
-        user['blocked'] = False
-        update_user(user)
+    with db.user_lock(username):
+        user = find_user(username)
+        if user:
+            user['blocked'] = False
+            update_user(user)
     return redirect(url_for("admin"))
 
 @app.route("/admin_delete/<username>")
@@ -1021,19 +1740,22 @@ def admin_delete(username):
 def admin_update(username):
     if 'user' not in session or session['user'] != "gatapro901":
         return redirect(url_for("login"))
-    user = find_user(username)
-    if not user:
-        return redirect(url_for("admin"))
-    try:
-        new_balance = float(request.form.get("balance", user.get("balance",0)))
-        new_xp = int(request.form.get("xp", user.get("xp",0)))
-        new_rank = request.form.get("rank", user.get("rank","مبتدأ"))
-        user["balance"] = new_balance
-        user["xp"] = new_xp
-        user["rank"] = new_rank
-        update_user(user)
-    except:
-        pass
+    with db.user_lock(username):
+        user = find_user(username)
+        if not user:
+            return redirect(url_for("admin"))
+        try:
+            new_sats = to_sats(float(request.form.get("balance", user.get("balance",0))))
+            new_xp = int(request.form.get("xp", user.get("xp",0)))
+            new_rank = request.form.get("rank", user.get("rank","مبتدأ"))
+            # القيم الجديدة بتبدأ من دلوقتي (اللي اتعدّن قبلها بيتحسب الأول)
+            settle_mining(user, int(time.time()))
+            post_ledger(user, new_sats - user_sats(user), "admin_adjustment", session['user'])
+            user["xp"] = new_xp
+            user["rank"] = new_rank
+            update_user(user)
+        except:
+            pass
     return redirect(url_for("admin_advanced"))
 
 # ---------- Backwards-compatible simple routes used by some templates ----------
@@ -1050,61 +1772,31 @@ def delete_user(username):
     return redirect(url_for("admin_delete", username=username))
 
 # ---------- Buy Pages Routes ----------
-@app.route("/buy_page/1")
-def buy_page_1():
-    return render_template("buy_1.html")
-
-@app.route("/buy_page/2")
-def buy_page_2():
-    return render_template("buy_2.html")
-
-@app.route("/buy_page/3")
-def buy_page_3():
-    return render_template("buy_3.html")
-
-@app.route("/buy_page/4")
-def buy_page_4():
-    return render_template("buy_4.html")
-
-@app.route("/buy_page/5")
-def buy_page_5():
-    return render_template("buy_5.html")
-
-@app.route("/buy_page/6")
-def buy_page_6():
-    return render_template("buy_6.html")
-
-@app.route("/buy_page/7")
-def buy_page_7():
-    return render_template("buy_7.html")
-
-@app.route("/buy_page/8")
-def buy_page_8():
-    return render_template("buy_8.html")
+@app.route("/buy_page/<int:n>")
+def buy_page(n):
+    if catalog.tier(n) is None:
+        return redirect(url_for("store"))
+    return prerendered(f"buy_{n}.html")
 
 # ==================== ROUTES الجديدة للأجهزة ====================
 
 #تشغيل / إيقاف تشغيل الجهاز
 @app.route('/toggle_power/<item_id>')
+@locked_to_user
 def toggle_power(item_id):
     if 'user' not in session:
         return jsonify({"error": "Unauthorized"}), 401
     username = session['user']
 
-    items = load_items()
-    item = next((i for i in items if str(i.get("id")) == str(item_id) and i.get("owner") == username), None)
+    user_items = get_user_items(username)
+    item = next((i for i in user_items if str(i.get("id")) == str(item_id)), None)
     if not item:
         return jsonify({"error": "Item not found or not yours"}), 404
 
-    # قلب حالة التشغيل
-    item["power_on"] = not bool(item.get("power_on", False))
+    # قلب حالة التشغيل (الإطفاء بيوقف التعدين كمان)
+    apply_device_action(item, "power_off" if item.get("power_on", False) else "power_on", int(time.time()))
 
-    # لو طفيت الجهاز نضمن إنه موقّف من التعدين كمان
-    if not item["power_on"]:
-        item["active"] = False
-        item["last_tick"] = None
-
-    save_items(items)
+    save_device_state(username, user_items, [item])
 
     if item["power_on"]:
         return jsonify({"message": f"تم تشغيل الجهاز {item.get('name')}", "active": True})
@@ -1113,34 +1805,121 @@ def toggle_power(item_id):
         
 # تبديل حالة التعدين على جهاز محدد (بتفعيل الجهاز لازم)
 @app.route('/toggle_mining/<item_id>')
+@locked_to_user
 def toggle_mining(item_id):
     if 'user' not in session:
         return jsonify({"error":"Unauthorized"}), 401
     username = session['user']
 
-    items = load_items()
-    item = next((i for i in items if str(i.get("id")) == str(item_id) and i.get("owner") == username), None)
+    user_items = get_user_items(username)
+    item = next((i for i in user_items if str(i.get("id")) == str(item_id)), None)
     if not item:
         return jsonify({"error":"Item not found or not yours"}), 404
 
     if not item.get("power_on", False):
         return jsonify({"message":"شغل الجهاز الأول قبل التعدين", "mining": False})
 
-    item["active"] = not bool(item.get("active", False))
-    if item["active"]:
-        item["last_tick"] = int(time.time())
-    else:
-        item["last_tick"] = None
-    save_items(items)
+    apply_device_action(item, "mine_stop" if item.get("active", False) else "mine_start", int(time.time()))
+    save_device_state(username, user_items, [item])
 
     return jsonify({"message": f"{'تم بدء' if item['active'] else 'تم إيقاف'} التعدين على جهاز {item.get('name')}", "mining": item["active"]})
 
+# ---------- Bulk device actions ----------
+# مستخدم عنده مئات الأجهزة: طلب واحد بدل طلب لكل جهاز
+# {"action": "power_on" | "power_off" | "mine_start" | "mine_stop",
+#  "ids": [...] أو "store_id": n أو "all": true}
+# كل الأجهزة اللي اتغيرت بتتكتب في معاملة واحدة مع إعادة حساب معدل التعدين مرة واحدة
+BULK_ACTIONS = ("power_on", "power_off", "mine_start", "mine_stop")
+
+def apply_device_action(item, action, now):
+    # بترجع None لو اتطبق، أو سبب الرفض
+    if action == "power_on":
+        item["power_on"] = True
+    elif action == "power_off":
+        item["power_on"] = False
+        item["active"] = False
+        item["last_tick"] = None
+    elif action == "mine_start":
+        if not item.get("power_on", False):
+            return "powered_off"
+        if not item.get("active", False):
+            item["active"] = True
+            item["last_tick"] = now
+    elif action == "mine_stop":
+        item["active"] = False
+        item["last_tick"] = None
+    else:
+        return "unknown_action"
+    return None
+
+def _bulk_params():
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        return data
+    form = request.form
+    return {"action": form.get("action"), "ids": form.getlist("ids"),
+            "store_id": form.get("store_id"), "all": form.get("all") in ("1", "true", "on")}
+
+@app.route('/items/bulk', methods=["POST"])
+@locked_to_user
+def items_bulk():
+    if 'user' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    username = session['user']
+    params = _bulk_params()
+    action = params.get("action")
+    if action not in BULK_ACTIONS:
+        return jsonify({"error": "unknown action", "actions": list(BULK_ACTIONS)}), 400
+
+    user_items = get_user_items(username)
+    results = []
+    if params.get("all"):
+        targets = user_items
+    elif params.get("store_id") not in (None, ""):
+        try:
+            store_id = int(params["store_id"])
+        except (TypeError, ValueError):
+            return jsonify({"error": "bad store_id"}), 400
+        targets = [i for i in user_items if i.get("store_id") == store_id]
+    elif isinstance(params.get("ids"), list) and params["ids"]:
+        by_id = {str(i.get("id")): i for i in user_items}
+        targets = []
+        for item_id in dict.fromkeys(str(x) for x in params["ids"]):
+            item = by_id.get(item_id)
+            if item is None:
+                results.append({"id": item_id, "ok": False, "error": "not_found"})
+            else:
+                targets.append(item)
+    else:
+        return jsonify({"error": "ids, store_id or all required"}), 400
+
+    now = int(time.time())
+    changed = []
+    for item in targets:
+        before = (item.get("power_on", False), item.get("active", False), item.get("last_tick"))
+        error = apply_device_action(item, action, now)
+        if error:
+            results.append({"id": item.get("id"), "ok": False, "error": error})
+            continue
+        if (item.get("power_on", False), item.get("active", False), item.get("last_tick")) != before:
+            changed.append(item)
+        results.append({"id": item.get("id"), "ok": True,
+                        "power_on": bool(item.get("power_on")), "active": bool(item.get("active"))})
+
+    if changed:
+        save_device_state(username, user_items, changed)
+    return jsonify({"ok": True, "action": action, "changed": len(changed), "results": results})
+
 @app.route('/tasks')
 def tasks_page():
     if 'user' not in session:
         return redirect(url_for('login'))
 
     username = session['user'].strip().lower()  # توحيد الاسم
+    # المهام اليومية بتتصفر مع اليوم → اليوم جزء من المفتاح
+    return user_page("tasks", username, lambda: render_tasks_page(username), extra=(today_number(),))
+
+def render_tasks_page(username):
     tasks = get_user_tasks(username)  # جلب المهام الخاصة بالمستخدم
 
     # التأكد من صيغة المكافأة للساتوشي
@@ -1154,30 +1933,31 @@ def tasks_page():
 
 @app.route('/complete_task/<condition>')
 def complete_task(condition):
-    if 'user' not in session:
-        return jsonify({"ok": False, "msg": "غير مسجل دخول"}), 401
-
-    username = session['user'].strip().lower()
-
-    # جلب المستخدم
-    users = load_users()
-    user = next((u for u in users if u.get("username","").strip().lower() == username), None)
+    return api_response(complete_task_result(session.get('user'), condition))
+
+def complete_task_result(session_user, condition):
+    if not session_user:
+        return {"ok": False, "msg": "غير مسجل دخول"}, 401
+    with user_unit(session_user):
+        return _complete_task(session_user.strip(), condition)
+
+def _complete_task(username, condition):
+    # جلب المستخدم - بالاسم زي ما هو في الجلسة عشان find_user/load_task_state/user_transaction
+    # يلاقوا الـ unit (الاسم lowercase كان بيفتح معاملة زيادة لـ "Alice")
+    user = find_user(username) or db.get_user_ci(username)
     if not user:
-        return jsonify({"ok": False, "msg": "مستخدم غير موجود"})
+        return {"ok": False, "msg": "مستخدم غير موجود"}, 200
+    username = user.get("username", username).strip()
 
-    # جلب المهام الخاصة بالمستخدم
-    tasks_data = load_tasks()
-    if username not in tasks_data:
-        tasks_data[username] = [dict(t) for t in DEFAULT_TASKS]
-        save_tasks(tasks_data)
+    # جلب حالة المهام الخاصة بالمستخدم
+    state = load_task_state(username)
 
-    user_tasks = tasks_data[username]
-    task = next((t for t in user_tasks if t.get("condition") == condition), None)
+    task = catalog.task_for(condition)
     if not task:
-        return jsonify({"ok": False, "msg": "المهمة غير موجودة"})
+        return {"ok": False, "msg": "المهمة غير موجودة"}, 200
 
-    if task.get("completed", False):
-        return jsonify({"ok": False, "msg": "المهمة مكتملة مسبقًا"})
+    if state.is_done(task.slot):
+        return {"ok": False, "msg": "المهمة مكتملة مسبقًا"}, 200
 
     # ===== تحقق من شرط المهمة =====
     condition_ok = False
@@ -1192,7 +1972,7 @@ def complete_task(condition):
             needed = int(condition.replace("buy_", "").replace("_items",""))
         except:
             needed = 0
-        user_items = [i for i in load_items() if str(i.get("owner","")).strip().lower() == username]
+        user_items = get_user_items(username)
         if len(user_items) >= needed:
             condition_ok = True
         else:
@@ -1211,67 +1991,52 @@ def complete_task(condition):
             msg_fail = "يجب تسجيل الدخول 30 يومًا متتالية"
 
     if not condition_ok:
-        return jsonify({"ok": False, "msg": msg_fail})
+        return {"ok": False, "msg": msg_fail}, 200
 
     # ===== إتمام المهمة =====
-    task["completed"] = True
+    state.mark(task.slot, today_number())
 
-    if task.get("type") == "btc":
-        reward = float(task.get("reward",0))
-        user["balance"] = float(user.get("balance",0)) + reward
-        user["balance"] = float(f"{user['balance']:.8f}")  # ساتوشي
+    if task.type == "btc":
+        post_ledger(user, to_sats(task.reward), "task_reward", condition)
 
-    elif task.get("type") == "xp":
-        reward = int(task.get("reward",0))
+    elif task.type == "xp":
+        reward = int(task.reward)
         user["xp"] = int(user.get("xp",0)) + reward
         user["rank"] = calculate_rank(user["xp"])
 
     # حفظ البيانات
-    tasks_data[username] = user_tasks
-    save_tasks(tasks_data)
-    save_users(users)
+    with user_transaction(username):
+        save_task_state(username, state)
+        update_user(user)
+
+    return {"ok": True, "msg": f"تم إكمال المهمة: {task.title or '(بدون عنوان)'} 🎉"}, 200
 
-    return jsonify({"ok": True, "msg": f"تم إكمال المهمة: {task.get('title','(بدون عنوان)')} 🎉"})
-            
 @app.route('/pending_tasks_count')
 def pending_tasks_count():
-    if 'user' not in session:
-        return jsonify({"ok": False, "msg": "غير مسجل دخول", "count": 0})
-
-    username = session['user']
-    tasks = load_tasks()  # افترض إن عندك دالة load_tasks() بترجع كل المهام
-    count = 0
+    return api_response(pending_tasks_count_result(session.get('user')))
 
-    for task in tasks:
-        # كل مهمة فيها حقل completed لكل مستخدم (مثلاً task["completed_by"] = ["user1", "user2"])
-        completed_users = task.get("completed_by", [])
-        if username not in completed_users:
-            count += 1
-
-    return jsonify({"ok": True, "count": count})
+def pending_tasks_count_result(username):
+    if not username:
+        return {"ok": False, "msg": "غير مسجل دخول", "count": 0}, 200
+    return {"ok": True, "count": pending_task_count(username)}, 200
 
 @app.route('/tasks_status')
 def tasks_status():
-    if 'user' not in session:
-        return jsonify({"ok": False})
+    username = session.get('user')
+    if not username:
+        return api_response(tasks_status_result(username))
+    return user_page("tasks_status", username,
+                     lambda: jsonify(tasks_status_result(username)[0]).get_data(),
+                     mimetype="application/json", extra=(today_number(),))
 
-    username = session['user'].strip().lower()
+def tasks_status_result(username):
+    if not username:
+        return {"ok": False}, 200
 
-    # جلب بيانات المهام
-    tasks_data = load_tasks()
-    if username not in tasks_data or not tasks_data[username]:
-        # إنشاء نسخة جديدة للمستخدم
-        tasks_data[username] = [dict(t, completed=False) for t in DEFAULT_TASKS]
-        save_tasks(tasks_data)
+    # التعريفات من الكتالوج + bitset المستخدم (مستخدم جديد = ولا مهمة مكتملة، من غير كتابة)
+    user_tasks = get_user_tasks(username.strip().lower())
 
-    user_tasks = tasks_data[username]
-
-    # التأكد من وجود مفتاح "completed" لكل مهمة
-    for t in user_tasks:
-        if "completed" not in t:
-            t["completed"] = False
-
-    return jsonify({"ok": True, "tasks": user_tasks})
+    return {"ok": True, "tasks": user_tasks, "version": catalog.TASKS_VERSION}, 200
     
     # أرشادات للمستخدم الجديد
     show_guide = all(not t['completed'] for t in user_tasks[:1])  # لو أول مهمة مش مكتملة
@@ -1279,8 +2044,122 @@ def tasks_status():
 
 # =======================================================================
 
+# ---------- Storage CLI ----------
+# flask --app main import-json  → استيراد users.json / items.json / tasks.json
+@app.cli.command("import-json")
+def import_json_command():
+    if db.name != "sqlite":
+        print("STORAGE_BACKEND=json: الملفات هي التخزين نفسه، مفيش حاجة نستوردها")
+        return
+    users, items, tasks = storage.import_json(db, USERS_FILE, ITEMS_FILE, TASKS_FILE)
+    print(f"imported {users} users, {items} items, {tasks} task lists into {db.path}")
+
+# flask --app main cache-snapshot  → كتابة snapshot للكاش (التشغيل الجاي بيتحمّل منه)
+@app.cli.command("cache-snapshot")
+@click.option("--path", default=storage.SNAPSHOT_FILE or "cache.snapshot", show_default=True)
+def cache_snapshot_command(path):
+    if not storage.STORAGE_CACHE:
+        print("STORAGE_CACHE=0: مفيش كاش نعمله snapshot")
+        return
+    db.wait_ready()
+    started = time.time()
+    header = db.write_snapshot(path)
+    print(f"wrote {header['rows']} rows in {header['pages']} pages to {path} "
+          f"({os.path.getsize(path)} bytes, {time.time() - started:.2f}s)")
+
+# flask --app main compact-items  → دمج items.journal في items.json (STORAGE_BACKEND=json)
+@app.cli.command("compact-items")
+def compact_items_command():
+    if db.name != "json":
+        print("STORAGE_BACKEND=sqlite: الأجهزة بتتكتب صف صف، مفيش journal")
+        return
+    started = time.time()
+    folded = db.compact_items()
+    print(f"folded {folded} journal records into {ITEMS_FILE} ({time.time() - started:.2f}s)")
+
+# flask --app main export-json  → كتابة ملفات JSON من قاعدة البيانات
+@app.cli.command("export-json")
+def export_json_command():
+    users, items, tasks = storage.export_json(db, USERS_FILE, ITEMS_FILE, TASKS_FILE)
+    print(f"exported {users} users, {items} items, {tasks} task lists")
+
+# flask --app main mining-scheduler  → تشغيل الـ scheduler يدوي (أو --once من cron) على نفس
+# الجهاز اللي عليه data.db و.locks؛ في الـ deploy العادي بيشتغل جوه الـ web (gunicorn.conf.py)
+@app.cli.command("mining-scheduler")
+@click.option("--once", is_flag=True, help="تسوية كل الأجهزة الشغالة مرة واحدة والخروج")
+def mining_scheduler_command(once):
+    scheduler = MiningScheduler()
+    if once:
+        now = int(time.time())
+        scheduler.load(now)
+        owners = list(scheduler.due)
+        settled = scheduler.settle_batches(owners, now)
+        print(f"settled {settled} of {len(owners)} mining users")
+        return
+    print(f"mining scheduler running (cadence {scheduler.cadence}s, poll {scheduler.poll_every}s)")
+    scheduler.run_exclusive()
+
+# flask --app main simulate --users 100000 --days 7  → توقع الصرف والحمل قبل تغيير الأسعار
+@app.cli.command("simulate")
+@click.option("--users", default=10000, help="عدد المستخدمين")
+@click.option("--days", default=7.0, help="مدة المحاكاة بالأيام")
+@click.option("--devices", default=3.0, help="متوسط الأجهزة لكل مستخدم في البداية")
+@click.option("--mix", default=None, help="أوزان الفئات: 1:50,2:30,8:1")
+@click.option("--active", default=0.8, help="نسبة المستخدمين اللي مشغلين التعدين")
+@click.option("--online", default=0.1, help="نسبة المستخدمين الفاتحين الموقع")
+@click.option("--buys", default=0.5, help="مشتريات لكل مستخدم في اليوم")
+@click.option("--logins", default=0.7, help="احتمال الدخول اليومي")
+@click.option("--step", default=3600, help="خطوة المحاكاة بالثواني")
+@click.option("--seed", default=0)
+def simulate_command(**options):
+    # numpy اختياري (في requirements.txt بس الموقع نفسه مش محتاجه): الـ try على الـ import بس،
+    # عشان أي ImportError تاني جوه المحاكاة يبان زي ما هو
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        raise click.ClickException("simulate محتاج numpy: pip install numpy")
+    import simulate
+    tiers = []
+    for i in catalog.TIERS:
+        tiers.append({"id": i.id, "price_sats": i.price_sats,
+                      "sat_per_cycle": i.sat_per_cycle, "interval": i.interval})
+    report = simulate.run(tiers, DEFAULT_TASKS, calculate_rank, to_sats,
+                          cadence=SCHEDULER_CADENCE, stream_interval=STREAM_INTERVAL, **options)
+    print(json.dumps(report, indent=4, ensure_ascii=False))
+
+# flask --app main reconcile-ledger  → مراجعة كل الأرصدة مقابل مجموع القيود
+@app.cli.command("reconcile-ledger")
+def reconcile_ledger_command():
+    # المستخدمين اللي لسه ملهمش قيود بياخدوا قيد افتتاحي الأول
+    # (تحت قفل المستخدم وبقراءة جديدة، عشان ما نكتبش فوق شراء أو تسوية من worker شغال)
+    opened = 0
+    for name in [u.get("username", "").strip() for u in load_users() if "balance_sats" not in u]:
+        with db.user_lock(name):
+            user = find_user(name)
+            if user and open_ledger(user):
+                update_user(user)
+                opened += 1
+
+    totals = {}
+    entries = 0
+    for e in db.scan_ledger():
+        totals[e["username"]] = totals.get(e["username"], 0) + int(e["sats"])
+        entries += 1
+
+    mismatched = 0
+    for user in load_users():
+        username = user.get("username", "").strip()
+        expected = totals.pop(username, 0)
+        if user_sats(user) != expected:
+            mismatched += 1
+            print(f"MISMATCH {username}: balance_sats={user_sats(user)} ledger={expected}")
+    print(f"{entries} entries, {opened} opened, {mismatched} mismatched, {len(totals)} deleted users with history")
+
 # ---------- Run ----------
 if __name__ == "__main__":
     # بياخد البورت من السيرفر، ولو ملقاش بياخد 5000 تلقائي
     port = int(os.environ.get("PORT", 5000))
+    # سيرفر التطوير عملية واحدة → نشغل الـ scheduler جوه نفس العملية
+    if os.environ.get("MINING_SCHEDULER", "0") == "1":
+        start_mining_scheduler()
     app.run(host="0.0.0.0", port=port, debug=False)
@@ -0,0 +1,281 @@
+# metrics.py - قياسات اختيارية لكل طلب (METRICS=1)
+# بتسجل لكل طلب: زمن الطلب، عمليات التخزين (load_users/save_items/...)،
+# بايتات ووقت json، ووقت رسم القوالب، وتجمعها لكل endpoint
+# وبتعرضها على /metrics (للأدمن بس) بصيغة Prometheus text
+#
+# الطلب بيجمع أرقامه في record خاص بيه، وفي الآخر append واحدة في deque
+# (append/popleft ذرية في CPython) → مفيش قفل في مسار الطلب
+# التجميع في الهيستوجرامات بيحصل وقت القراءة أو لما الطابور يكبر
+# الأرقام لكل عملية (worker) لوحدها
+import collections, contextvars, cProfile, heapq, hmac, io, json, os, pstats, random, threading, time
+
+METRICS = os.environ.get("METRICS", "0") == "1"
+# Authorization: Bearer <token> لـ Prometheus (بدل جلسة الأدمن)
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+# cProfile لعينة من الطلبات، ونحتفظ بأبطأ N منهم
+PROFILE_SLOWEST = int(os.environ.get("METRICS_PROFILE", "0"))
+PROFILE_RATE = float(os.environ.get("METRICS_PROFILE_RATE", "0.05"))
+PROFILE_DIR = os.environ.get("METRICS_PROFILE_DIR", "profiles")
+
+ADMIN = "gatapro901"
+PREFIX = "miningsim"
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DRAIN_AT = 5000
+
+_current = contextvars.ContextVar("metrics_record", default=None)
+_pending = collections.deque()
+_drain_lock = threading.Lock()
+
+
+class Histogram:
+    __slots__ = ("counts", "total", "n")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.n = 0
+
+    def observe(self, value):
+        i = 0
+        while i < len(BUCKETS) and value > BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.total += value
+        self.n += 1
+
+
+# ---------- التجميع (تحت _drain_lock بس) ----------
+_requests = collections.defaultdict(Histogram)      # (endpoint, method) → زمن الطلب
+_statuses = collections.Counter()                   # (endpoint, status)
+_ops = collections.defaultdict(Histogram)           # (endpoint, op) → زمن عملية التخزين
+_json_bytes = collections.Counter()                 # (endpoint, direction)
+_json_seconds = collections.Counter()               # (endpoint, direction)
+_templates = collections.defaultdict(Histogram)     # template → زمن الرسم
+
+
+def _drain():
+    while True:
+        try:
+            rec = _pending.popleft()
+        except IndexError:
+            return
+        ep = rec["endpoint"]
+        _requests[(ep, rec["method"])].observe(rec["seconds"])
+        _statuses[(ep, rec["status"])] += 1
+        for op, seconds in rec["ops"]:
+            _ops[(ep, op)].observe(seconds)
+        for direction in ("read", "write"):
+            _json_bytes[(ep, direction)] += rec["json_bytes"][direction]
+            _json_seconds[(ep, direction)] += rec["json_seconds"][direction]
+        for name, seconds in rec["templates"]:
+            _templates[name].observe(seconds)
+
+
+def _submit(rec):
+    _pending.append(rec)
+    if len(_pending) >= DRAIN_AT and _drain_lock.acquire(blocking=False):
+        try:
+            _drain()
+        finally:
+            _drain_lock.release()
+
+
+# ---------- المجسات ----------
+def _on_storage_op(op, seconds):
+    rec = _current.get()
+    if rec is not None:
+        rec["ops"].append((op, seconds))
+
+
+def _json_sample(direction, size, seconds):
+    rec = _current.get()
+    if rec is not None:
+        rec["json_bytes"][direction] += size
+        rec["json_seconds"][direction] += seconds
+
+
+class _JsonProbe:
+    # بيحل محل json جوه storage: نفس الدوال + حساب البايتات والوقت
+    def __init__(self, real):
+        self._real = real
+
+    def __getattr__(self, attr):
+        return getattr(self._real, attr)
+
+    def loads(self, s, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._real.loads(s, **kwargs)
+        finally:
+            _json_sample("read", len(s), time.perf_counter() - started)
+
+    def load(self, f, **kwargs):
+        return self.loads(f.read(), **kwargs)
+
+    def dumps(self, obj, **kwargs):
+        started = time.perf_counter()
+        text = self._real.dumps(obj, **kwargs)
+        _json_sample("write", len(text), time.perf_counter() - started)
+        return text
+
+    def dump(self, obj, f, **kwargs):
+        f.write(self.dumps(obj, **kwargs))
+
+
+# ---------- cProfile لأبطأ الطلبات ----------
+_profile_lock = threading.Lock()   # profiler واحد في نفس الوقت
+_slowest = []                      # min-heap (seconds, seq, endpoint, path)
+_slowest_lock = threading.Lock()
+_profile_seq = 0
+
+
+def _keep_profile(seconds, endpoint, profiler):
+    global _profile_seq
+    with _slowest_lock:
+        if len(_slowest) >= PROFILE_SLOWEST and seconds <= _slowest[0][0]:
+            return
+        _profile_seq += 1
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{int(seconds * 1000)}ms-{endpoint}-{_profile_seq}.prof")
+        profiler.dump_stats(path)
+        heapq.heappush(_slowest, (seconds, _profile_seq, endpoint, path))
+        if len(_slowest) > PROFILE_SLOWEST:
+            _, _, _, evicted = heapq.heappop(_slowest)
+            try:
+                os.remove(evicted)
+            except OSError:
+                pass
+
+
+def profiles_text(limit=25):
+    with _slowest_lock:
+        slowest = sorted(_slowest, reverse=True)
+    out = io.StringIO()
+    for seconds, _, endpoint, path in slowest:
+        out.write(f"==== {endpoint} {seconds * 1000:.1f}ms {path}\n")
+        try:
+            pstats.Stats(path, stream=out).sort_stats("cumulative").print_stats(limit)
+        except OSError:
+            out.write("(profile file missing)\n")
+    return out.getvalue() or "no profiles yet\n"
+
+
+# ---------- ربط التطبيق ----------
+def install(app, storage_module):
+    from flask import before_render_template, g, request, template_rendered
+
+    storage_module.set_op_observer(_on_storage_op)
+    storage_module.json = _JsonProbe(json)
+
+    @app.before_request
+    def _metrics_start():
+        g._metrics_token = _current.set({
+            "ops": [], "templates": [],
+            "json_bytes": {"read": 0, "write": 0},
+            "json_seconds": {"read": 0.0, "write": 0.0},
+        })
+        g._metrics_profiler = None
+        if PROFILE_SLOWEST and random.random() < PROFILE_RATE and _profile_lock.acquire(blocking=False):
+            g._metrics_profiler = cProfile.Profile()
+            g._metrics_profiler.enable()
+        g._metrics_started = time.perf_counter()
+
+    @app.teardown_request
+    def _metrics_finish(exc):
+        started = g.pop("_metrics_started", None)
+        token = g.pop("_metrics_token", None)
+        if started is None or token is None:
+            return
+        seconds = time.perf_counter() - started
+        rec = _current.get()
+        try:
+            _current.reset(token)
+        except ValueError:
+            # الـ streaming بيخلص في context تاني
+            _current.set(None)
+        if rec is None:
+            return
+        profiler = g.pop("_metrics_profiler", None)
+        endpoint = request.endpoint or "unknown"
+        if profiler is not None:
+            profiler.disable()
+            _profile_lock.release()
+            _keep_profile(seconds, endpoint, profiler)
+        rec.update(endpoint=endpoint, method=request.method, seconds=seconds,
+                   status=str(500 if exc else g.pop("_metrics_status", 200)))
+        _submit(rec)
+
+    @app.after_request
+    def _metrics_status(response):
+        g._metrics_status = response.status_code
+        return response
+
+    def _render_start(sender, template, context, **extra):
+        g._metrics_render = time.perf_counter()
+
+    def _render_done(sender, template, context, **extra):
+        rec = _current.get()
+        started = g.pop("_metrics_render", None)
+        if rec is not None and started is not None:
+            rec["templates"].append((template.name or "?", time.perf_counter() - started))
+
+    before_render_template.connect(_render_start, app, weak=False)
+    template_rendered.connect(_render_done, app, weak=False)
+
+
+def authorized(user, authorization):
+    if user == ADMIN:
+        return True
+    if METRICS_TOKEN and authorization:
+        scheme, _, token = authorization.partition(" ")
+        return scheme.lower() == "bearer" and hmac.compare_digest(token, METRICS_TOKEN)
+    return False
+
+
+# ---------- Prometheus text ----------
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _histogram(lines, name, help_text, series):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} histogram")
+    for key, h in sorted(series.items()):
+        labels = dict(key)
+        running = 0
+        for bound, count in zip(BUCKETS + (float("inf"),), h.counts):
+            running += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f"{name}_bucket{_labels(**labels, le=le)} {running}")
+        lines.append(f"{name}_sum{_labels(**labels)} {h.total!r}")
+        lines.append(f"{name}_count{_labels(**labels)} {h.n}")
+
+
+def _counter(lines, name, help_text, series):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} counter")
+    for key, value in sorted(series.items()):
+        lines.append(f"{name}{_labels(**dict(key))} {value!r}")
+
+
+def render():
+    with _drain_lock:
+        _drain()
+        lines = []
+        _histogram(lines, f"{PREFIX}_request_duration_seconds", "Request latency per endpoint.",
+                   {(("endpoint", ep), ("method", m)): h for (ep, m), h in _requests.items()})
+        _counter(lines, f"{PREFIX}_requests_total", "Requests per endpoint and status.",
+                 {(("endpoint", ep), ("status", st)): n for (ep, st), n in _statuses.items()})
+        _histogram(lines, f"{PREFIX}_storage_op_duration_seconds", "Storage calls per endpoint.",
+                   {(("endpoint", ep), ("op", op)): h for (ep, op), h in _ops.items()})
+        _counter(lines, f"{PREFIX}_json_bytes_total", "JSON bytes parsed/serialized by storage.",
+                 {(("endpoint", ep), ("direction", d)): n for (ep, d), n in _json_bytes.items()})
+        _counter(lines, f"{PREFIX}_json_seconds_total", "Time spent in json by storage.",
+                 {(("endpoint", ep), ("direction", d)): n for (ep, d), n in _json_seconds.items()})
+        _histogram(lines, f"{PREFIX}_template_render_seconds", "Template render time.",
+                   {(("template", name),): h for name, h in _templates.items()})
+    return "\n".join(lines) + "\n"
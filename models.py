@@ -0,0 +1,264 @@
+# models.py - سجلات slotted للمستخدمين والأجهزة والمهام
+# التطبيع (int/float/bool) بيحصل مرة واحدة وقت التحميل في from_dict
+# بدل int(i.get("interval", 30)) في كل حلقة، والكاش بيحتفظ بالسجلات دي بدل dicts
+# to_dict بيرجع نفس شكل الـ JSON القديم: المفتاح الغايب بيفضل غايب
+# (الكود بيفرق بين "mining_rate" مش موجود و 0)
+import sys
+from dataclasses import dataclass
+
+
+class _Missing:
+    __slots__ = ()
+
+    def __repr__(self):
+        return "MISSING"
+
+    def __bool__(self):
+        return False
+
+
+MISSING = _Missing()
+
+
+# ---------- التحويلات ----------
+def _int(v):
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        try:
+            return int(float(v))
+        except (TypeError, ValueError):
+            return 0
+
+
+def _int_or_none(v):
+    return None if v is None or v == "" else _int(v)
+
+
+def _float(v):
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _bool(v):
+    if isinstance(v, str):
+        return v.strip().lower() in ("1", "true", "yes", "on")
+    return bool(v)
+
+
+def _str(v):
+    return "" if v is None else str(v)
+
+
+def _name(v):
+    # نصوص بتتكرر في آلاف السجلات (owner, name, rank, theme) → نسخة واحدة في الذاكرة
+    return sys.intern(_str(v))
+
+
+def _number(v):
+    # مكافآت المهام: xp عدد صحيح و btc كسر
+    if isinstance(v, (int, float)) and not isinstance(v, bool):
+        return v
+    f = _float(v)
+    return int(f) if f.is_integer() else f
+
+
+def _interval(v):
+    return _int(v) or 30
+
+
+class _Record:
+    __slots__ = ()
+    _coerce = {}
+
+    @classmethod
+    def from_dict(cls, d):
+        coerce = cls._coerce
+        values, extra = {}, None
+        for k, v in d.items():
+            fn = coerce.get(k)
+            if fn is None:
+                if extra is None:
+                    extra = {}
+                extra[k] = v
+            else:
+                values[k] = fn(v)
+        return cls(extra=extra, **values)
+
+    def to_dict(self):
+        out = {}
+        for k in self._coerce:
+            v = getattr(self, k)
+            if v is not MISSING:
+                out[k] = v
+        if self.extra:
+            out.update(self.extra)
+        return out
+
+    # صفوف الـ snapshot: قيم الـ slots بالترتيب (مطبّعة أصلًا) و ... مكان MISSING
+    # (marshal بيعرف Ellipsis) → التحميل من غير from_dict ولا تحويلات
+    def to_row(self):
+        return tuple(... if v is MISSING else v for v in map(self.__getattribute__, self.__slots__))
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(*[MISSING if v is ... else v for v in row])
+
+    # قراءة زي الـ dict (القوالب و _board_key بيستخدموا .get و in)
+    def get(self, key, default=None):
+        if key in self._coerce:
+            v = getattr(self, key)
+        else:
+            v = (self.extra or {}).get(key, MISSING)
+        return default if v is MISSING else v
+
+    def __getitem__(self, key):
+        v = self.get(key, MISSING)
+        if v is MISSING:
+            raise KeyError(key)
+        return v
+
+    def __contains__(self, key):
+        return self.get(key, MISSING) is not MISSING
+
+
+@dataclass(slots=True, eq=False)
+class User(_Record):
+    username: str = ""
+    password: object = MISSING
+    balance: object = MISSING
+    balance_sats: object = MISSING
+    xp: object = MISSING
+    rank: object = MISSING
+    currency: object = MISSING
+    blocked: object = MISSING
+    theme: object = MISSING
+    created_at: object = MISSING
+    last_login: object = MISSING
+    mining: object = MISSING
+    mining_rate: object = MISSING
+    mining_anchor: object = MISSING
+    mining_carry: object = MISSING
+    login_streak: object = MISSING
+    login_day: object = MISSING      # date.toordinal() لآخر يوم اتحسب في الـ streak
+    extra: object = None
+
+    _coerce = {
+        "username": _str, "password": _str, "balance": _float, "balance_sats": _int,
+        "xp": _int, "rank": _name, "currency": _name, "blocked": _bool, "theme": _name,
+        "created_at": _str, "last_login": _str, "mining": _bool, "mining_rate": _float,
+        "mining_anchor": _int, "mining_carry": _float, "login_streak": _int,
+        "login_day": _int_or_none,
+    }
+
+
+@dataclass(slots=True, eq=False)
+class Item(_Record):
+    id: str = ""
+    owner: str = ""
+    store_id: object = MISSING
+    name: object = MISSING
+    price: object = MISSING
+    created_at: object = MISSING
+    active: bool = False
+    power_on: bool = False
+    last_tick: object = None
+    sat_per_cycle: int = 0
+    interval: int = 30
+    extra: object = None
+
+    _coerce = {
+        "id": _str, "owner": _name, "store_id": _int_or_none, "name": _name, "price": _float,
+        "created_at": _str, "active": _bool, "power_on": _bool, "last_tick": _int_or_none,
+        "sat_per_cycle": _int, "interval": _interval,
+    }
+
+    @property
+    def rate(self):
+        # ساتوشي في الثانية لو الجهاز شغال
+        return self.sat_per_cycle / self.interval if self.active and self.power_on else 0.0
+
+    @classmethod
+    def from_tier(cls, tier, owner, item_id, created_at):
+        # tier = catalog.Tier (مطبّع مرة واحدة وقت الاستيراد)
+        return cls(id=item_id, owner=_name(owner), store_id=tier.id, name=_name(tier.name),
+                   price=tier.price, created_at=created_at, active=False, power_on=False,
+                   last_tick=None, sat_per_cycle=tier.sat_per_cycle, interval=tier.interval)
+
+
+@dataclass(slots=True, eq=False)
+class Task(_Record):
+    title: str = ""
+    reward: object = 0
+    type: object = MISSING
+    condition: object = MISSING
+    completed: bool = False
+    last_done: object = MISSING
+    done_day: object = MISSING       # date.toordinal() ليوم الإنجاز (المهام اليومية)
+    extra: object = None
+
+    _coerce = {
+        "title": _name, "reward": _number, "type": _name, "condition": _name,
+        "completed": _bool, "last_done": _str, "done_day": _int_or_none,
+    }
+
+
+@dataclass(slots=True, eq=False)
+class TaskState:
+    # حالة مهام مستخدم: التعريفات نفسها في catalog.TASKS
+    done: int = 0          # bit لكل slot
+    days: dict = None      # slot → يوم آخر إنجاز (date.toordinal)
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(done=_int(d.get("done", 0)),
+                   days={_int(k): _int(v) for k, v in (d.get("days") or {}).items()})
+
+    def to_dict(self):
+        return {"done": self.done, "days": {str(k): v for k, v in sorted((self.days or {}).items())}}
+
+    def is_done(self, slot):
+        return bool(self.done >> slot & 1)
+
+    def mark(self, slot, day):
+        self.done |= 1 << slot
+        if self.days is None:
+            self.days = {}
+        self.days[slot] = day
+
+    def clear(self, slot):
+        self.done &= ~(1 << slot)
+
+
+def store_rate(store_item):
+    # عناصر المتجر فيها sat_per_30s / sat_per_26s ... → (sat_per_cycle, interval)
+    sat = None
+    for k, v in store_item.items():
+        if isinstance(k, str) and k.startswith("sat_per"):
+            try:
+                sat = int(v)
+                break
+            except (TypeError, ValueError):
+                pass
+    if sat is None:
+        sat = _int(store_item.get("sat", 0))
+    return sat, _interval(store_item.get("interval"))
+
+
+def tasks_from_list(rows):
+    return [Task.from_dict(t) for t in rows]
+
+
+def tasks_to_list(tasks):
+    return [t.to_dict() for t in tasks]
+
+
+def task_record(value):
+    # tasks.json: حالة مضغوطة (dict) أو قائمة المهام القديمة (بتتحول في main أول ما تتكتب)
+    return TaskState.from_dict(value) if isinstance(value, dict) else tasks_from_list(value)
+
+
+def task_value(record):
+    return record.to_dict() if isinstance(record, TaskState) else tasks_to_list(record)
@@ -0,0 +1,53 @@
+# pagecache.py - كاش LRU للصفحات والـ JSON المرسومة لكل مستخدم
+# المدخل متخزن بمفتاح (الصفحة، المستخدم، ...) ومعاه نسخة بيانات المستخدم وقت الرسم
+# (CachedStorage.data_version): أي كتابة على صفه أو أجهزته أو مهامه بتزود النسخة،
+# فالمدخل القديم بيبقى miss ويتبدل بدل ما يتراكم. الحجم محدود بالبايتات
+# والـ TTL أقصر من صلاحية توكن CSRF اللي جوه الصفحة (ساعة في Flask-WTF)
+import collections, hashlib, os, threading, time
+
+PAGE_CACHE_BYTES = int(os.environ.get("PAGE_CACHE_BYTES", str(32 * 1024 * 1024)))   # 0 = من غير كاش
+PAGE_CACHE_TTL = int(os.environ.get("PAGE_CACHE_TTL", "600"))                        # ثواني
+
+
+class PageCache:
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._pages = collections.OrderedDict()   # key → (version, body, etag, expires)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version, now=None):
+        # (body, etag) لو المدخل موجود بنفس النسخة ولسه صالح
+        now = time.time() if now is None else now
+        with self._lock:
+            page = self._pages.get(key)
+            if page is None or page[0] != version or page[3] < now:
+                self.misses += 1
+                return None
+            self._pages.move_to_end(key)
+            self.hits += 1
+            return page[1], page[2]
+
+    def put(self, key, version, body, now=None):
+        now = time.time() if now is None else now
+        etag = hashlib.sha1(body).hexdigest()
+        if len(body) > self.max_bytes:
+            return body, etag
+        with self._lock:
+            old = self._pages.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[1])
+            self._pages[key] = (version, body, etag, now + self.ttl)
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._pages.popitem(last=False)
+                self._bytes -= len(evicted[1])
+        return body, etag
+
+    def stats(self):
+        with self._lock:
+            return {"pages": len(self._pages), "bytes": self._bytes,
+                    "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,173 @@
+# simulate.py - محاكاة اقتصاد التعدين قبل تغيير الأسعار
+# كل الأجهزة في مصفوفات NumPy (sat_per_cycle, interval, last_tick, owner)
+# فملايين الأجهزة وأيام من التعدين بتتحسب في ثواني
+# بيتشغل من: flask --app main simulate --users 100000 --days 7
+import re
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+
+def parse_mix(text, tiers):
+    # "1:50,2:30,8:1" → أوزان لكل فئة؛ الافتراضي بالعكس مع السعر (الرخيص أكتر)
+    import numpy as np
+    ids = [t["id"] for t in tiers]
+    if not text:
+        weights = np.array([1.0 / max(t["price_sats"], 1) for t in tiers])
+    else:
+        weights = np.zeros(len(tiers))
+        for part in text.split(","):
+            tier_id, _, w = part.partition(":")
+            weights[ids.index(int(tier_id))] = float(w or 1)
+    if weights.sum() <= 0:
+        raise ValueError("mix has no positive weights")
+    return weights / weights.sum()
+
+
+def _task_rules(tasks, to_sats):
+    # الشروط المعروفة: first_login / buy_N_items / login_N_days
+    rules = []
+    for t in tasks:
+        cond = t.get("condition", "")
+        if t.get("type") == "xp":
+            sats, xp = 0, int(t.get("reward", 0))
+        else:
+            sats, xp = to_sats(t.get("reward", 0)), 0
+        m = re.fullmatch(r"buy_(\d+)_items", cond)
+        if m:
+            rules.append(("items", int(m.group(1)), sats, xp))
+            continue
+        m = re.fullmatch(r"login_(\d+)_days", cond)
+        if m:
+            rules.append(("streak", int(m.group(1)), sats, xp))
+        elif cond == "first_login":
+            rules.append(("first_login", 0, sats, xp))
+    return rules
+
+
+def run(tiers, tasks, calculate_rank, to_sats, users=10000, days=7, devices=3.0,
+        mix=None, active=0.8, online=0.1, buys=0.5, logins=0.7, step=HOUR,
+        cadence=300, stream_interval=1.0, seed=0):
+    """
+    tiers: [{"id", "price_sats", "sat_per_cycle", "interval"}]
+    buys = مشتريات لكل مستخدم في اليوم، logins = احتمال الدخول اليومي
+    active = نسبة المستخدمين اللي مشغلين التعدين، online = نسبة اللي فاتحين الموقع
+    """
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    weights = parse_mix(mix, tiers)
+    price = np.array([t["price_sats"] for t in tiers], dtype=np.int64)
+    sat = np.array([t["sat_per_cycle"] for t in tiers], dtype=np.int64)
+    interval = np.array([t["interval"] for t in tiers], dtype=np.int64)
+
+    # ---------- الأجهزة الأولية ----------
+    per_user = rng.poisson(devices, users)
+    owner = np.repeat(np.arange(users, dtype=np.int64), per_user)
+    tier = rng.choice(len(tiers), owner.size, p=weights)
+    dev_sat, dev_interval = sat[tier], interval[tier]
+    last_tick = -rng.integers(0, dev_interval)  # مراحل عشوائية داخل الدورة
+    mining = rng.random(users) < active
+
+    balance = np.zeros(users, dtype=np.int64)
+    xp = np.zeros(users, dtype=np.int64)
+    item_count = per_user.astype(np.int64)
+    streak = np.zeros(users, dtype=np.int64)
+
+    rules = _task_rules(tasks, to_sats)
+    done = [np.zeros(users, dtype=bool) for _ in rules]
+
+    totals = {"mined_sats": 0, "task_sats": 0, "task_xp": 0, "spent_sats": 0,
+              "purchases": 0, "task_rewards": 0, "settles": 0}
+    hourly = []
+
+    def reward(n, mask):
+        kind, need, sats, rxp = rules[n]
+        mask = mask & ~done[n]
+        done[n] |= mask
+        count = int(mask.sum())
+        balance[mask] += sats
+        xp[mask] += rxp
+        totals["task_sats"] += sats * count
+        totals["task_xp"] += rxp * count
+        totals["task_rewards"] += count
+
+    steps = int(days * DAY // step)
+    for s in range(steps):
+        t0, t1 = s * step, (s + 1) * step
+
+        # ---------- تسجيل الدخول اليومي + مهام الـ streak ----------
+        if t0 % DAY == 0:
+            logged = rng.random(users) < logins
+            streak = np.where(logged, streak + 1, 0)
+            for n, (kind, need, _, _) in enumerate(rules):
+                if kind == "first_login":
+                    reward(n, logged)
+                elif kind == "streak":
+                    reward(n, streak >= need)
+
+        # ---------- التعدين: عدد الدورات الكاملة لكل جهاز في الخطوة ----------
+        cycles = (t1 - last_tick) // dev_interval - (t0 - last_tick) // dev_interval
+        mined = np.bincount(owner, weights=cycles * dev_sat, minlength=users).astype(np.int64)
+        mined[~mining] = 0
+        balance += mined
+        xp += (mined // 6) * 20
+        step_mined = int(mined.sum())
+        totals["mined_sats"] += step_mined
+        totals["settles"] += int(mining.sum()) * max(1, step // max(1, cadence))
+
+        # ---------- المشتريات ----------
+        buyers = np.flatnonzero(rng.random(users) < buys * step / DAY)
+        bought = 0
+        if buyers.size:
+            want = rng.choice(len(tiers), buyers.size, p=weights)
+            ok = balance[buyers] >= price[want]
+            buyers, want = buyers[ok], want[ok]
+            bought = buyers.size
+            np.subtract.at(balance, buyers, price[want])
+            np.add.at(item_count, buyers, 1)
+            totals["spent_sats"] += int(price[want].sum())
+            owner = np.concatenate([owner, buyers])
+            dev_sat = np.concatenate([dev_sat, sat[want]])
+            dev_interval = np.concatenate([dev_interval, interval[want]])
+            last_tick = np.concatenate([last_tick, np.full(buyers.size, t1, dtype=np.int64)])
+            for n, (kind, need, _, _) in enumerate(rules):
+                if kind == "items":
+                    reward(n, item_count >= need)
+        totals["purchases"] += bought
+        hourly.append(step_mined * HOUR / step)
+
+    # ---------- النتايج ----------
+    hours = steps * step / HOUR or 1
+    hourly = np.array(hourly or [0.0])
+    values, counts = np.unique(xp, return_counts=True)
+    ranks = {}
+    for v, c in zip(values.tolist(), counts.tolist()):
+        r = calculate_rank(v)
+        ranks[r] = ranks.get(r, 0) + c
+
+    online_users = users * online
+    mining_users = int(mining.sum())
+    # كل تسوية = put_user + append_ledger، والـ scheduler بيعمل معاملة لكل دفعة
+    writes = (2 * totals["settles"] + 3 * totals["purchases"] + 2 * totals["task_rewards"]) / (hours * HOUR)
+    return {
+        "users": users,
+        "devices": int(owner.size),
+        "mining_users": mining_users,
+        "simulated_hours": hours,
+        "sats_per_hour": {"mean": float(hourly.mean()), "p95": float(np.percentile(hourly, 95)),
+                          "max": float(hourly.max())},
+        "totals": totals,
+        "balance_sats": {"mean": float(balance.mean()), "p50": float(np.percentile(balance, 50)),
+                         "p99": float(np.percentile(balance, 99))},
+        "xp": {"mean": float(xp.mean()), "p50": float(np.percentile(xp, 50)),
+               "p99": float(np.percentile(xp, 99)), "max": int(xp.max(initial=0))},
+        "ranks": ranks,
+        "load": {
+            "online_users": online_users,
+            "stream_connections": online_users,
+            "stream_events_per_sec": online_users * (mining_users / max(users, 1)) / stream_interval,
+            "polling_requests_per_sec": online_users / 3,  # /mining_tick القديم كل 3 ثواني
+            "writes_per_sec": writes,
+            "purchases_per_sec": totals["purchases"] / (hours * HOUR),
+        },
+    }
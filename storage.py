@@ -0,0 +1,1739 @@
+# storage.py - طبقة التخزين
+# SQLite (WAL) هو الافتراضي، وملفات JSON تفضل كصيغة استيراد/تصدير
+# أو كـ backend كامل لو STORAGE_BACKEND=json
+import bisect, contextvars, functools, heapq, itertools, json, logging, marshal, os, sqlite3, sys, tempfile, threading, time, zlib
+from contextlib import ExitStack, contextmanager
+from models import Item, User, task_record, task_value
+try:
+    import fcntl
+except ImportError:  # ويندوز: أقفال داخل العملية بس
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "sqlite")
+DB_FILE = os.environ.get("DB_FILE", "data.db")
+# كاش الذاكرة (فهارس بالاسم/رقم الجهاز) - STORAGE_CACHE=0 لإيقافه
+STORAGE_CACHE = os.environ.get("STORAGE_CACHE", "1") == "1"
+# background: الـ worker بيرد من الـ backend مباشرة لحد ما الكاش يسخن (/ready بيقول إمتى)
+# sync: الكاش بيتحمّل كله قبل أول طلب
+STORAGE_WARMUP = os.environ.get("STORAGE_WARMUP", "background")
+# snapshot ثنائي للكاش بيتقري بدل parse كل الصفوف عند التشغيل ("" = من غيره)
+SNAPSHOT_FILE = os.environ.get("STORAGE_SNAPSHOT", "cache.snapshot")
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_PAGE = 5000   # صفوف في الصفحة (وحدة التحميل والتقدم)
+# ملفات الأقفال المشتركة بين الـ workers (flock)
+LOCK_DIR = os.environ.get("LOCK_DIR", ".locks")
+LOCK_STRIPES = int(os.environ.get("LOCK_STRIPES", "256"))
+# اتصالات SQLite الفاضية اللي بتفضل مفتوحة لكل عملية (الزيادة وقت الضغط بتتقفل بعد الاستخدام)
+SQLITE_POOL_SIZE = int(os.environ.get("SQLITE_POOL_SIZE", "4"))
+# JSON backend: تعديلات الأجهزة بتتكتب سطر في items.journal، ولما يكبر عن الحد
+# بيتدمج في items.json في thread في الخلفية (0 = ما يتدمجش غير بالأمر compact-items)
+ITEMS_JOURNAL_COMPACT = int(os.environ.get("ITEMS_JOURNAL_COMPACT", str(4 * 1024 * 1024)))
+
+
+class StorageError(Exception):
+    pass
+
+
+def _dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def _atomic_write(path, text):
+    _atomic_replace(path, lambda f: f.write(text.encode("utf-8")))
+
+
+def _atomic_replace(path, fill):
+    # ملف مؤقت + fsync + rename: القارئ يا يشوف النسخة القديمة كاملة يا الجديدة كاملة
+    folder = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix=".tmp-", dir=folder)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            fill(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    if hasattr(os, "O_DIRECTORY"):
+        dir_fd = os.open(folder, os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+# ---------- أقفال بين العمليات ----------
+class StripedLock:
+    # N قفل (stripe) كل واحد: RLock للـ threads + flock على ملف للـ workers
+    # المستخدمين بيتوزعوا على الـ stripes بالـ hash، فمفيش قفل عام على كل الطلبات
+    def __init__(self, lock_dir, stripes, prefix="user"):
+        self.lock_dir = lock_dir
+        self.stripes = stripes
+        self.prefix = prefix
+        self._threads = [threading.RLock() for _ in range(stripes)]
+        self._files = [None] * stripes
+        self._depth = threading.local()
+
+    def _stripe(self, key):
+        return zlib.crc32(key.strip().lower().encode("utf-8")) % self.stripes
+
+    @contextmanager
+    def __call__(self, key=""):
+        with self._hold(self._stripe(key)):
+            yield
+
+    @contextmanager
+    def many(self, keys):
+        # أكتر من مفتاح: الـ stripes بتتاخد بالترتيب عشان مفيش deadlock مع الطلبات
+        with ExitStack() as stack:
+            for n in sorted({self._stripe(k) for k in keys}):
+                stack.enter_context(self._hold(n))
+            yield
+
+    def group(self, keys):
+        # المفاتيح متجمعة حسب الـ stripe (بترتيب الـ stripes) - للشغل الكبير اللي
+        # بيقفل شوية stripes في المرة بدل ما يمسك أغلبهم مع بعض
+        groups = {}
+        for k in keys:
+            groups.setdefault(self._stripe(k), []).append(k)
+        return [groups[n] for n in sorted(groups)]
+
+    @contextmanager
+    def _hold(self, n):
+        with self._threads[n]:
+            depths = self._depth.__dict__.setdefault("d", {})
+            depth = depths.get(n, 0)
+            if depth == 0 and fcntl is not None:
+                if self._files[n] is None:
+                    os.makedirs(self.lock_dir, exist_ok=True)
+                    self._files[n] = open(os.path.join(self.lock_dir, f"{self.prefix}-{n}.lock"), "a+")
+                _flock(self._files[n])
+            depths[n] = depth + 1
+            try:
+                yield
+            finally:
+                depths[n] = depth
+                if depth == 0 and fcntl is not None:
+                    fcntl.flock(self._files[n].fileno(), fcntl.LOCK_UN)
+
+
+def _flock(f):
+    # flock بيوقف الـ thread كله (gevent ما بيخليهوش cooperative): worker تاني ماسك الـ stripe
+    # كان بيوقف كل الطلبات والـ streams. LOCK_NB + sleep (مع gevent بيسيب الـ hub يشتغل)
+    delay = 0.001
+    while True:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return
+        except BlockingIOError:
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+
+
+def try_lock_file(name):
+    # قفل لعملية واحدة بس من غير استنى: الملف المفتوح (خليه مفتوح طول ما انت ماسكه)
+    # أو None لو عملية تانية ماسكاه. العملية لما تموت القفل بيتفك لوحده
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    f = open(os.path.join(LOCK_DIR, f"{name}.lock"), "a+")
+    if fcntl is not None:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return None
+    return f
+
+
+_user_locks = None
+
+def user_locks():
+    global _user_locks
+    if _user_locks is None:
+        _user_locks = StripedLock(LOCK_DIR, LOCK_STRIPES)
+    return _user_locks
+
+
+class _UserLockMixin:
+    # with db.user_lock(username): ... → قراءة/تعديل/كتابة ذرية لمستخدم واحد
+    @contextmanager
+    def user_lock(self, username):
+        with user_locks()(username or ""):
+            yield self
+
+    @contextmanager
+    def users_lock(self, usernames):
+        with user_locks().many(usernames):
+            yield self
+
+    def lock_groups(self, usernames):
+        return user_locks().group(usernames)
+
+    def sync(self):
+        pass
+
+
+SATS_PER_BTC = 100_000_000
+
+
+def _balance(user):
+    # الرصيد بالساتوشي (عدد صحيح)؛ المستخدمين القدام لسه عندهم balance بالـ BTC بس
+    if "balance_sats" in user:
+        return int(user["balance_sats"])
+    try:
+        return int(round(float(user.get("balance", 0)) * SATS_PER_BTC))
+    except:
+        return 0
+
+
+def _board_key(user):
+    # ترتيب اللوحة: الرصيد تنازليًا وبعدين الاسم
+    return (-_balance(user), user.get("username", "").strip())
+
+
+# ---------- صفحات الأدمن (keyset) ----------
+# الصفحة الجاية بتبدأ بعد مفتاح الترتيب بتاع آخر صف (after) بدل OFFSET
+# فالصفحة رقم 1000 بنفس تكلفة الأولى
+USER_SORTS = ("balance", "xp", "username")
+
+
+def user_sort_key(user, sort="balance"):
+    username = user.get("username", "").strip()
+    if sort == "balance":
+        return (-_balance(user), username)
+    if sort == "xp":
+        return (-int(user.get("xp", 0) or 0), username)
+    return (username,)
+
+
+def user_matches(user, filters):
+    # filters: blocked/mining (True/False/None) و rank و min_sats/max_sats
+    for flag in ("blocked", "mining"):
+        if filters.get(flag) is not None and bool(user.get(flag, False)) != filters[flag]:
+            return False
+    if filters.get("rank") and user.get("rank") != filters["rank"]:
+        return False
+    if filters.get("min_sats") is not None and _balance(user) < filters["min_sats"]:
+        return False
+    if filters.get("max_sats") is not None and _balance(user) > filters["max_sats"]:
+        return False
+    return True
+
+
+def _has_filters(filters):
+    return any(v not in (None, "") for v in filters.values())
+
+
+def item_sort_key(item):
+    return (str(item.get("id")),)
+
+
+def item_matches(item, filters):
+    # filters: owner (بدون حساسية حروف) و store_id و active/power_on
+    if filters.get("owner") and str(item.get("owner", "")).strip().lower() != filters["owner"].strip().lower():
+        return False
+    if filters.get("store_id") is not None and item.get("store_id") != filters["store_id"]:
+        return False
+    for flag in ("active", "power_on"):
+        if filters.get(flag) is not None and bool(item.get(flag, False)) != filters[flag]:
+            return False
+    return True
+
+
+def _scan_page(rows, matches, key, filters, after, limit):
+    # من غير فهرس: فلترة + أصغر limit مفتاح بعد المؤشر (heap بحجم limit مش sort للكل)
+    keyed = ((key(r), r) for r in rows if matches(r, filters))
+    if after is not None:
+        after = tuple(after)
+        keyed = (kr for kr in keyed if kr[0] > after)
+    return [r for _, r in heapq.nsmallest(limit, keyed, key=lambda kr: kr[0])]
+
+
+def _next_login_state(state, limit, lock_seconds, now):
+    # محاولة فاشلة: العداد يزيد، ولما يوصل للحد يتقفل الحساب ويتصفر العداد
+    failed = int((state or {}).get("failed", 0)) + 1
+    if failed >= limit:
+        return {"failed": 0, "lock_until": int(now + lock_seconds)}
+    return {"failed": failed, "lock_until": 0}
+
+
+def _locked(method):
+    # read-modify-write على ملف كامل لازم يبقى تحت قفل الملفات
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.transaction():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+# ---------- JSON backend (السلوك القديم: قراءة/كتابة الملف كامل) ----------
+class JsonStorage(_UserLockMixin):
+    # كل كتابة هنا بتعيد كتابة الملف كله، فبتاخد قفل واحد على الملفات
+    name = "json"
+    indexed = False   # أي استعلام = قراءة الملف كله
+
+    def __init__(self, users_file, items_file, tasks_file):
+        self.users_file = users_file
+        self.items_file = items_file
+        self.tasks_file = tasks_file
+        self.ledger_file = os.path.join(os.path.dirname(users_file), "ledger.ndjson")
+        self.login_state_file = os.path.join(os.path.dirname(users_file), "login_state.json")
+        self.items_journal = os.path.splitext(items_file)[0] + ".journal"
+        self._file_lock = StripedLock(LOCK_DIR, 1, prefix="json")
+        self._compacting = threading.Lock()
+
+    def _read(self, path, default):
+        if not os.path.exists(path):
+            self._write(path, default)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except ValueError as e:
+            # ملف بايظ: نوقف بدل ما نرجع [] ونكتبه فوق البيانات
+            raise StorageError(f"{path} is not valid JSON: {e}")
+        # لو الملف اتحول لنوع غلط → نرجع الافتراضي
+        if not isinstance(data, type(default)):
+            return default
+        return data
+
+    def _write(self, path, data):
+        _atomic_write(path, json.dumps(data, indent=4, ensure_ascii=False))
+
+    @contextmanager
+    def transaction(self):
+        with self._file_lock():
+            yield self
+
+    def identity(self):
+        # الـ marker هنا mtime الملفات، فملفات جديدة = marker مختلف = تحميل كامل
+        return None
+
+    def change_marker(self):
+        # الـ journal: (inode, الحجم) - الدمج بيبدله بملف جديد فاضي فالـ inode بيتغير
+        files = tuple(os.stat(p).st_mtime_ns if os.path.exists(p) else 0
+                      for p in (self.users_file, self.items_file, self.tasks_file))
+        try:
+            st = os.stat(self.items_journal)
+        except FileNotFoundError:
+            return files + (0, 0)
+        return files + (st.st_ino, st.st_size)
+
+    def changes_since(self, marker):
+        # الملفات نفسها اتغيرت → إعادة تحميل كاملة
+        # الـ journal بس اللي زاد → الأجهزة من السطور الجديدة، ومعاها البيانات (من غير get_item)
+        current = self.change_marker()
+        if not isinstance(marker, tuple) or len(marker) != len(current) or marker[:3] != current[:3]:
+            return None
+        # inode 0 = ما كانش فيه journal (أول append بيعمله)
+        if marker[3] not in (0, current[3]) or marker[4] > current[4]:
+            return None
+        changes = []
+        for rec in self._journal_records(marker[4], current[4]):
+            if "p" not in rec:
+                return None
+            changes.append((current, "items", str(rec["p"].get("id")), rec["p"]))
+        return changes
+
+    # users
+    def load_users(self):
+        return self._read(self.users_file, [])
+
+    def save_users(self, users):
+        self._write(self.users_file, users)
+
+    def get_user(self, username):
+        return next((u for u in self.load_users() if u.get("username", "").strip() == username), None)
+
+    def get_user_ci(self, username):
+        username = username.strip().lower()
+        return next((u for u in self.load_users() if u.get("username", "").strip().lower() == username), None)
+
+    @_locked
+    def put_user(self, user, old_username=None):
+        key = (old_username or user.get("username", "")).strip()
+        users = self.load_users()
+        for i, u in enumerate(users):
+            if u.get("username", "").strip() == key:
+                users[i] = user
+                break
+        else:
+            users.append(user)
+        self.save_users(users)
+        new = user.get("username", "").strip()
+        if old_username and key != new:
+            self._rename_ledger(key, new)
+            moved = [dict(i, owner=new) for i in self.load_items() if str(i.get("owner", "")) == key]
+            if moved:
+                self._append_journal([{"p": i} for i in moved])
+            tasks = self.load_tasks()
+            moved = [(src, dst) for src, dst in ((key.lower(), new.lower()), (key, new))
+                     if src != dst and src in tasks]
+            for src, dst in moved:
+                tasks[dst] = tasks.pop(src)
+            if moved:
+                self.save_tasks(tasks)
+
+    @_locked
+    def delete_user_ci(self, username):
+        username = username.strip().lower()
+        users = [u for u in self.load_users() if u.get("username", "").strip().lower() != username]
+        self.save_users(users)
+
+    def leaderboard(self, offset=0, limit=None, exclude=()):
+        users = [u for u in self.load_users() if u.get("username", "").strip() not in exclude]
+        users.sort(key=_board_key)
+        return users[offset:offset + limit if limit is not None else None]
+
+    def leaderboard_rank(self, username, exclude=()):
+        board = self.leaderboard(exclude=exclude)
+        return next((n for n, u in enumerate(board, start=1) if u.get("username", "").strip() == username), None)
+
+    def leaderboard_size(self, exclude=()):
+        return len([u for u in self.load_users() if u.get("username", "").strip() not in exclude])
+
+    def user_count(self, exclude=()):
+        return self.leaderboard_size(exclude)
+
+    def page_users(self, filters, sort="balance", after=None, limit=50):
+        return _scan_page(self.load_users(), user_matches, lambda u: user_sort_key(u, sort),
+                          filters, after, limit)
+
+    # items: items.json (آخر دمج) + items.journal (سطر لكل تعديل من بعده)
+    # {"p": item} = put (استبدال بالـ id أو إضافة في الآخر)، {"d": owner_lower} = مسح أجهزة مالك
+    # إعادة تشغيل نفس السطور على نتيجتها بتدي نفس النتيجة، فلو الدمج وقع بعد كتابة
+    # items.json وقبل تفريغ الـ journal ما فيش حاجة بتبوظ
+    def load_items(self):
+        items = self._read(self.items_file, [])
+        if not os.path.exists(self.items_journal):
+            return items
+        by_id = {str(i.get("id")): i for i in items}
+        for rec in self._journal_records():
+            if "p" in rec:
+                by_id[str(rec["p"].get("id"))] = rec["p"]
+            elif "d" in rec:
+                owner = rec["d"]
+                by_id = {k: i for k, i in by_id.items()
+                         if str(i.get("owner", "")).strip().lower() != owner}
+        return list(by_id.values())
+
+    def _journal_records(self, start=0, end=None):
+        try:
+            with open(self.items_journal, "rb") as f:
+                f.seek(start)
+                data = f.read() if end is None else f.read(end - start)
+        except FileNotFoundError:
+            return
+        for line in data.split(b"\n"):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # سطر ناقص من كتابة اتقطعت (آخر الملف) → كأنه ما اتكتبش
+                continue
+
+    def _append_journal(self, records):
+        data = "".join(_dumps(r) + "\n" for r in records).encode("utf-8")
+        fd = os.open(self.items_journal, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            # آخر سطر ناقص (كتابة اتقطعت): من غير \n السطر الجديد كان بيلزق فيه ويضيع معاه.
+            # بنبدأ سطر جديد بدل ما نقص الملف، عشان مواقع changes_since ما تتغيرش (إحنا تحت قفل الملفات)
+            size = os.fstat(fd).st_size
+            if size and os.pread(fd, 1, size - 1) != b"\n":
+                data = b"\n" + data
+            os.write(fd, data)
+            os.fsync(fd)
+            size = os.fstat(fd).st_size
+        finally:
+            os.close(fd)
+        if ITEMS_JOURNAL_COMPACT and size > ITEMS_JOURNAL_COMPACT:
+            self._compact_in_background()
+
+    def _compact_in_background(self):
+        if not self._compacting.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self.compact_items()
+            except Exception:
+                log.exception("items journal compaction failed")
+            finally:
+                self._compacting.release()
+
+        threading.Thread(target=run, name="items-compact", daemon=True).start()
+
+    @_locked
+    def compact_items(self):
+        # يدمج الـ journal في items.json ويبدأ journal فاضي؛ بيرجع عدد السطور اللي اتدمجت
+        if not os.path.exists(self.items_journal):
+            return 0
+        folded = sum(1 for _ in self._journal_records())
+        self.save_items(self.load_items())
+        return folded
+
+    def save_items(self, items):
+        # استبدال كامل: items.json الأول وبعدين journal فاضي (ملف جديد → inode جديد)
+        self._write(self.items_file, items)
+        if os.path.exists(self.items_journal):
+            _atomic_write(self.items_journal, "")
+
+    def get_item(self, item_id):
+        return next((i for i in self.load_items() if str(i.get("id")) == str(item_id)), None)
+
+    def items_by_owner(self, owner):
+        return [i for i in self.load_items() if str(i.get("owner")) == str(owner)]
+
+    @_locked
+    def put_item(self, item):
+        self._append_journal([{"p": item}])
+
+    @_locked
+    def put_items(self, changed):
+        if not changed:
+            return
+        self._append_journal([{"p": i} for i in changed])
+
+    def items_by_owner_ci(self, owner):
+        owner = str(owner).strip().lower()
+        return [i for i in self.load_items() if str(i.get("owner", "")).strip().lower() == owner]
+
+    def page_items(self, filters, after=None, limit=50):
+        return _scan_page(self.load_items(), item_matches, item_sort_key, filters, after, limit)
+
+    @_locked
+    def delete_items_by_owner_ci(self, owner):
+        self._append_journal([{"d": owner.strip().lower()}])
+
+    # tasks
+    def load_tasks(self):
+        return self._read(self.tasks_file, {})
+
+    def save_tasks(self, tasks):
+        self._write(self.tasks_file, tasks)
+
+    def get_tasks(self, username):
+        return self.load_tasks().get(username)
+
+    @_locked
+    def put_tasks(self, username, user_tasks):
+        tasks = self.load_tasks()
+        tasks[username] = user_tasks
+        self.save_tasks(tasks)
+
+    @_locked
+    def delete_tasks(self, username):
+        tasks = self.load_tasks()
+        if username in tasks:
+            del tasks[username]
+            self.save_tasks(tasks)
+
+    # ledger (append-only، سطر لكل قيد)
+    @_locked
+    def append_ledger(self, entries):
+        with open(self.ledger_file, "a", encoding="utf-8") as f:
+            for e in entries:
+                f.write(_dumps(e) + "\n")
+
+    def _rename_ledger(self, old, new):
+        # القيود بالاسم: تغيير الاسم بيعيد كتابة الملف (تحت نفس قفل الملفات)
+        if not os.path.exists(self.ledger_file):
+            return
+        entries = list(self.scan_ledger())
+        for e in entries:
+            if e.get("username") == old:
+                e["username"] = new
+        _atomic_write(self.ledger_file, "".join(_dumps(e) + "\n" for e in entries))
+
+    def scan_ledger(self):
+        if not os.path.exists(self.ledger_file):
+            return
+        with open(self.ledger_file, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    # login state (محاولات فاشلة + قفل مؤقت) - ملف صغير بعيد عن users.json
+    def get_login_state(self, username):
+        state = self._read(self.login_state_file, {}).get(username.strip().lower())
+        return state or {"failed": 0, "lock_until": 0}
+
+    @_locked
+    def login_failure(self, username, limit, lock_seconds, now):
+        states = self._read(self.login_state_file, {})
+        state = _next_login_state(states.get(username.strip().lower()), limit, lock_seconds, now)
+        states[username.strip().lower()] = state
+        self._write(self.login_state_file, states)
+        return state
+
+    @_locked
+    def clear_login_state(self, username):
+        states = self._read(self.login_state_file, {})
+        if states.pop(username.strip().lower(), None) is not None:
+            self._write(self.login_state_file, states)
+
+
+# ---------- SQLite backend (قراءة/كتابة على مستوى الصف) ----------
+# كل تعديل على الـ schema يتضاف هنا كخطوة جديدة (PRAGMA user_version)
+SCHEMA = [
+    """
+    CREATE TABLE users (
+        username TEXT PRIMARY KEY,
+        username_lower TEXT NOT NULL,
+        data TEXT NOT NULL
+    );
+    CREATE INDEX users_username_lower ON users(username_lower);
+
+    CREATE TABLE items (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        id TEXT NOT NULL UNIQUE,
+        owner TEXT NOT NULL,
+        owner_lower TEXT NOT NULL,
+        data TEXT NOT NULL
+    );
+    CREATE INDEX items_owner ON items(owner);
+    CREATE INDEX items_owner_lower ON items(owner_lower);
+
+    CREATE TABLE tasks (
+        username TEXT PRIMARY KEY,
+        data TEXT NOT NULL
+    );
+    """,
+    # لوحة المتصدرين: فهرس على الرصيد بدل ترتيب كل المستخدمين في كل طلب
+    """
+    ALTER TABLE users ADD COLUMN balance REAL NOT NULL DEFAULT 0;
+    UPDATE users SET balance = COALESCE(CAST(json_extract(data, '$.balance') AS REAL), 0);
+    CREATE INDEX users_balance ON users(balance DESC, username);
+    """,
+    # دفتر قيود بالساتوشي (append-only) + عمود الرصيد بقى ساتوشي صحيح
+    """
+    CREATE TABLE ledger (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        sats INTEGER NOT NULL,
+        ts INTEGER NOT NULL,
+        ref TEXT
+    );
+    CREATE INDEX ledger_username ON ledger(username);
+    UPDATE users SET balance = CAST(ROUND(balance * 100000000) AS INTEGER);
+    """,
+    # سجل تغييرات عشان كاش كل worker يعرف الصفوف اللي اتغيرت من workers تانية
+    """
+    CREATE TABLE changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        tbl TEXT NOT NULL,
+        key TEXT NOT NULL
+    );
+    CREATE TRIGGER users_changed_ins AFTER INSERT ON users BEGIN
+        INSERT INTO changes (tbl, key) VALUES ('users', NEW.username); END;
+    CREATE TRIGGER users_changed_upd AFTER UPDATE ON users BEGIN
+        INSERT INTO changes (tbl, key) VALUES ('users', OLD.username);
+        INSERT INTO changes (tbl, key) SELECT 'users', NEW.username WHERE NEW.username != OLD.username; END;
+    CREATE TRIGGER users_changed_del AFTER DELETE ON users BEGIN
+        INSERT INTO changes (tbl, key) VALUES ('users', OLD.username); END;
+    CREATE TRIGGER items_changed_ins AFTER INSERT ON items BEGIN
+        INSERT INTO changes (tbl, key) VALUES ('items', NEW.id); END;
+    CREATE TRIGGER items_changed_upd AFTER UPDATE ON items BEGIN
+        INSERT INTO changes (tbl, key) VALUES ('items', NEW.id); END;
+    CREATE TRIGGER items_changed_del AFTER DELETE ON items BEGIN
+        INSERT INTO changes (tbl, key) VALUES ('items', OLD.id); END;
+    CREATE TRIGGER tasks_changed_ins AFTER INSERT ON tasks BEGIN
+        INSERT INTO changes (tbl, key) VALUES ('tasks', NEW.username); END;
+    CREATE TRIGGER tasks_changed_upd AFTER UPDATE ON tasks BEGIN
+        INSERT INTO changes (tbl, key) VALUES ('tasks', NEW.username); END;
+    CREATE TRIGGER tasks_changed_del AFTER DELETE ON tasks BEGIN
+        INSERT INTO changes (tbl, key) VALUES ('tasks', OLD.username); END;
+    -- بنحتفظ بآخر 100 ألف تغيير بس
+    CREATE TRIGGER changes_prune AFTER INSERT ON changes WHEN NEW.seq % 1000 = 0 BEGIN
+        DELETE FROM changes WHERE seq <= NEW.seq - 100000; END;
+    """,
+    """
+    CREATE TABLE login_state (
+        username_lower TEXT PRIMARY KEY,
+        failed INTEGER NOT NULL DEFAULT 0,
+        lock_until INTEGER NOT NULL DEFAULT 0
+    );
+    """,
+    # صفحات الأدمن: أعمدة محسوبة (VIRTUAL) من الـ JSON عليها فهارس للفلترة والترتيب
+    """
+    ALTER TABLE users ADD COLUMN xp INTEGER GENERATED ALWAYS AS (CAST(COALESCE(json_extract(data, '$.xp'), 0) AS INTEGER)) VIRTUAL;
+    ALTER TABLE users ADD COLUMN rank TEXT GENERATED ALWAYS AS (json_extract(data, '$.rank')) VIRTUAL;
+    ALTER TABLE users ADD COLUMN blocked INTEGER GENERATED ALWAYS AS (COALESCE(json_extract(data, '$.blocked'), 0) != 0) VIRTUAL;
+    ALTER TABLE users ADD COLUMN mining INTEGER GENERATED ALWAYS AS (COALESCE(json_extract(data, '$.mining'), 0) != 0) VIRTUAL;
+    CREATE INDEX users_xp ON users(xp DESC, username);
+    CREATE INDEX users_rank ON users(rank, balance DESC, username);
+    CREATE INDEX users_blocked ON users(blocked, balance DESC, username);
+    ALTER TABLE items ADD COLUMN store_id INTEGER GENERATED ALWAYS AS (json_extract(data, '$.store_id')) VIRTUAL;
+    CREATE INDEX items_owner_lower_id ON items(owner_lower, id);
+    CREATE INDEX items_store_id ON items(store_id, id);
+    """,
+    # عدد المستخدمين للصفحة الرئيسية: عداد بيتحدث مع كل INSERT/DELETE بدل COUNT(*)
+    # (الـ upsert على صف موجود UPDATE مش INSERT، والـ rename UPDATE → العدد ما بيتغيرش)
+    """
+    CREATE TABLE counters (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    );
+    INSERT INTO counters (name, value) SELECT 'users', COUNT(*) FROM users;
+    CREATE TRIGGER users_count_ins AFTER INSERT ON users BEGIN
+        UPDATE counters SET value = value + 1 WHERE name = 'users'; END;
+    CREATE TRIGGER users_count_del AFTER DELETE ON users BEGIN
+        UPDATE counters SET value = value - 1 WHERE name = 'users'; END;
+    """,
+    # هوية القاعدة (عشوائية لكل ملف) في الـ snapshot: قاعدة اتعملت من جديد ما تتلخبطش مع القديمة
+    """
+    CREATE TABLE meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    INSERT INTO meta (key, value) VALUES ('db_id', lower(hex(randomblob(16))));
+    """,
+    # الـ scheduler بيقرا المستخدمين اللي بيعدّنوا بس بالترتيب من غير ما يعدي على الجدول كله
+    """
+    CREATE INDEX users_mining ON users(mining, username);
+    """,
+]
+
+
+class SqliteStorage(_UserLockMixin):
+    # اتصالات من pool صغير بدل اتصال لكل thread: مع gevent الـ threading.local بيبقى
+    # لكل greenlet، فكل طلب كان بيفتح اتصال جديد. الاتصال بيتستلف للعملية أو المعاملة
+    # وبيرجع بعدها؛ النداءات المتداخلة في نفس الـ thread/greenlet (contextvar) بتستخدم نفس الاتصال
+    name = "sqlite"
+    indexed = True
+
+    def __init__(self, path, pool_size=SQLITE_POOL_SIZE):
+        self.path = path
+        self.pool_size = max(1, pool_size)
+        self._idle = []
+        self._idle_lock = threading.Lock()
+        self._held = contextvars.ContextVar("sqlite_conn", default=None)
+        self._migrate()
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        held = self._held.get()
+        if held is not None:
+            yield held
+            return
+        with self._idle_lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = self._open()
+        token = self._held.set(conn)
+        try:
+            yield conn
+        finally:
+            self._held.reset(token)
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            # أكتر من pool_size (ضغط لحظي) → الاتصال الزيادة بيتقفل
+            with self._idle_lock:
+                if len(self._idle) < self.pool_size:
+                    self._idle.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+
+    def _query(self, sql, args=()):
+        with self._connection() as conn:
+            return conn.execute(sql, args).fetchall()
+
+    def _query_one(self, sql, args=()):
+        with self._connection() as conn:
+            return conn.execute(sql, args).fetchone()
+
+    def _run(self, sql, args=()):
+        with self._connection() as conn:
+            conn.execute(sql, args)
+
+    def _migrate(self):
+        with self._connection() as conn:
+            # WAL بيتسجل في ملف القاعدة نفسه → مرة واحدة مش مع كل اتصال
+            conn.execute("PRAGMA journal_mode=WAL")
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for n, script in enumerate(SCHEMA[version:], start=version + 1):
+                conn.executescript("BEGIN IMMEDIATE;" + script + f"PRAGMA user_version={n}; COMMIT;")
+
+    def is_empty(self):
+        return self._query_one("SELECT NOT EXISTS (SELECT 1 FROM users)")[0] == 1
+
+    def identity(self):
+        return self._query_one("SELECT value FROM meta WHERE key='db_id'")[0]
+
+    def change_marker(self):
+        row = self._query_one("SELECT seq FROM sqlite_sequence WHERE name='changes'")
+        return row[0] if row else 0
+
+    def changes_since(self, marker):
+        with self._connection() as conn:
+            # marker بعد آخر تغيير → مش من القاعدة دي (اتعملت من جديد) → إعادة تحميل كاملة
+            row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name='changes'").fetchone()
+            if marker > (row[0] if row else 0):
+                return None
+            rows = conn.execute("SELECT seq, tbl, key FROM changes WHERE seq > ? ORDER BY seq", (marker,)).fetchall()
+            # لو السجل اتقص قبل ما نلحقه → إعادة تحميل كاملة
+            if marker and (not rows or rows[0][0] != marker + 1):
+                first = conn.execute("SELECT MIN(seq) FROM changes").fetchone()[0]
+                if first is None or first > marker + 1:
+                    return None
+        return rows
+
+    @contextmanager
+    def transaction(self):
+        # المعاملات المتداخلة بتنضم للمعاملة الخارجية (نفس الاتصال)
+        with self._connection() as conn:
+            outer = not conn.in_transaction
+            if outer:
+                conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self
+            except:
+                if outer:
+                    conn.execute("ROLLBACK")
+                raise
+            else:
+                if outer:
+                    conn.execute("COMMIT")
+
+    # users
+    def load_users(self):
+        return [json.loads(r[0]) for r in self._query("SELECT data FROM users ORDER BY rowid")]
+
+    def save_users(self, users):
+        with self.transaction(), self._connection() as conn:
+            keep = [u.get("username", "").strip() for u in users]
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS _keep (k TEXT PRIMARY KEY)")
+            conn.execute("DELETE FROM _keep")
+            conn.executemany("INSERT OR IGNORE INTO _keep VALUES (?)", [(k,) for k in keep])
+            conn.execute("DELETE FROM users WHERE username NOT IN (SELECT k FROM _keep)")
+            for u in users:
+                self._upsert_user(u)
+
+    def get_user(self, username):
+        row = self._query_one("SELECT data FROM users WHERE username=?", (username,))
+        return json.loads(row[0]) if row else None
+
+    def get_user_ci(self, username):
+        row = self._query_one("SELECT data FROM users WHERE username_lower=? ORDER BY rowid LIMIT 1",
+                              (username.strip().lower(),))
+        return json.loads(row[0]) if row else None
+
+    def _upsert_user(self, user):
+        username = user.get("username", "").strip()
+        self._run(
+            "INSERT INTO users (username, username_lower, balance, data) VALUES (?,?,?,?) "
+            "ON CONFLICT(username) DO UPDATE SET username_lower=excluded.username_lower, "
+            "balance=excluded.balance, data=excluded.data",
+            (username, username.lower(), _balance(user), _dumps(user)))
+
+    def put_user(self, user, old_username=None):
+        with self.transaction():
+            new = user.get("username", "").strip()
+            if old_username and old_username.strip() != new:
+                self._run("UPDATE users SET username=?, username_lower=? WHERE username=?",
+                          (new, new.lower(), old_username.strip()))
+                # القيود والأجهزة وحالة المهام بتتنقل مع الصف في نفس المعاملة
+                self._rename_rows(old_username.strip(), new)
+            self._upsert_user(user)
+
+    def _rename_rows(self, old, new):
+        self._run("UPDATE ledger SET username=? WHERE username=?", (new, old))
+        self._run("UPDATE items SET owner=?, owner_lower=?, data=json_set(data, '$.owner', ?) WHERE owner=?",
+                  (new, new.lower(), new, old))
+        # المهام بالاسم lowercase (task_key)، والقديمة ممكن تكون بالاسم زي ما هو
+        for src, dst in ((old.lower(), new.lower()), (old, new)):
+            if src != dst:
+                self._run("UPDATE OR REPLACE tasks SET username=? WHERE username=?", (dst, src))
+                # trigger التعديل بيسجل الاسم الجديد بس → الكاش في الـ workers التانية يشيل القديم
+                self._run("INSERT INTO changes (tbl, key) VALUES ('tasks', ?)", (src,))
+
+    def delete_user_ci(self, username):
+        self._run("DELETE FROM users WHERE username_lower=?", (username.strip().lower(),))
+
+    def _exclude_sql(self, exclude):
+        if not exclude:
+            return "", ()
+        return f" AND username NOT IN ({','.join('?' * len(exclude))})", tuple(exclude)
+
+    def leaderboard(self, offset=0, limit=None, exclude=()):
+        where, args = self._exclude_sql(exclude)
+        rows = self._query(
+            f"SELECT data FROM users WHERE 1=1{where} ORDER BY balance DESC, username LIMIT ? OFFSET ?",
+            args + (-1 if limit is None else limit, offset))
+        return [json.loads(r[0]) for r in rows]
+
+    def leaderboard_rank(self, username, exclude=()):
+        with self._connection() as conn:
+            row = conn.execute("SELECT balance FROM users WHERE username=?", (username,)).fetchone()
+            if not row:
+                return None
+            where, args = self._exclude_sql(exclude)
+            above = conn.execute(
+                f"SELECT COUNT(*) FROM users WHERE (balance > ? OR (balance = ? AND username < ?)){where}",
+                (row[0], row[0], username) + args).fetchone()[0]
+        return above + 1
+
+    def leaderboard_size(self, exclude=()):
+        where, args = self._exclude_sql(exclude)
+        return self._query_one(f"SELECT COUNT(*) FROM users WHERE 1=1{where}", args)[0]
+
+    def user_count(self, exclude=()):
+        # العداد (schema 7) ناقص المستبعدين الموجودين (بحث بالمفتاح)
+        with self._connection() as conn:
+            total = conn.execute("SELECT value FROM counters WHERE name='users'").fetchone()[0]
+            if exclude:
+                total -= conn.execute(
+                    f"SELECT COUNT(*) FROM users WHERE username IN ({','.join('?' * len(exclude))})",
+                    tuple(exclude)).fetchone()[0]
+        return total
+
+    _USER_ORDER = {"balance": "balance DESC, username", "xp": "xp DESC, username", "username": "username"}
+
+    def page_users(self, filters, sort="balance", after=None, limit=50):
+        where, args = [], []
+        for flag in ("blocked", "mining"):
+            if filters.get(flag) is not None:
+                where.append(f"{flag}=?")
+                args.append(int(filters[flag]))
+        if filters.get("rank"):
+            where.append("rank=?")
+            args.append(filters["rank"])
+        if filters.get("min_sats") is not None:
+            where.append("balance>=?")
+            args.append(filters["min_sats"])
+        if filters.get("max_sats") is not None:
+            where.append("balance<=?")
+            args.append(filters["max_sats"])
+        if after is not None:
+            # نفس ترتيب user_sort_key: (-balance, username) / (-xp, username) / (username,)
+            if sort == "username":
+                where.append("username > ?")
+                args.append(after[0])
+            else:
+                where.append(f"({sort} < ? OR ({sort} = ? AND username > ?))")
+                args += [-after[0], -after[0], after[1]]
+        sql = "SELECT data FROM users"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        rows = self._query(f"{sql} ORDER BY {self._USER_ORDER[sort]} LIMIT ?", args + [limit])
+        return [json.loads(r[0]) for r in rows]
+
+    # items
+    def load_items(self):
+        return [json.loads(r[0]) for r in self._query("SELECT data FROM items ORDER BY seq")]
+
+    def save_items(self, items):
+        with self.transaction(), self._connection() as conn:
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS _keep_items (k TEXT PRIMARY KEY)")
+            conn.execute("DELETE FROM _keep_items")
+            conn.executemany("INSERT OR IGNORE INTO _keep_items VALUES (?)",
+                             [(str(i.get("id")),) for i in items])
+            conn.execute("DELETE FROM items WHERE id NOT IN (SELECT k FROM _keep_items)")
+            for i in items:
+                self._upsert_item(i)
+
+    def get_item(self, item_id):
+        row = self._query_one("SELECT data FROM items WHERE id=?", (str(item_id),))
+        return json.loads(row[0]) if row else None
+
+    def items_by_owner(self, owner):
+        rows = self._query("SELECT data FROM items WHERE owner=? ORDER BY seq", (str(owner),))
+        return [json.loads(r[0]) for r in rows]
+
+    def items_by_owner_ci(self, owner):
+        rows = self._query("SELECT data FROM items WHERE owner_lower=? ORDER BY seq",
+                           (str(owner).strip().lower(),))
+        return [json.loads(r[0]) for r in rows]
+
+    def page_items(self, filters, after=None, limit=50):
+        where, args = [], []
+        if filters.get("owner"):
+            where.append("owner_lower=?")
+            args.append(filters["owner"].strip().lower())
+        if filters.get("store_id") is not None:
+            where.append("store_id=?")
+            args.append(filters["store_id"])
+        for flag in ("active", "power_on"):
+            if filters.get(flag) is not None:
+                where.append(f"(COALESCE(json_extract(data, '$.{flag}'), 0) != 0) = ?")
+                args.append(int(filters[flag]))
+        if after is not None:
+            where.append("id > ?")
+            args.append(after[0])
+        sql = "SELECT data FROM items"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        rows = self._query(f"{sql} ORDER BY id LIMIT ?", args + [limit])
+        return [json.loads(r[0]) for r in rows]
+
+    def _upsert_item(self, item):
+        owner = str(item.get("owner", ""))
+        self._run(
+            "INSERT INTO items (id, owner, owner_lower, data) VALUES (?,?,?,?) "
+            "ON CONFLICT(id) DO UPDATE SET owner=excluded.owner, owner_lower=excluded.owner_lower, data=excluded.data",
+            (str(item.get("id")), owner, owner.strip().lower(), _dumps(item)))
+
+    def put_item(self, item):
+        self._upsert_item(item)
+
+    def put_items(self, changed):
+        with self.transaction():
+            for i in changed:
+                self._upsert_item(i)
+
+    def delete_items_by_owner_ci(self, owner):
+        self._run("DELETE FROM items WHERE owner_lower=?", (owner.strip().lower(),))
+
+    # tasks
+    def load_tasks(self):
+        rows = self._query("SELECT username, data FROM tasks ORDER BY rowid")
+        return {r[0]: json.loads(r[1]) for r in rows}
+
+    def save_tasks(self, tasks):
+        with self.transaction(), self._connection() as conn:
+            conn.execute("DELETE FROM tasks")
+            conn.executemany("INSERT INTO tasks (username, data) VALUES (?,?)",
+                             [(k, _dumps(v)) for k, v in tasks.items()])
+
+    def get_tasks(self, username):
+        row = self._query_one("SELECT data FROM tasks WHERE username=?", (username,))
+        return json.loads(row[0]) if row else None
+
+    def put_tasks(self, username, user_tasks):
+        self._run(
+            "INSERT INTO tasks (username, data) VALUES (?,?) ON CONFLICT(username) DO UPDATE SET data=excluded.data",
+            (username, _dumps(user_tasks)))
+
+    def delete_tasks(self, username):
+        self._run("DELETE FROM tasks WHERE username=?", (username,))
+
+    # ledger
+    def append_ledger(self, entries):
+        with self._connection() as conn:
+            conn.executemany(
+                "INSERT INTO ledger (username, kind, sats, ts, ref) VALUES (?,?,?,?,?)",
+                [(e["username"], e["kind"], int(e["sats"]), int(e["ts"]), e.get("ref")) for e in entries])
+
+    def scan_ledger(self, batch=5000):
+        # دفعات بالمؤشر (seq): الاتصال بيرجع للـ pool بين الدفعات، والذاكرة ثابتة
+        after = 0
+        while True:
+            rows = self._query("SELECT seq, username, kind, sats, ts, ref FROM ledger WHERE seq > ? "
+                               "ORDER BY seq LIMIT ?", (after, batch))
+            for seq, username, kind, sats, ts, ref in rows:
+                yield {"username": username, "kind": kind, "sats": sats, "ts": ts, "ref": ref}
+            if len(rows) < batch:
+                return
+            after = rows[-1][0]
+
+    # login state
+    def get_login_state(self, username):
+        row = self._query_one("SELECT failed, lock_until FROM login_state WHERE username_lower=?",
+                              (username.strip().lower(),))
+        return {"failed": row[0], "lock_until": row[1]} if row else {"failed": 0, "lock_until": 0}
+
+    def login_failure(self, username, limit, lock_seconds, now):
+        with self.transaction():
+            state = _next_login_state(self.get_login_state(username), limit, lock_seconds, now)
+            self._run(
+                "INSERT INTO login_state (username_lower, failed, lock_until) VALUES (?,?,?) "
+                "ON CONFLICT(username_lower) DO UPDATE SET failed=excluded.failed, lock_until=excluded.lock_until",
+                (username.strip().lower(), state["failed"], state["lock_until"]))
+        return state
+
+    def clear_login_state(self, username):
+        self._run("DELETE FROM login_state WHERE username_lower=?", (username.strip().lower(),))
+
+
+# ---------- In-memory indexes (write-through) ----------
+# بيتحمل مرة واحدة عند التشغيل وبعدين بيتحدث مع كل تعديل
+# وأي كتابة بتروح للـ backend فورًا (write-through)
+_FETCH = object()   # سجل تغيير من غير بيانات → نقرا الصف من الـ backend
+_epochs = itertools.count(1)
+
+
+class CachedStorage:
+    def __init__(self, backend, snapshot=None, progress=None):
+        self.backend = backend
+        self.name = backend.name
+        self._lock = threading.RLock()
+        # المفاتيح اللي المعاملة الحالية (لكل thread/greenlet) عدّلتها في الكاش
+        self._touched = contextvars.ContextVar("cache_tx_touched", default=None)
+        self.progress = {} if progress is None else progress
+        if not (snapshot and self._load_snapshot(snapshot)):
+            self._load()
+
+    def __getattr__(self, attr):
+        # أي حاجة خاصة بالـ backend (path, is_empty, ...)
+        return getattr(self.backend, attr)
+
+    def _reset(self):
+        self._users = {}        # username → user
+        self._users_lower = {}  # lowercased username → [username, ...]
+        self._board = []        # قائمة مرتبة من (-balance, username)
+        self._items = {}        # item id → item
+        self._owned = {}        # owner → {item id: item}
+        self._owners_lower = {} # lowercased owner → {owner, ...}
+        self._tasks = {}        # username → TaskState
+        # نسخة بيانات كل مستخدم (صفه + أجهزته + مهامه) لكاش الصفحات في main:
+        # أي تعديل بيزودها، والتحميل الكامل أو استبدال جدول كامل بيغير الـ epoch
+        self._versions = {}     # lowercased username → عداد
+        self._epoch = next(_epochs)
+
+    def _add_page(self, kind, rows):
+        if kind == "users":
+            for u in rows:
+                self._index_user(User.from_dict(u))
+        elif kind == "items":
+            for i in rows:
+                self._index_item(Item.from_dict(i))
+        elif kind == "user_rows":
+            for u in rows:
+                self._index_user(User.from_row(u))
+        elif kind == "item_rows":
+            for i in rows:
+                self._index_item(Item.from_row(i))
+        elif kind == "tasks":
+            for k, v in rows:
+                self._tasks[k] = task_record(v)
+        self.progress["loaded"] = self.progress.get("loaded", 0) + len(rows)
+        # مع gevent: نسيب الـ hub يخدم طلبات بين الصفحات
+        time.sleep(0)
+
+    def _load(self):
+        with self._lock:
+            self._marker = self.backend.change_marker()
+            self._reset()
+            tables = (("users", self.backend.load_users()), ("items", self.backend.load_items()),
+                      ("tasks", list(self.backend.load_tasks().items())))
+            self.progress.update(source="backend", loaded=0, total=sum(len(rows) for _, rows in tables))
+            for kind, rows in tables:
+                for n in range(0, len(rows), SNAPSHOT_PAGE):
+                    self._add_page(kind, rows[n:n + SNAPSHOT_PAGE])
+
+    # ---------- Snapshot ----------
+    # header (marker بتاع الـ backend وقت الكتابة) + صفحات SNAPSHOT_PAGE صف بـ marshal
+    # كل بلوك مسبوق بطوله؛ صفوف المستخدمين والأجهزة columnar (قيم الـ slots بالترتيب)
+    # الصفحات بتتقري واحدة واحدة، وبعدها sync() بيلحق اللي اتغير بعد الـ marker
+    # (أو تحميل كامل لو سجل التغييرات مش مكفي). marshal لملفات محلية موثوقة بس
+    def _snapshot_header(self):
+        return {"format": SNAPSHOT_FORMAT, "python": tuple(sys.version_info[:2]),
+                "backend": self.backend.name, "source": _backend_source(self.backend),
+                "identity": self.backend.identity(),
+                "fields": (User.__slots__, Item.__slots__)}
+
+    def _load_snapshot(self, path):
+        try:
+            f = open(path, "rb")
+        except OSError:
+            return False
+        with f, self._lock:
+            try:
+                header = _read_block(f)
+                expected = self._snapshot_header()
+                if {k: header.get(k) for k in expected} != expected:
+                    return False
+                self._reset()
+                self.progress.update(source="snapshot", loaded=0, total=header["rows"])
+                for _ in range(header["pages"]):
+                    kind, rows = _read_block(f)
+                    self._add_page(kind, rows)
+                self._marker = header["marker"]
+            except (EOFError, ValueError, TypeError, KeyError, AttributeError):
+                return False
+        self.sync()
+        return True
+
+    def write_snapshot(self, path):
+        # المراجع بتتنسخ تحت القفل (السجلات نفسها مش بتتعدل في مكانها، بتتبدل)
+        with self._lock:
+            self.sync()
+            marker = self._marker
+            tables = (("users", list(self._users.values())), ("items", list(self._items.values())),
+                      ("tasks", list(self._tasks.items())))
+        pages = [(kind, rows[n:n + SNAPSHOT_PAGE]) for kind, rows in tables
+                 for n in range(0, len(rows), SNAPSHOT_PAGE)]
+        header = dict(self._snapshot_header(), marker=marker, pages=len(pages),
+                      rows=sum(len(rows) for _, rows in tables), created=int(time.time()))
+
+        def fill(f):
+            _write_block(f, header)
+            for kind, rows in pages:
+                if kind == "users":
+                    _write_block(f, ("user_rows", [u.to_row() for u in rows]))
+                elif kind == "items":
+                    _write_block(f, ("item_rows", [i.to_row() for i in rows]))
+                else:
+                    _write_block(f, (kind, [(k, task_value(v)) for k, v in rows]))
+
+        _atomic_replace(path, fill)
+        return header
+
+    def warmup_status(self):
+        return dict(self.progress, state="ready", ready=True)
+
+    def wait_ready(self, timeout=None):
+        return True
+
+    @contextmanager
+    def transaction(self):
+        # المتداخلة بتنضم للخارجية، والخارجية بس اللي بترجع الكاش لو وقعت
+        if self._touched.get() is not None:
+            with self.backend.transaction():
+                yield self
+            return
+        touched = set()
+        token = self._touched.set(touched)
+        try:
+            with self.backend.transaction():
+                yield self
+        except:
+            # الـ backend عمل rollback → نقرا من جديد الصفوف اللي المعاملة لمستها بس
+            self._restore(touched)
+            raise
+        finally:
+            self._touched.reset(token)
+
+    def _mark(self, tbl, key):
+        touched = self._touched.get()
+        if touched is not None:
+            touched.add((tbl, key))
+
+    def _restore(self, touched):
+        with self._lock:
+            if ("all", None) in touched:
+                # استبدال جدول كامل (save_users/save_items/save_tasks) → تحميل كامل
+                self._load()
+                return
+            for tbl, key in touched:
+                if tbl == "users":
+                    self._refresh_user(key)
+                elif tbl == "items":
+                    self._refresh_item(key)
+                elif tbl == "owner":
+                    for row in self.backend.items_by_owner_ci(key):
+                        self._put_item_model(Item.from_dict(row))
+                elif tbl == "tasks":
+                    self._refresh_tasks(key)
+
+    def sync(self):
+        # نلحق التعديلات اللي عملتها workers تانية (قراءة واحدة لو مفيش جديد)
+        marker = self.backend.change_marker()
+        if marker == self._marker:
+            return
+        changes = self.backend.changes_since(self._marker)
+        if changes is None:
+            self._load()
+            return
+        with self._lock:
+            # الصف الرابع (لو موجود) = البيانات الجديدة نفسها، فمش محتاجين نقرا الصف تاني
+            latest = {(c[1], c[2]): c[3] if len(c) > 3 else _FETCH for c in changes}
+            for (tbl, key), row in latest.items():
+                if tbl == "users":
+                    self._refresh_user(key)
+                elif tbl == "items":
+                    self._refresh_item(key, row)
+                elif tbl == "tasks":
+                    self._refresh_tasks(key)
+            self._marker = max(marker, changes[-1][0]) if changes else marker
+
+    def _refresh_user(self, username):
+        self._touch(username)
+        row = self.backend.get_user(username)
+        if row is None:
+            self._unindex_user(username)
+        else:
+            self._index_user(User.from_dict(row))
+
+    def _refresh_item(self, item_id, row=_FETCH):
+        if row is _FETCH:
+            row = self.backend.get_item(item_id)
+        if row is not None:
+            self._put_item_model(Item.from_dict(row))
+            return
+        old = self._items.pop(item_id, None)
+        if old is not None:
+            self._touch(old.get("owner", ""))
+            self._owned.get(str(old.get("owner", "")), {}).pop(item_id, None)
+
+    def _refresh_tasks(self, username):
+        self._touch(username)
+        row = self.backend.get_tasks(username)
+        if row is None:
+            self._tasks.pop(username, None)
+        else:
+            self._tasks[username] = task_record(row)
+
+    def _touch(self, username):
+        name = str(username).strip().lower()
+        self._versions[name] = self._versions.get(name, 0) + 1
+
+    def data_version(self, username):
+        return self._epoch, self._versions.get(username.strip().lower(), 0)
+
+    @contextmanager
+    def user_lock(self, username):
+        with self.backend.user_lock(username):
+            self.sync()
+            yield self
+
+    @contextmanager
+    def users_lock(self, usernames):
+        with self.backend.users_lock(usernames):
+            self.sync()
+            yield self
+
+    # users
+    def _index_user(self, user):
+        username = user.get("username", "").strip()
+        old = self._users.get(username)
+        if old is not None:
+            self._board_remove(old)
+        self._users[username] = user
+        bisect.insort(self._board, _board_key(user))
+        names = self._users_lower.setdefault(username.lower(), [])
+        if username not in names:
+            names.append(username)
+
+    def _board_remove(self, user):
+        key = _board_key(user)
+        n = bisect.bisect_left(self._board, key)
+        if n < len(self._board) and self._board[n] == key:
+            del self._board[n]
+
+    def _unindex_user(self, username):
+        old = self._users.pop(username, None)
+        if old is not None:
+            self._board_remove(old)
+        names = self._users_lower.get(username.lower(), [])
+        if username in names:
+            names.remove(username)
+        if not names:
+            self._users_lower.pop(username.lower(), None)
+
+    # السجلات جوه الكاش models؛ اللي بيطلع للكود dict جديد (نسخة)
+    # واللي بيتكتب في الـ backend نسخة مطبّعة
+    def load_users(self):
+        return [u.to_dict() for u in self._users.values()]
+
+    def save_users(self, users):
+        with self._lock:
+            self._mark("all", None)
+            models = [User.from_dict(u) for u in users]
+            self.backend.save_users([u.to_dict() for u in models])
+            self._users, self._users_lower, self._board = {}, {}, []
+            self._epoch = next(_epochs)
+            for u in models:
+                self._index_user(u)
+
+    def get_user(self, username):
+        user = self._users.get(username)
+        return user.to_dict() if user else None
+
+    def get_user_ci(self, username):
+        names = self._users_lower.get(username.strip().lower())
+        return self.get_user(names[0]) if names else None
+
+    def put_user(self, user, old_username=None):
+        with self._lock:
+            model = User.from_dict(user)
+            self._mark("users", model.username.strip())
+            if old_username:
+                self._mark("users", old_username.strip())
+            renamed = old_username and old_username.strip() != model.username.strip()
+            if renamed:
+                # الـ backend بينقل الأجهزة والمهام مع الاسم
+                old = old_username.strip()
+                self._mark("owner", old.lower())
+                task_keys = {old, old.lower(), model.username.strip(), model.username.strip().lower()}
+                for key in task_keys:
+                    self._mark("tasks", key)
+            self.backend.put_user(model.to_dict(), old_username=old_username)
+            if old_username:
+                self._unindex_user(old_username.strip())
+                self._touch(old_username)
+            self._index_user(model)
+            self._touch(model.username)
+            if renamed:
+                for row in self.backend.items_by_owner(model.username.strip()):
+                    self._put_item_model(Item.from_dict(row))
+                for key in task_keys:
+                    self._refresh_tasks(key)
+
+    def delete_user_ci(self, username):
+        with self._lock:
+            self.backend.delete_user_ci(username)
+            self._touch(username)
+            for name in list(self._users_lower.get(username.strip().lower(), [])):
+                self._mark("users", name)
+                self._unindex_user(name)
+
+    # leaderboard: بحث ثنائي على القائمة المرتبة بدل sort في كل طلب
+    def _excluded_positions(self, exclude):
+        return sorted(bisect.bisect_left(self._board, _board_key(self._users[name]))
+                      for name in exclude if name in self._users)
+
+    def leaderboard(self, offset=0, limit=None, exclude=()):
+        board, skip = self._board, self._excluded_positions(exclude)
+        # نحول offset المفلتر لمكانه في القائمة الكاملة
+        start = offset
+        for p in skip:
+            if p <= start:
+                start += 1
+        result = []
+        for n in range(start, len(board)):
+            if limit is not None and len(result) >= limit:
+                break
+            if n in skip:
+                continue
+            result.append(self.get_user(board[n][1]))
+        return result
+
+    def leaderboard_rank(self, username, exclude=()):
+        user = self._users.get(username)
+        if user is None or username in exclude:
+            return None
+        above = bisect.bisect_left(self._board, _board_key(user))
+        above -= sum(1 for p in self._excluded_positions(exclude) if p < above)
+        return above + 1
+
+    def leaderboard_size(self, exclude=()):
+        return len(self._board) - sum(1 for name in exclude if name in self._users)
+
+    def user_count(self, exclude=()):
+        # الفهرس نفسه هو العداد: بيتحدث مع كل تسجيل/حذف (ومع sync من الـ workers التانية)
+        return len(self._users) - sum(1 for name in exclude if name in self._users)
+
+    # صفحات الأدمن: الترتيب بالرصيد من غير فلتر = اللوحة نفسها؛ أي ترتيب أو فلتر تاني
+    # بيروح للـ backend لو عنده فهارس (SQLite، schema 6) بدل scan كامل للكاش في كل صفحة
+    def page_users(self, filters, sort="balance", after=None, limit=50):
+        if self.backend.indexed and (sort != "balance" or _has_filters(filters)):
+            return self.backend.page_users(filters, sort, after, limit)
+        if sort != "balance":
+            return [u.to_dict() for u in _scan_page(list(self._users.values()), user_matches,
+                                                     lambda u: user_sort_key(u, sort), filters, after, limit)]
+        # الترتيب بالرصيد هو نفس ترتيب اللوحة: نمشي عليها من بعد المؤشر
+        board, result = self._board, []
+        n = bisect.bisect_right(board, tuple(after)) if after is not None else 0
+        while n < len(board) and len(result) < limit:
+            user = self._users.get(board[n][1])
+            if user is not None and user_matches(user, filters):
+                result.append(user.to_dict())
+            n += 1
+        return result
+
+    # items
+    def _index_item(self, item):
+        item_id, owner = str(item.get("id")), str(item.get("owner", ""))
+        old = self._items.get(item_id)
+        if old is not None and str(old.get("owner", "")) != owner:
+            self._owned.get(str(old.get("owner", "")), {}).pop(item_id, None)
+        self._items[item_id] = item
+        self._owned.setdefault(owner, {})[item_id] = item
+        self._owners_lower.setdefault(owner.strip().lower(), set()).add(owner)
+
+    def _put_item_model(self, item):
+        # تعديل جهاز بيغير نسخة المالك (والمالك القديم لو الجهاز اتنقل)
+        old = self._items.get(str(item.get("id")))
+        if old is not None and old.owner != item.owner:
+            self._touch(old.owner)
+        self._touch(item.owner)
+        self._index_item(item)
+
+    def load_items(self):
+        return [i.to_dict() for i in self._items.values()]
+
+    def page_items(self, filters, after=None, limit=50):
+        if not filters.get("owner") and self.backend.indexed:
+            return self.backend.page_items(filters, after, limit)
+        if filters.get("owner"):
+            owners = self._owners_lower.get(filters["owner"].strip().lower(), ())
+            rows = [i for o in owners for i in self._owned.get(o, {}).values()]
+        else:
+            rows = list(self._items.values())
+        return [i.to_dict() for i in _scan_page(rows, item_matches, item_sort_key, filters, after, limit)]
+
+    def save_items(self, items):
+        with self._lock:
+            self._mark("all", None)
+            models = [Item.from_dict(i) for i in items]
+            self.backend.save_items([i.to_dict() for i in models])
+            self._items, self._owned, self._owners_lower = {}, {}, {}
+            self._epoch = next(_epochs)
+            for i in models:
+                self._index_item(i)
+
+    def get_item(self, item_id):
+        item = self._items.get(str(item_id))
+        return item.to_dict() if item else None
+
+    def items_by_owner(self, owner):
+        return [i.to_dict() for i in self._owned.get(str(owner), {}).values()]
+
+    def items_by_owner_ci(self, owner):
+        owners = self._owners_lower.get(str(owner).strip().lower(), ())
+        return [i.to_dict() for o in owners for i in self._owned.get(o, {}).values()]
+
+    def put_item(self, item):
+        with self._lock:
+            model = Item.from_dict(item)
+            self._mark("items", str(model.get("id")))
+            self.backend.put_item(model.to_dict())
+            self._put_item_model(model)
+
+    def put_items(self, changed):
+        with self._lock:
+            models = [Item.from_dict(i) for i in changed]
+            for i in models:
+                self._mark("items", str(i.get("id")))
+            self.backend.put_items([i.to_dict() for i in models])
+            for i in models:
+                self._put_item_model(i)
+
+    def delete_items_by_owner_ci(self, owner):
+        with self._lock:
+            self._mark("owner", owner.strip().lower())
+            self.backend.delete_items_by_owner_ci(owner)
+            self._touch(owner)
+            for o in self._owners_lower.pop(owner.strip().lower(), set()):
+                for item_id in self._owned.pop(o, {}):
+                    self._items.pop(item_id, None)
+
+    # tasks
+    def load_tasks(self):
+        return {k: task_value(v) for k, v in self._tasks.items()}
+
+    def save_tasks(self, tasks):
+        with self._lock:
+            self._mark("all", None)
+            models = {k: task_record(v) for k, v in tasks.items()}
+            self.backend.save_tasks({k: task_value(v) for k, v in models.items()})
+            self._tasks = models
+            self._epoch = next(_epochs)
+
+    def get_tasks(self, username):
+        user_tasks = self._tasks.get(username)
+        return task_value(user_tasks) if user_tasks is not None else None
+
+    def put_tasks(self, username, user_tasks):
+        with self._lock:
+            model = task_record(user_tasks)
+            self._mark("tasks", username)
+            self.backend.put_tasks(username, task_value(model))
+            self._tasks[username] = model
+            self._touch(username)
+
+    def delete_tasks(self, username):
+        with self._lock:
+            self._mark("tasks", username)
+            self.backend.delete_tasks(username)
+            self._tasks.pop(username, None)
+            self._touch(username)
+
+
+# ---------- تسخين الكاش في الخلفية ----------
+# الـ worker بيبدأ يرد فورًا: لحد ما الكاش يجهز كل النداءات بتروح للـ backend مباشرة
+# (نفس النتيجة، أبطأ بس)، وبعدها بتتحول للكاش. الكتابات اللي حصلت أثناء التحميل
+# بيلحقها sync() زي كتابات أي worker تاني
+def _write_block(f, obj):
+    data = marshal.dumps(obj)
+    f.write(len(data).to_bytes(8, "little"))
+    f.write(data)
+
+
+def _read_block(f):
+    # loads على bytes أسرع بكتير من marshal.load على الملف
+    size = int.from_bytes(f.read(8), "little")
+    data = f.read(size)
+    if len(data) != size:
+        raise EOFError("truncated snapshot")
+    return marshal.loads(data)
+
+
+def _backend_source(backend):
+    return os.path.abspath(getattr(backend, "path", None) or backend.users_file)
+
+
+class WarmingStorage:
+    def __init__(self, backend, snapshot=None):
+        self.backend = backend
+        self.name = backend.name
+        self.snapshot = snapshot
+        self.cache = None
+        self.progress = {"state": "loading", "loaded": 0, "total": None}
+        self._started = time.time()
+        self._ready = threading.Event()
+        threading.Thread(target=self._warm, name="cache-warmup", daemon=True).start()
+
+    def __getattr__(self, attr):
+        return getattr(self.cache if self.cache is not None else self.backend, attr)
+
+    def _warm(self):
+        try:
+            cache = CachedStorage(self.backend, self.snapshot, self.progress)
+        except Exception as e:
+            # الـ backend لوحده شغال؛ /ready بيفضل 503 عشان حد يبص
+            self.progress.update(state="failed", error=repr(e))
+            return
+        self.cache = cache
+        self.progress.update(state="ready", seconds=round(time.time() - self._started, 3))
+        self._ready.set()
+        refresh_snapshot(cache, self.snapshot)
+
+    def warmup_status(self):
+        status = dict(self.progress, ready=self._ready.is_set())
+        if not status["ready"]:
+            status["seconds"] = round(time.time() - self._started, 3)
+        return status
+
+    def wait_ready(self, timeout=None):
+        return self._ready.wait(timeout)
+
+
+def refresh_snapshot(cache, path):
+    # اتحمّل من الـ backend (مفيش snapshot أو كان قديم) → نكتب واحد للتشغيل الجاي
+    if path and cache.progress.get("source") != "snapshot":
+        try:
+            cache.write_snapshot(path)
+        except OSError:
+            pass
+
+
+def warmup_status(db):
+    status = getattr(db, "warmup_status", None)
+    return status() if status else {"state": "ready", "ready": True}
+
+
+# ---------- عداد عمليات التخزين لكل طلب ----------
+READ_OPS = {"load_users", "get_user", "get_user_ci", "leaderboard", "leaderboard_rank",
+            "leaderboard_size", "user_count", "load_items", "get_item",
+            "items_by_owner", "items_by_owner_ci", "load_tasks", "get_tasks", "scan_ledger",
+            "get_login_state", "page_users", "page_items"}
+WRITE_OPS = {"save_users", "put_user", "delete_user_ci", "save_items", "put_item", "put_items",
+             "delete_items_by_owner_ci", "save_tasks", "put_tasks", "delete_tasks", "append_ledger",
+             "login_failure", "clear_login_state", "compact_items"}
+
+_op_counts = contextvars.ContextVar("storage_op_counts", default=None)
+_tx_depth = contextvars.ContextVar("storage_tx_depth", default=0)
+
+def reset_op_counts():
+    counts = {"reads": 0, "writes": 0, "commits": 0}
+    _op_counts.set(counts)
+    return counts
+
+def op_counts():
+    return _op_counts.get() or {"reads": 0, "writes": 0, "commits": 0}
+
+def _count(kind):
+    counts = _op_counts.get()
+    if counts is not None:
+        counts[kind] += 1
+
+# metrics.py بيسجل هنا دالة (op, seconds) لما القياسات تكون شغالة
+_op_observer = None
+
+def set_op_observer(observer):
+    global _op_observer
+    _op_observer = observer
+
+
+class CountingStorage:
+    # غلاف خارجي بيعد القراءات والكتابات والمعاملات للطلب الحالي
+    def __init__(self, inner):
+        self.inner = inner
+        self.name = inner.name
+
+    def __getattr__(self, attr):
+        value = getattr(self.inner, attr)
+        if attr in READ_OPS:
+            kind = "reads"
+        elif attr in WRITE_OPS:
+            kind = "writes"
+        else:
+            return value
+
+        def counted(*args, **kwargs):
+            _count(kind)
+            observer = _op_observer
+            if observer is None:
+                return value(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return value(*args, **kwargs)
+            finally:
+                observer(attr, time.perf_counter() - started)
+        return counted
+
+    @contextmanager
+    def transaction(self):
+        # المعاملات المتداخلة commit واحد (الخارجية بس)
+        depth = _tx_depth.get()
+        token = _tx_depth.set(depth + 1)
+        try:
+            with self.inner.transaction():
+                yield self
+        finally:
+            _tx_depth.reset(token)
+        if depth == 0:
+            _count("commits")
+
+
+# ---------- Import / export ----------
+def import_json(db, users_file, items_file, tasks_file):
+    src = JsonStorage(users_file, items_file, tasks_file)
+    users, items, tasks = src.load_users(), src.load_items(), src.load_tasks()
+
+    # ids المكررة (نفس الملي ثانية) بتاخد لاحقة عشان العمود UNIQUE
+    seen = set()
+    for i in items:
+        item_id = str(i.get("id"))
+        n = 1
+        while item_id in seen:
+            item_id = f"{i.get('id')}_{n}"
+            n += 1
+        i["id"] = item_id
+        seen.add(item_id)
+
+    with db.transaction():
+        db.save_users(users)
+        db.save_items(items)
+        db.save_tasks(tasks)
+    return len(users), len(items), len(tasks)
+
+
+def export_json(db, users_file, items_file, tasks_file):
+    dst = JsonStorage(users_file, items_file, tasks_file)
+    users, items, tasks = db.load_users(), db.load_items(), db.load_tasks()
+    dst.save_users(users)
+    dst.save_items(items)
+    dst.save_tasks(tasks)
+    return len(users), len(items), len(tasks)
+
+
+def open_storage(users_file, items_file, tasks_file):
+    if STORAGE_BACKEND == "json":
+        db = JsonStorage(users_file, items_file, tasks_file)
+    else:
+        is_new = not os.path.exists(DB_FILE)
+        db = SqliteStorage(DB_FILE)
+        # أول تشغيل: نستورد ملفات JSON الموجودة تلقائيًا
+        if is_new and db.is_empty() and os.path.exists(users_file):
+            import_json(db, users_file, items_file, tasks_file)
+    if STORAGE_CACHE:
+        if STORAGE_WARMUP == "background":
+            db = WarmingStorage(db, SNAPSHOT_FILE)
+        else:
+            db = CachedStorage(db, SNAPSHOT_FILE)
+            refresh_snapshot(db, SNAPSHOT_FILE)
+    return CountingStorage(db)
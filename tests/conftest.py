@@ -0,0 +1,52 @@
+# conftest.py - كل الاختبارات على ملفات في مجلد مؤقت
+# main بيفتح التخزين وقت الـ import، فالإعدادات والمجلد لازم يتظبطوا قبل أي import له
+import os, sys, tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix="mining-tests-")
+
+sys.path.insert(0, ROOT)
+os.chdir(WORKDIR)
+os.environ.update({
+    "DB_FILE": os.path.join(WORKDIR, "data.db"),
+    "LOCK_DIR": os.path.join(WORKDIR, ".locks"),
+    "STORAGE_SNAPSHOT": "",
+    "STORAGE_WARMUP": "sync",
+    "MINING_SCHEDULER": "0",
+})
+
+
+# ---------- Helpers ----------
+# main بيتعمله import جوه الدوال (بعد ما الإعدادات فوق اتظبطت)
+def client_for(username):
+    import main
+    main.app.config["WTF_CSRF_ENABLED"] = False
+    client = main.app.test_client()
+    with client.session_transaction() as s:
+        s["user"] = username
+    return client
+
+
+def register(username, sats):
+    # مستخدم جديد برصيد sats بالظبط (عن طريق قيد تعديل زي الأدمن)
+    import main
+    main.app.config["WTF_CSRF_ENABLED"] = False
+    main.app.test_client().post("/register", data={"username": username, "password": "pw"})
+    with main.db.user_lock(username):
+        user = main.find_user(username)
+        main.post_ledger(user, sats - main.user_sats(user), "admin_adjustment", "test")
+        main.update_user(user)
+
+
+def reconcile():
+    import main
+    result = main.app.test_cli_runner().invoke(args=["reconcile-ledger"])
+    assert result.exit_code == 0, result.output
+    return result.output
+
+
+def ledger_totals(db):
+    totals = {}
+    for e in db.scan_ledger():
+        totals[e["username"]] = totals.get(e["username"], 0) + int(e["sats"])
+    return totals
@@ -0,0 +1,22 @@
+# test_asgi.py - الـ nginx بيوجّه للـ sidecar نفس المسارات اللي asgi.py بيخدمها بالظبط
+import os
+import re
+
+import asgi
+from conftest import ROOT
+
+
+def sidecar_paths():
+    with open(os.path.join(ROOT, "deploy", "nginx.conf.template"), encoding="utf-8") as f:
+        conf = f.read()
+    return re.compile(re.search(r"location ~ (\S+) \{\s*proxy_set_header Connection \"\";\s*proxy_pass http://async_api;",
+                                conf).group(1))
+
+
+def test_nginx_routes_match_sidecar_routes():
+    pattern = sidecar_paths()
+    for path in list(asgi.ROUTES) + ["/complete_task/first_login"]:
+        assert pattern.match(path), path
+        assert asgi.resolve(path)[0] is not None
+    for path in ("/", "/dashboard", "/complete_task/", "/complete_task/a/b", "/mining_tick/x", "/stream"):
+        assert not pattern.match(path), path
@@ -0,0 +1,14 @@
+# test_auth.py - rate limit الدخول: عنوان الـ proxy الداخلي ما يبقاش bucket واحد لكل المستخدمين
+import auth
+
+
+def test_proxy_address_does_not_share_one_ip_bucket():
+    for n in range(auth.LOGIN_MAX_PER_IP + 5):
+        assert auth.check_rate(f"proxied{n}", "10.1.2.3") == 0
+        assert auth.check_rate(f"local{n}", "127.0.0.1") == 0
+
+
+def test_public_address_is_limited():
+    for n in range(auth.LOGIN_MAX_PER_IP):
+        assert auth.check_rate(f"public{n}", "1.2.3.4") == 0
+    assert auth.check_rate("public-last", "1.2.3.4") > 0
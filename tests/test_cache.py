@@ -0,0 +1,37 @@
+# test_cache.py - كاش الذاكرة: معاملة وقعت بترجع الصفوف اللي لمستها بس من الـ backend
+import pytest
+
+import storage
+
+
+@pytest.fixture
+def cache(tmp_path):
+    backend = storage.SqliteStorage(str(tmp_path / "cache.db"))
+    cache = storage.CachedStorage(backend)
+    cache.put_user({"username": "bob", "balance_sats": 5})
+    cache.put_items([{"id": "a", "owner": "bob"}])
+    return cache
+
+
+def test_rollback_restores_touched_rows_without_full_load(cache, monkeypatch):
+    monkeypatch.setattr(cache, "_load", lambda: pytest.fail("full reload"))
+    with pytest.raises(ValueError):
+        with cache.transaction():
+            cache.put_user({"username": "bob", "balance_sats": 99})
+            cache.put_items([{"id": "b", "owner": "bob"}])
+            cache.delete_items_by_owner_ci("BOB")
+            cache.put_tasks("bob", {"done": 1, "days": {}})
+            raise ValueError("bad request")
+    assert cache.get_user("bob")["balance_sats"] == 5
+    assert [i["id"] for i in cache.items_by_owner("bob")] == ["a"]
+    assert cache.get_tasks("bob") is None
+
+
+def test_inner_failure_caught_by_outer_commits(cache):
+    with cache.transaction():
+        with pytest.raises(KeyError):
+            with cache.transaction():
+                cache.put_user({"username": "bob", "balance_sats": 7})
+                raise KeyError("handled")
+    assert cache.get_user("bob")["balance_sats"] == 7
+    assert cache.backend.get_user("bob")["balance_sats"] == 7
@@ -0,0 +1,41 @@
+# test_journal.py - items.journal: إعادة التشغيل والدمج، وسطر ناقص في الآخر ما يبلعش اللي بعده
+import os
+
+import storage
+
+
+def open_json(tmp_path):
+    return storage.JsonStorage(str(tmp_path / "users.json"), str(tmp_path / "items.json"),
+                               str(tmp_path / "tasks.json"))
+
+
+# ---------- items.journal ----------
+def test_journal_replay_and_compaction(tmp_path):
+    db = open_json(tmp_path)
+    db.save_items([{"id": "a", "owner": "Ann"}, {"id": "b", "owner": "bob"}])
+    db.put_items([{"id": "c", "owner": "ann"}, {"id": "b", "owner": "bob", "active": True}])
+    db.delete_items_by_owner_ci("ANN")
+    db.put_item({"id": "d", "owner": "ann"})
+    # سطر ناقص من كتابة اتقطعت بيتجاهل
+    with open(db.items_journal, "ab") as f:
+        f.write(b'{"p": {"id": "e"')
+
+    expected = [{"id": "b", "owner": "bob", "active": True}, {"id": "d", "owner": "ann"}]
+    assert sorted(db.load_items(), key=lambda i: i["id"]) == expected
+    assert db.compact_items() == 4
+    assert os.path.getsize(db.items_journal) == 0
+    assert sorted(db.load_items(), key=lambda i: i["id"]) == expected
+
+
+def test_append_after_torn_tail(tmp_path):
+    db = open_json(tmp_path)
+    db.save_items([{"id": "a", "owner": "ann"}])
+    db.put_item({"id": "b", "owner": "ann"})
+    marker = db.change_marker()
+    with open(db.items_journal, "ab") as f:
+        f.write(b'{"p": {"id": "e"')
+    db.put_item({"id": "f", "owner": "ann"})
+
+    assert [i["id"] for i in sorted(db.load_items(), key=lambda i: i["id"])] == ["a", "b", "f"]
+    changes = db.changes_since(marker)
+    assert changes is not None and [c[1:3] for c in changes] == [("items", "f")]
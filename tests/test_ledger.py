@@ -0,0 +1,55 @@
+# test_ledger.py - ثوابت الرصيد والقيود: مجموع القيود = balance_sats بعد تغيير الاسم
+import catalog
+import main
+import storage
+from conftest import client_for, ledger_totals, reconcile, register
+
+
+# ---------- Rename ----------
+def test_rename_keeps_ledger_with_user():
+    register("renamer", 40)
+    client = client_for("renamer")
+    client.get("/dashboard")   # مكافآت المهام = قيود جديدة بالاسم القديم
+    response = client.post("/settings", data={"username": "renamer2", "password": "pw",
+                                              "currency": "bitcoin", "theme": "light"})
+    assert response.status_code == 302
+
+    main.db.sync()
+    user = main.find_user("renamer2")
+    totals = ledger_totals(main.db)
+    assert main.find_user("renamer") is None
+    assert "renamer" not in totals
+    assert totals["renamer2"] == main.user_sats(user)
+    output = reconcile()
+    assert "MISMATCH" not in output
+    assert " 0 mismatched, 0 deleted users with history" in output
+
+
+def test_rename_moves_devices_and_tasks():
+    register("Mover", catalog.tier(1).price_sats)
+    client = client_for("Mover")
+    client.get("/dashboard")
+    client.get("/buy_item/1")
+    rewarded = main.user_sats(main.find_user("Mover"))
+    name = "Mover"
+    for n in range(3):
+        new = f"Mover{n}"
+        client.post("/settings", data={"username": new, "password": "pw", "currency": "bitcoin", "theme": "light"})
+        client.get("/dashboard")   # first_login ما تتحسبش تاني بعد تغيير الاسم
+        main.db.sync()
+        assert len(main.get_user_items(new)) == 1
+        assert main.get_user_items(name) == []
+        assert main.user_sats(main.find_user(new)) == rewarded
+        name = new
+    assert "MISMATCH" not in reconcile()
+
+
+def test_json_rename_moves_ledger(tmp_path):
+    db = storage.JsonStorage(str(tmp_path / "users.json"), str(tmp_path / "items.json"),
+                             str(tmp_path / "tasks.json"))
+    db.put_user({"username": "bob", "balance_sats": 18})
+    db.append_ledger([{"username": "bob", "kind": "signup_bonus", "sats": 12, "ts": 0},
+                      {"username": "other", "kind": "signup_bonus", "sats": 3, "ts": 0},
+                      {"username": "bob", "kind": "task_reward", "sats": 6, "ts": 0}])
+    db.put_user({"username": "bob2", "balance_sats": 18}, old_username="bob")
+    assert ledger_totals(db) == {"bob2": 18, "other": 3}
@@ -0,0 +1,80 @@
+# test_locks.py - قفل المستخدم بين العمليات: الشراء المتزامن من أكتر من worker ما بيصرفش
+# أكتر من الرصيد، والـ stripe المقفول في عملية تانية بيتستنى من غير flock بيوقف الـ thread
+import os, subprocess, sys, textwrap, time
+
+import catalog
+import main
+import storage
+from conftest import ROOT, WORKDIR, ledger_totals, reconcile, register
+
+
+# ---------- Concurrent purchases (أكتر من عملية) ----------
+BUYER = textwrap.dedent("""
+    import sys
+    sys.path.insert(0, {root!r})
+    import main
+    client = main.app.test_client()
+    with client.session_transaction() as s:
+        s["user"] = {user!r}
+    for _ in range({attempts}):
+        client.get("/buy_item/{tier}")
+""")
+
+
+def test_concurrent_purchases_never_overspend():
+    tier, fits, procs, attempts = catalog.tier(2), 7, 4, 5
+    register("buyer", tier.price_sats * fits)
+
+    script = BUYER.format(root=ROOT, user="buyer", attempts=attempts, tier=tier.id)
+    workers = [subprocess.Popen([sys.executable, "-c", script], cwd=WORKDIR, env=os.environ.copy())
+               for _ in range(procs)]
+    assert all(w.wait(timeout=120) == 0 for w in workers)
+
+    main.db.sync()
+    user = main.find_user("buyer")
+    assert len(main.get_user_items("buyer")) == fits
+    assert main.user_sats(user) == 0
+    assert ledger_totals(main.db)["buyer"] == 0
+    assert "MISMATCH" not in reconcile()
+
+
+def test_striped_lock_excludes_other_processes(tmp_path):
+    locks = storage.StripedLock(str(tmp_path), 4)
+    probe = textwrap.dedent(f"""
+        import fcntl, sys
+        sys.path.insert(0, {ROOT!r})
+        import storage
+        locks = storage.StripedLock({str(tmp_path)!r}, 4)
+        path = {str(tmp_path)!r} + "/user-%d.lock" % locks._stripe("alice")
+        with open(path, "a+") as f:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                sys.exit(3)
+    """)
+    with locks("alice"):
+        held = subprocess.run([sys.executable, "-c", probe]).returncode
+    free = subprocess.run([sys.executable, "-c", probe]).returncode
+    assert (held, free) == (3, 0)
+
+
+
+def test_busy_stripe_waits_with_sleep_not_blocking_flock(tmp_path, monkeypatch):
+    # عملية تانية ماسكة الـ stripe 0.3 ثانية: إحنا بنستنى بـ LOCK_NB + time.sleep
+    locks = storage.StripedLock(str(tmp_path), 1)
+    holder = subprocess.Popen([sys.executable, "-c", textwrap.dedent(f"""
+        import sys, time
+        sys.path.insert(0, {ROOT!r})
+        import storage
+        with storage.StripedLock({str(tmp_path)!r}, 1)("x"):
+            print("held", flush=True)
+            time.sleep(0.3)
+    """)], stdout=subprocess.PIPE, text=True)
+    assert holder.stdout.readline().strip() == "held"
+    sleeps = []
+    real_sleep = time.sleep
+    monkeypatch.setattr(storage.time, "sleep", lambda s: (sleeps.append(s), real_sleep(s)))
+    with locks("x"):
+        pass
+    holder.wait(timeout=10)
+    assert sleeps
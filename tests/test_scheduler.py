@@ -0,0 +1,46 @@
+# test_scheduler.py - الـ scheduler بيقفل شوية stripes في المعاملة (مش أغلب الـ 256)،
+# وبيقرا المستخدمين اللي بيعدّنوا من الفهرس، وعملية واحدة بس بتشغله
+import time
+
+import main
+import storage
+from conftest import register
+
+
+def start_mining(username, anchor):
+    with main.db.user_lock(username):
+        user = main.find_user(username)
+        user.update(mining=True, mining_rate=1.0, mining_anchor=anchor, mining_carry=0.0)
+        main.update_user(user)
+
+
+def test_settle_holds_few_stripes_per_transaction(monkeypatch):
+    now = int(time.time())
+    names = [f"miner{n}" for n in range(40)]
+    for name in names:
+        register(name, 0)
+        start_mining(name, now - 600)
+
+    held = []
+    users_lock = main.db.users_lock
+    def spy(usernames):
+        held.append(len({storage.user_locks()._stripe(u) for u in usernames}))
+        return users_lock(usernames)
+    monkeypatch.setattr(main.db, "users_lock", spy)
+
+    scheduler = main.MiningScheduler(cadence=300, stripes=4)
+    scheduler.load(now)
+    assert set(names) <= set(scheduler.due)
+    assert scheduler.settle_batches(names, now) == len(names)
+    assert held and max(held) <= 4
+    assert all(main.user_sats(main.find_user(n)) == 600 for n in names)
+
+
+def test_only_one_scheduler_holds_the_lock():
+    first = storage.try_lock_file("scheduler-test")
+    assert first is not None
+    assert storage.try_lock_file("scheduler-test") is None
+    first.close()
+    second = storage.try_lock_file("scheduler-test")
+    assert second is not None
+    second.close()
@@ -0,0 +1,46 @@
+# test_unit_of_work.py - الطلب تحت قفل المستخدم بيكتب في معاملة واحدة (أو مفيش خالص لو وقع)
+import pytest
+
+import catalog
+import main
+from conftest import client_for, ledger_totals, reconcile, register
+
+
+def ops(response):
+    return dict(kv.split("=") for kv in response.headers["X-Storage-Ops"].split())
+
+
+def test_purchase_is_one_commit():
+    tier = catalog.tier(1)
+    register("unit", tier.price_sats * 3)
+    client = client_for("unit")
+    client.get("/dashboard")
+    response = client.get(f"/buy_item/{tier.id}?qty=2")
+    assert response.status_code == 302
+    assert ops(response)["commits"] == "1"
+    assert len(main.get_user_items("unit")) == 2
+    assert "MISMATCH" not in reconcile()
+
+
+def test_failed_unit_writes_nothing():
+    register("rollback", 30)
+    before = main.find_user("rollback")
+    with pytest.raises(RuntimeError), main.app.test_request_context():
+        with main.user_unit("rollback"):
+            user = main.find_user("rollback")
+            assert main.find_user("rollback") is user
+            main.post_ledger(user, 5, "admin_adjustment", "test")
+            main.update_user(user)
+            raise RuntimeError("abort")
+    assert main.find_user("rollback") == before
+    assert ledger_totals(main.db)["rollback"] == 30
+
+
+def test_task_for_mixed_case_user_is_one_commit():
+    register("Alice", 0)
+    response = client_for("Alice").get("/complete_task/first_login")
+    assert response.get_json()["ok"]
+    assert ops(response)["commits"] == "1"
+    state = main.load_task_state("Alice")
+    assert state.is_done(catalog.task_for("first_login").slot)
+    assert "MISMATCH" not in reconcile()